@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+"""
+Compares the throughput of the vectorized ColumnOperations functions with the previous row by row implementation.
+
+Usage, from the examples/python folder:
+    python benchmark/bench_columnoperations.py --rows 200000 --bundle_size 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add Generated folder, the shared ssecommon package and the plugin folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+sys.path.append(PARENT_DIR)
+sys.path.append(os.path.join(PARENT_DIR, 'columnoperations'))
+
+import numpy
+import ServerSideExtension_pb2 as SSE
+from columnoperations.__main__ import ExtensionService
+from ssecommon.aggregation import Sum
+
+_MINFLOAT = float('-inf')
+
+
+class _Context:
+    """
+    Minimal stand-in for the grpc context passed to the functions.
+    """
+
+    @staticmethod
+    def invocation_metadata():
+        return ()
+
+    @staticmethod
+    def send_initial_metadata(md):
+        pass
+
+
+# Row by row implementations the functions were previously built on, used as reference
+
+
+def _sum_of_rows_rowwise(request, context):
+    for request_rows in request:
+        response_rows = []
+        for row in request_rows.rows:
+            params = [d.numData for d in row.duals]
+            result = sum(params)
+            duals = iter([SSE.Dual(numData=result)])
+            response_rows.append(SSE.Row(duals=duals))
+        yield SSE.BundledRows(rows=response_rows)
+
+
+def _sum_of_column_rowwise(request, context):
+    params = []
+    for request_rows in request:
+        for row in request_rows.rows:
+            param = [d.numData for d in row.duals][0]
+            params.append(param)
+    result = sum(params)
+    duals = iter([SSE.Dual(numData=result)])
+    yield SSE.BundledRows(rows=[SSE.Row(duals=duals)])
+
+
+def _max_of_columns_2_rowwise(request, context):
+    result = [_MINFLOAT] * 2
+    for request_rows in request:
+        for row in request_rows.rows:
+            for i in range(0, len(row.duals)):
+                result[i] = max(result[i], row.duals[i].numData)
+    duals = iter([SSE.Dual(numData=r) for r in result])
+    yield SSE.BundledRows(rows=[SSE.Row(duals=duals)])
+
+
+def make_bundles(rows, columns, bundle_size):
+    """
+    Creates a request of random numerical values.
+    :param rows: total number of rows
+    :param columns: number of columns per row
+    :param bundle_size: number of rows per BundledRows message
+    :return: list of BundledRows
+    """
+    values = numpy.random.rand(rows, columns).tolist()
+    bundles = []
+    for start in range(0, rows, bundle_size):
+        bundle = SSE.BundledRows()
+        for row in values[start:start + bundle_size]:
+            bundle.rows.add().duals.extend([SSE.Dual(numData=v) for v in row])
+        bundles.append(bundle)
+    return bundles
+
+
+def measure(function, bundles, repeat):
+    """
+    :return: best wall time, in seconds, of running the function over the whole request
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in function(iter(bundles), _Context()):
+            pass
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--bundle_size', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [
+        ('SumOfRows', 2, _sum_of_rows_rowwise, ExtensionService._sum_of_rows),
+        ('SumOfColumn', 1, _sum_of_column_rowwise, Sum(data_types=[SSE.NUMERIC])),
+        ('MaxOfColumns_2', 2, _max_of_columns_2_rowwise, ExtensionService._max_of_columns_2),
+    ]
+
+    print('{:<16}{:>16}{:>16}{:>10}'.format('function', 'row wise rows/s', 'columnar rows/s', 'speedup'))
+    for name, columns, reference, vectorized in cases:
+        bundles = make_bundles(args.rows, columns, args.bundle_size)
+        before = measure(reference, bundles, args.repeat)
+        after = measure(vectorized, bundles, args.repeat)
+        print('{:<16}{:>16.0f}{:>16.0f}{:>9.1f}x'.format(name, args.rows / before, args.rows / after, before / after))
@@ -0,0 +1,93 @@
+#! /usr/bin/env python3
+"""
+Compares the throughput of the HelloWorld functions sending the received bundles back as they are with the previous
+implementation, which parsed each bundle into messages and serialized the response again. The time of the request
+deserializer and the response serializer is included, as in the plugin.
+
+Usage, from the examples/python folder:
+    python benchmark/bench_passthrough.py --rows 200000 --bundle_size 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+# Add Generated folder, the shared ssecommon package and the plugin folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+sys.path.append(PARENT_DIR)
+sys.path.append(os.path.join(PARENT_DIR, 'helloworld'))
+
+import ServerSideExtension_pb2 as SSE
+from helloworld.__main__ import ExtensionService
+from ssecommon.wire import ReceivedRows, serialize_response
+
+"""
+Implementations the functions were previously built on, used as reference.
+"""
+
+
+def _hello_world_parsed(request, context):
+    for request_rows in request:
+        yield request_rows
+
+
+def _echo_table_parsed(request, context):
+    for request_rows in request:
+        response_rows = []
+        for row in request_rows.rows:
+            response_rows.append(row)
+        yield SSE.BundledRows(rows=response_rows)
+
+
+def make_request(rows, columns, bundle_size, distinct=100):
+    """
+    Creates a serialized request of string values.
+    :param rows: total number of rows
+    :param columns: number of columns per row
+    :param bundle_size: number of rows per BundledRows message
+    :param distinct: number of distinct values
+    :return: list of serialized BundledRows
+    """
+    request = []
+    for start in range(0, rows, bundle_size):
+        bundle = SSE.BundledRows()
+        for i in range(start, min(start + bundle_size, rows)):
+            bundle.rows.add().duals.extend([SSE.Dual(strData='value {}'.format((i + c) % distinct))
+                                            for c in range(columns)])
+        request.append(bundle.SerializeToString())
+    return request
+
+
+def measure(function, request, deserializer, repeat):
+    """
+    :return: best wall time, in seconds, of deserializing the request, running the function and serializing the
+    response
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for response in function(map(deserializer, request), None):
+            serialize_response(response)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--bundle_size', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    cases = [
+        ('HelloWorld', 1, _hello_world_parsed, ExtensionService._hello_world),
+        ('EchoTable_3', 3, _echo_table_parsed, ExtensionService._echo_table),
+    ]
+
+    print('{:<16}{:>16}{:>20}{:>10}'.format('function', 'parsed rows/s', 'passthrough rows/s', 'speedup'))
+    for name, columns, reference, passthrough in cases:
+        request = make_request(args.rows, columns, args.bundle_size)
+        before = measure(reference, request, SSE.BundledRows.FromString, args.repeat)
+        after = measure(passthrough, request, ReceivedRows, args.repeat)
+        print('{:<16}{:>16.0f}{:>20.0f}{:>9.0f}x'.format(name, args.rows / before, args.rows / after, before / after))
@@ -0,0 +1,303 @@
+#! /usr/bin/env python3
+"""
+End-to-end load generator for the example plugins.
+
+Starts the plugins as subprocesses, or uses plugins already running, and drives them over gRPC with synthetic
+BundledRows streams from a number of concurrent streams. The throughput in rows per second and the latency
+percentiles of each scenario are reported as JSON, and optionally compared with a stored baseline.
+
+Usage, from the examples/python folder:
+    python benchmark/loadgen.py --rows 100000 --bundle_size 2000 --streams 8 --output results.json
+    python benchmark/loadgen.py --scenario SumOfRows --baseline results.json
+    python benchmark/loadgen.py --plugin_args=--aio --scenario HelloWorld
+"""
+import argparse
+import json
+import os
+import platform
+import shlex
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import grpc
+import numpy
+import ServerSideExtension_pb2 as SSE
+
+# A call to a plugin: the ExecuteFunction function id, or the EvaluateScript script and function type
+Scenario = namedtuple('Scenario', ['name', 'plugin', 'port', 'param_types', 'function_id', 'script', 'function_type'])
+
+_TYPE_CODES = {'N': SSE.NUMERIC, 'S': SSE.STRING, 'D': SSE.DUAL}
+
+SCENARIOS = [
+    Scenario('HelloWorld', 'helloworld', 50052, 'S', 0, None, None),
+    Scenario('HelloWorldAggr', 'helloworld', 50052, 'S', 1, None, None),
+    Scenario('Cache', 'helloworld', 50052, 'S', 2, None, None),
+    Scenario('EchoTable_3', 'helloworld', 50052, 'SSS', 4, None, None),
+    Scenario('SumOfRows', 'columnoperations', 50053, 'NN', 0, None, None),
+    Scenario('SumOfColumn', 'columnoperations', 50053, 'N', 1, None, None),
+    Scenario('MaxOfColumns_2', 'columnoperations', 50053, 'NN', 2, None, None),
+    # The scripts disable the plugin's result cache, so that every call is evaluated
+    Scenario('ScriptEvalTensor', 'fullscriptsupport', 50051, 'N', None,
+             '[a * 2 for a in args[0]]  # qlik-cache: no-store', SSE.TENSOR),
+    Scenario('ScriptAggr', 'fullscriptsupport', 50051, 'N', None, 'sum(args[0])  # qlik-cache: no-store',
+             SSE.AGGREGATION),
+    Scenario('PandasTensor', 'fullscriptsupport_pandas', 50056, 'NN', None, 'qResult = q.p0 + q.p1', SSE.TENSOR),
+]
+
+
+def make_request(param_types, rows, bundle_size, distinct, seed):
+    """
+    Creates a synthetic request.
+    :param param_types: string with one character per parameter, N for numeric, S for string and D for dual
+    :param rows: number of rows
+    :param bundle_size: number of rows per BundledRows message
+    :param distinct: number of distinct string values
+    :param seed: seed of the random values
+    :return: list of BundledRows
+    """
+    random = numpy.random.RandomState(seed)
+    vocabulary = ['value {}'.format(i) for i in range(distinct)]
+    columns = []
+    for code in param_types:
+        numbers = random.rand(rows).tolist()
+        strings = [vocabulary[i] for i in random.randint(0, distinct, rows).tolist()]
+        if code == 'N':
+            columns.append([{'numData': n} for n in numbers])
+        elif code == 'S':
+            columns.append([{'strData': s} for s in strings])
+        else:
+            columns.append([{'numData': n, 'strData': s} for n, s in zip(numbers, strings)])
+
+    bundles = []
+    for start in range(0, rows, bundle_size):
+        bundle = SSE.BundledRows()
+        for row_cells in zip(*(column[start:start + bundle_size] for column in columns)):
+            duals = bundle.rows.add().duals
+            for cell in row_cells:
+                duals.add(**cell)
+        bundles.append(bundle)
+    return bundles
+
+
+def make_metadata(scenario, rows):
+    """
+    :return: the metadata Qlik sends with a call of the scenario
+    """
+    metadata = [('qlik-commonrequestheader-bin',
+                 SSE.CommonRequestHeader(appId='loadgen', userId='loadgen', cardinality=rows).SerializeToString())]
+    if scenario.script is None:
+        header = SSE.FunctionRequestHeader(functionId=scenario.function_id, version='1')
+        metadata.append(('qlik-functionrequestheader-bin', header.SerializeToString()))
+    else:
+        params = [SSE.Parameter(dataType=_TYPE_CODES[code], name='p{}'.format(i))
+                  for i, code in enumerate(scenario.param_types)]
+        header = SSE.ScriptRequestHeader(script=scenario.script, functionType=scenario.function_type,
+                                         returnType=SSE.NUMERIC, params=params)
+        metadata.append(('qlik-scriptrequestheader-bin', header.SerializeToString()))
+    return tuple(metadata)
+
+
+def _is_serving(port, timeout=0.5):
+    channel = grpc.insecure_channel('localhost:{}'.format(port))
+    try:
+        grpc.channel_ready_future(channel).result(timeout=timeout)
+        return True
+    except grpc.FutureTimeoutError:
+        return False
+    finally:
+        channel.close()
+
+
+def start_plugin(plugin, port, plugin_args, timeout=30):
+    """
+    Starts a plugin as a subprocess and waits until it accepts calls.
+    :return: the subprocess.Popen of the plugin
+    """
+    if _is_serving(port):
+        # gRPC servers reuse the port on Linux, the calls would be spread over both servers
+        raise RuntimeError('A server is already running on port {}, stop it or use --no_start'.format(port))
+
+    command = [sys.executable, plugin + '/', '--port', str(port)] + plugin_args
+    process = subprocess.Popen(command, cwd=PARENT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    channel = grpc.insecure_channel('localhost:{}'.format(port))
+    try:
+        grpc.channel_ready_future(channel).result(timeout=timeout)
+    except grpc.FutureTimeoutError:
+        process.kill()
+        raise RuntimeError('{} did not start on port {}'.format(plugin, port))
+    finally:
+        channel.close()
+    return process
+
+
+def percentile(values, q):
+    return float(numpy.percentile(values, q)) if values else None
+
+
+def run_scenario(scenario, rows, bundle_size, streams, calls, distinct, warm_up=1):
+    """
+    Drives a plugin with concurrent streams.
+    :param scenario: the Scenario to run
+    :param rows: rows per call
+    :param bundle_size: rows per BundledRows message
+    :param streams: number of concurrent streams
+    :param calls: number of calls per stream
+    :param distinct: number of distinct string values
+    :param warm_up: number of calls per stream before the measurement
+    :return: dict of the results
+    """
+    channel = grpc.insecure_channel('localhost:{}'.format(scenario.port),
+                                    options=[('grpc.max_receive_message_length', -1)])
+    stub = SSE.ConnectorStub(channel)
+    method = stub.ExecuteFunction if scenario.script is None else stub.EvaluateScript
+    metadata = make_metadata(scenario, rows)
+    # One request per stream, with different data so that no result is reused across the streams
+    requests = [make_request(scenario.param_types, rows, bundle_size, distinct, seed) for seed in range(streams)]
+
+    latencies = []
+    first_responses = []
+    errors = []
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(streams + 1)
+
+    def stream(request):
+        try:
+            for _ in range(warm_up):
+                for _ in method(iter(request), metadata=metadata):
+                    pass
+        except grpc.RpcError as e:
+            with lock:
+                errors.append(str(e.code()))
+        finally:
+            # Start measuring when all streams are warmed up
+            start_barrier.wait()
+        for _ in range(calls):
+            start = time.perf_counter()
+            first = None
+            try:
+                for _ in method(iter(request), metadata=metadata):
+                    if first is None:
+                        first = time.perf_counter() - start
+            except grpc.RpcError as e:
+                with lock:
+                    errors.append(str(e.code()))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                first_responses.append(first)
+
+    threads = [threading.Thread(target=stream, args=(request,)) for request in requests]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    channel.close()
+
+    return {
+        'plugin': scenario.plugin,
+        'calls': len(latencies),
+        'errors': len(errors),
+        'rows_per_sec': rows * len(latencies) / elapsed,
+        'p50_ms': _ms(percentile(latencies, 50)),
+        'p95_ms': _ms(percentile(latencies, 95)),
+        'p99_ms': _ms(percentile(latencies, 99)),
+        'first_response_p50_ms': _ms(percentile([f for f in first_responses if f is not None], 50)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares results with a baseline.
+    :param results: the scenario results of this run
+    :param baseline: the scenario results of the baseline run
+    :param tolerance: relative change accepted before a change is reported as a regression
+    :return: tuple of a dict of the relative changes per scenario, and the list of regressed scenarios
+    """
+    changes = {}
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base or not base['rows_per_sec'] or not base['p95_ms']:
+            continue
+        throughput = result['rows_per_sec'] / base['rows_per_sec'] - 1
+        p95 = result['p95_ms'] / base['p95_ms'] - 1 if result['p95_ms'] is not None else None
+        changes[name] = {'rows_per_sec': throughput, 'p95_ms': p95}
+        if throughput < -tolerance or (p95 is not None and p95 > tolerance):
+            regressions.append(name)
+    return changes, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenario', action='append', choices=[s.name for s in SCENARIOS],
+                        help='scenario to run, may be repeated. Default: all')
+    parser.add_argument('--rows', type=int, default=20000, help='rows per call')
+    parser.add_argument('--bundle_size', type=int, default=2000, help='rows per BundledRows message')
+    parser.add_argument('--streams', type=int, default=4, help='number of concurrent streams')
+    parser.add_argument('--calls', type=int, default=5, help='calls per stream')
+    parser.add_argument('--distinct', type=int, default=100, help='number of distinct string values')
+    parser.add_argument('--no_start', action='store_true', help='use plugins already running on their ports')
+    parser.add_argument('--plugin_args', default='', help='arguments passed to the started plugins, e.g. --aio')
+    parser.add_argument('--output', nargs='?', help='file to write the JSON report to. Default: standard output')
+    parser.add_argument('--baseline', nargs='?', help='JSON report of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change reported as a regression')
+    args = parser.parse_args(argv)
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or s.name in args.scenario]
+    processes = {}
+    results = {}
+    try:
+        for scenario in scenarios:
+            if not args.no_start and scenario.plugin not in processes:
+                processes[scenario.plugin] = start_plugin(scenario.plugin, scenario.port,
+                                                          shlex.split(args.plugin_args))
+            results[scenario.name] = run_scenario(scenario, args.rows, args.bundle_size, args.streams, args.calls,
+                                                  args.distinct)
+            print('{:<18}{:>14.0f} rows/s  p50 {:>8.1f} ms  p99 {:>8.1f} ms'
+                  .format(scenario.name, results[scenario.name]['rows_per_sec'],
+                          results[scenario.name]['p50_ms'] or 0, results[scenario.name]['p99_ms'] or 0),
+                  file=sys.stderr)
+    finally:
+        for process in processes.values():
+            process.terminate()
+            process.wait()
+
+    report = {
+        'config': {'rows': args.rows, 'bundle_size': args.bundle_size, 'streams': args.streams, 'calls': args.calls,
+                   'distinct': args.distinct, 'plugin_args': args.plugin_args, 'python': platform.python_version(),
+                   'grpcio': grpc.__version__},
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['comparison'], regressions = compare(results, baseline['results'], args.tolerance)
+        report['regressions'] = regressions
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,45 @@
 #! /usr/bin/env python3
 import argparse
-import json
 import logging
 import logging.config
 import os
 import sys
-import time
-from concurrent import futures
 
 # Add Generated folder to module path.
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+# Add the folder of the shared ssecommon package to module path.
+sys.path.append(PARENT_DIR)
 
 import ServerSideExtension_pb2 as SSE
 import grpc
+import numpy
 from scripteval import ScriptEval
+from ssecommon import prefork, serving
+from ssecommon.accounting import Quotas
+from ssecommon.aggregation import Sum
+from ssecommon.capabilities import CapabilitiesCache
+from ssecommon.columnar import decode_numeric_bundle
+from ssecommon.registry import registry, sse_function
+from ssecommon.wire import serialize_columns
 from ssedata import FunctionType
 
-_ONE_DAY_IN_SECONDS = 60 * 60 * 24
 _MINFLOAT = float('-inf')
 
 
+@sse_function('Normalize', SSE.TENSOR, {'col1': SSE.NUMERIC}, SSE.NUMERIC, function_id=3)
+def normalize(col1):
+    """
+    Standardizes a column to a mean of 0 and a standard deviation of 1. Tensor function, called once with all rows.
+    :param col1: float64 array with the values of the parameter
+    :return: the standardized values, NaN for missing values and for a column without variance
+    """
+    if not len(col1):
+        return col1
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return (col1 - numpy.nanmean(col1)) / numpy.nanstd(col1)
+
+
 class ExtensionService(SSE.ConnectorServicer):
     """
     A simple SSE-plugin created for the Column Operations example.
@@ -38,6 +57,14 @@ class ExtensionService(SSE.ConnectorServicer):
         logging.config.fileConfig(log_file)
         logging.info('Logging enabled')
 
+        # The function definitions are validated and compiled once, and again when the file is changed
+        implementations = {func_id: getattr(self, name) if isinstance(name, str) else name
+                           for func_id, name in self.functions.items()}
+        # Functions defined with the @sse_function decorator are added to those of the file
+        self._capabilities = CapabilitiesCache(funcdef_file, implementations, 'Column Operations - Qlik', 'v1.1.0',
+                                               registry=registry)
+        self._capabilities.watch()
+
     @property
     def function_definitions(self):
         """
@@ -48,11 +75,13 @@ class ExtensionService(SSE.ConnectorServicer):
     @property
     def functions(self):
         """
-        :return: Mapping of function id and implementation
+        :return: Mapping of function id and the name of the implementing method, or the Aggregator class of an
+        aggregation
         """
         return {
             0: '_sum_of_rows',
-            1: '_sum_of_column',
+            # SumOfColumn, summed bundle by bundle keeping only the partial sum in memory
+            1: Sum,
             2: '_max_of_columns_2'
         }
 
@@ -61,61 +90,38 @@ class ExtensionService(SSE.ConnectorServicer):
     """
 
     @staticmethod
-    def _sum_of_rows(request, context):
+    def _decode_numbers(request_rows, context):
         """
-        Summarize two parameters row wise. Tensor function.
-        :param request: an iterable sequence of RowData
-        :param context:
-        :return: the same iterable sequence of row data as received
+        :param request_rows: a bundle of rows with numerical values only
+        :param context: the context, of which the status is set if the bundle cannot be decoded
+        :return: float64 array of shape (rows, columns), see decode_numeric_bundle
         """
-        # Iterate over bundled rows
-        for request_rows in request:
-            response_rows = []
-            # Iterating over rows
-            for row in request_rows.rows:
-                # Retrieve the numerical value of the parameters
-                # Two columns are sent from the client, hence the length of params will be 2
-                params = [d.numData for d in row.duals]
-
-                # Sum over each row
-                result = sum(params)
-
-                # Create an iterable of Dual with a numerical value
-                duals = iter([SSE.Dual(numData=result)])
-
-                # Append the row data constructed to response_rows
-                response_rows.append(SSE.Row(duals=duals))
-
-            # Yield Row data as Bundled rows
-            yield SSE.BundledRows(rows=response_rows)
+        try:
+            return decode_numeric_bundle(request_rows)
+        except ValueError as e:
+            # Make sure the error handling, including logging, works as intended in the client
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            # Raise error on the plugin-side
+            raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, str(e))
 
     @staticmethod
-    def _sum_of_column(request, context):
+    def _sum_of_rows(request, context):
         """
-        Summarize the column sent as a parameter. Aggregation function.
+        Summarize two parameters row wise. Tensor function.
         :param request: an iterable sequence of RowData
         :param context:
-        :return: int, sum if column
+        :return: the same iterable sequence of row data as received
         """
-        params = []
-
-        # Iterate over bundled rows
+        # Iterate over bundled rows, decoded to a numerical array with one column per parameter
         for request_rows in request:
-            # Iterating over rows
-            for row in request_rows.rows:
-                # Retrieve numerical value of parameter and append to the params variable
-                # Length of param is 1 since one column is received, the [0] collects the first value in the list
-                param = [d.numData for d in row.duals][0]
-                params.append(param)
+            params = ExtensionService._decode_numbers(request_rows, context)
 
-        # Sum all rows collected the the params variable
-        result = sum(params)
+            # Sum over each row, for all rows in the bundle at once
+            result = params.sum(axis=1)
 
-        # Create an iterable of dual with numerical value
-        duals = iter([SSE.Dual(numData=result)])
-
-        # Yield the row data constructed
-        yield SSE.BundledRows(rows=[SSE.Row(duals=duals)])
+            # Yield the row data of the bundle as Bundled rows, serialized directly from the array
+            yield serialize_columns([result])
 
     @staticmethod
     def _max_of_columns_2(request, context):
@@ -126,19 +132,19 @@ class ExtensionService(SSE.ConnectorServicer):
         :return: a table with numerical values, two columns and one row
         """
 
-        result = [_MINFLOAT]*2
+        result = numpy.full(2, _MINFLOAT)
 
-        # Iterate over bundled rows
+        # Iterate over bundled rows, decoded to a numerical array with one column per parameter
         for request_rows in request:
-            # Iterating over rows
-            for row in request_rows.rows:
-                # Retrieve the numerical value of each parameter
-                # and update the result variable if it's higher than the previously saved value
-                for i in range(0, len(row.duals)):
-                    result[i] = max(result[i], row.duals[i].numData)
+            params = ExtensionService._decode_numbers(request_rows, context)
+
+            if params.size:
+                # Find the max of each column in the bundle and update the result variable if it's higher than the
+                # previously saved value. fmax ignores missing values (NaN) in the same way as comparing with max()
+                result = numpy.fmax(result, numpy.fmax.reduce(params[:, :2], axis=0))
 
         # Create an iterable of dual with numerical value
-        duals = iter([SSE.Dual(numData=r) for r in result])
+        duals = iter([SSE.Dual(numData=r) for r in result.tolist()])
 
         # Set and send Table header
         table = SSE.TableDescription(name='MaxOfColumns', numberOfRows=1)
@@ -179,31 +185,8 @@ class ExtensionService(SSE.ConnectorServicer):
         """
         logging.info('GetCapabilities')
 
-        # Create an instance of the Capabilities grpc message
-        # Enable(or disable) script evaluation
-        # Set values for pluginIdentifier and pluginVersion
-        capabilities = SSE.Capabilities(allowScript=True,
-                                        pluginIdentifier='Column Operations - Qlik',
-                                        pluginVersion='v1.1.0')
-
-        # If user defined functions supported, add the definitions to the message
-        with open(self.function_definitions) as json_file:
-            # Iterate over each function definition and add data to the Capabilities grpc message
-            for definition in json.load(json_file)['Functions']:
-                function = capabilities.functions.add()
-                function.name = definition['Name']
-                function.functionId = definition['Id']
-                function.functionType = definition['Type']
-                function.returnType = definition['ReturnType']
-
-                # Retrieve name and type of each parameter
-                for param_name, param_type in sorted(definition['Params'].items()):
-                    function.params.add(name=param_name, dataType=param_type)
-
-                logging.info('Adding to capabilities: {}({})'.format(function.name,
-                                                                     [p.name for p in function.params]))
-
-        return capabilities
+        # Built from the function definitions at startup, and rebuilt by the watcher when the file changes
+        return self._capabilities.capabilities
 
     def ExecuteFunction(self, request_iterator, context):
         """
@@ -216,7 +199,16 @@ class ExtensionService(SSE.ConnectorServicer):
         func_id = self._get_function_id(context)
         logging.info('ExecuteFunction (functionId: {})'.format(func_id))
 
-        return getattr(self, self.functions[func_id])(request_iterator, context)
+        function = self._capabilities.get_function(func_id)
+        if function is None:
+            # Make sure the error handling, including logging, works as intended in the client
+            msg = 'Function id {} is not defined in this plugin.'.format(func_id)
+            context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+            context.set_details(msg)
+            # Raise error on the plugin-side
+            raise grpc.RpcError(grpc.StatusCode.UNIMPLEMENTED, msg)
+
+        return function(request_iterator, context)
 
     def EvaluateScript(self, request, context):
         """
@@ -225,17 +217,13 @@ class ExtensionService(SSE.ConnectorServicer):
         :param context:
         :return:
         """
-        # Retrieve header from request
-        metadata = dict(context.invocation_metadata())
-        header = SSE.ScriptRequestHeader()
-        header.ParseFromString(metadata['qlik-scriptrequestheader-bin'])
-
-        # Retrieve function type
-        func_type = self.scriptEval.get_func_type(header)
+        # Retrieve the plan of the script header, parsed and analyzed once per distinct header
+        plan = self.scriptEval.plans.get_from_context(context)
+        func_type = plan.func_type
 
         # Verify function type
         if (func_type == FunctionType.Tensor) or (func_type == FunctionType.Aggregation):
-            return self.scriptEval.EvaluateScript(request, context, header, func_type)
+            return self.scriptEval.EvaluateScript(request, context, plan)
         else:
             # This plugin does not support other function types than tensor and aggregation.
             # Make sure the error handling, including logging, works as intended in the client
@@ -249,49 +237,44 @@ class ExtensionService(SSE.ConnectorServicer):
     Implementation of the Server connecting to gRPC.
     """
 
-    def Serve(self, port, pem_dir):
+    def Serve(self, port, pem_dir, aio=False, metrics_port=None, reuse_port=False, quotas=None):
         """
-        Server
+        Sets up the gRPC Server and runs it until the plugin is interrupted, see ssecommon.serving.
         :param port: port to listen on.
         :param pem_dir: Directory including certificates
+        :param aio: serve the streams with a grpc.aio server on an asyncio event loop instead of a thread each
+        :param metrics_port: port of the HTTP endpoint serving metrics of the calls, None to not record metrics
+        :param reuse_port: let the worker processes of ssecommon.prefork listen on the same port
+        :param quotas: ssecommon.accounting.Quotas limiting the calls of each Qlik app, None for no limits
         :return: None
         """
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-        SSE.add_ConnectorServicer_to_server(self, server)
-
-        if pem_dir:
-            # Secure connection
-            with open(os.path.join(pem_dir, 'sse_server_key.pem'), 'rb') as f:
-                private_key = f.read()
-            with open(os.path.join(pem_dir, 'sse_server_cert.pem'), 'rb') as f:
-                cert_chain = f.read()
-            with open(os.path.join(pem_dir, 'root_cert.pem'), 'rb') as f:
-                root_cert = f.read()
-            credentials = grpc.ssl_server_credentials([(private_key, cert_chain)], root_cert, True)
-            server.add_secure_port('[::]:{}'.format(port), credentials)
-            logging.info('*** Running server in secure mode on port: {} ***'.format(port))
-        else:
-            # Insecure connection
-            server.add_insecure_port('[::]:{}'.format(port))
-            logging.info('*** Running server in insecure mode on port: {} ***'.format(port))
-
-        server.start()
-        try:
-            while True:
-                time.sleep(_ONE_DAY_IN_SECONDS)
-        except KeyboardInterrupt:
-            server.stop(0)
+        serving.serve(self, port, pem_dir, aio, metrics_port, reuse_port, quotas)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', nargs='?', default='50053')
     parser.add_argument('--pem_dir', nargs='?')
+    parser.add_argument('--aio', action='store_true')
+    parser.add_argument('--metrics_port', nargs='?', type=int)
+    parser.add_argument('--app_max_calls', nargs='?', type=int)
+    parser.add_argument('--app_cpu_quota', nargs='?', type=float)
     parser.add_argument('--definition_file', nargs='?', default='functions.json')
+    parser.add_argument('--workers', nargs='?', type=int, default=1)
     args = parser.parse_args()
 
+    # Limits of the calls of each Qlik app, in calls in progress and in CPU seconds per minute
+    quotas = None
+    if args.app_max_calls is not None or args.app_cpu_quota is not None:
+        quotas = Quotas(max_calls=args.app_max_calls, cpu_seconds=args.app_cpu_quota)
+
     # need to locate the file when script is called from outside it's location dir.
     def_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.definition_file)
 
-    calc = ExtensionService(def_file)
-    calc.Serve(args.port, args.pem_dir)
+    if args.workers > 1:
+        # Each worker process creates the servicer, after the modules are loaded by the supervisor
+        prefork.serve(lambda: ExtensionService(def_file), args.workers, args.port, args.pem_dir, args.aio,
+                      args.metrics_port, quotas)
+    else:
+        calc = ExtensionService(def_file)
+        calc.Serve(args.port, args.pem_dir, args.aio, args.metrics_port, quotas=quotas)
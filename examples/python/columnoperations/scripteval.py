@@ -2,6 +2,7 @@ import logging
 import logging.config
 
 import grpc
+from ssecommon.callplan import CallPlan, CallPlanCache
 from ssedata import ArgType, ReturnType, FunctionType
 
 import ServerSideExtension_pb2 as SSE
@@ -12,30 +13,45 @@ class ScriptEval:
     Class for SSE plugin ScriptEval functionality.
     """
 
-    def EvaluateScript(self, request, context, header, func_type):
+    def __init__(self):
+        """
+        Class initializer.
+        """
+        # The call plans of the script headers sent from Qlik, each header is parsed and analyzed once
+        self.plans = CallPlanCache(self.build_plan)
+
+    def build_plan(self, header):
+        """
+        Determines the function, argument and return types of a script request.
+        :param header: the parsed ScriptRequestHeader
+        :return: a CallPlan
+        """
+        return CallPlan(header, self.get_func_type(header), self.get_arg_types(header), self.get_return_type(header))
+
+    def EvaluateScript(self, request, context, plan):
         """
         Evaluates script provided in the header, given the
         arguments provided in the sequence of RowData objects, the request.
 
         :param request: an iterable sequence of Row data.
         :param context: the context sent from client
-        :param header: header sent with request.
-        :param func_type: function type.
+        :param plan: the CallPlan of the header sent with request.
         :return: an iterable sequence of Row data.
         """
-        # Retrieve data types form header
-        arg_types = self.get_arg_types(header)
-        ret_type = self.get_return_type(header)
+        arg_types = plan.arg_types
+        ret_type = plan.ret_type
 
         logging.info('EvaluateScript: {} ({} {}) {}'
-                     .format(header.script, arg_types, ret_type, func_type))
+                     .format(plan.script, arg_types, ret_type, plan.func_type))
 
-        aggr = (func_type == FunctionType.Aggregation)
+        aggr = (plan.func_type == FunctionType.Aggregation)
 
         # Check if parameters are provided
-        if header.params:
+        if plan.header.params:
             # Verify argument type
             if arg_types == ArgType.Numeric:
+                # The numerical values of each row are extracted by the function prepared in the plan
+                extract_row = plan.extract_row
                 # Create an empty list if tensor function
                 if aggr:
                     all_rows = []
@@ -44,20 +60,19 @@ class ScriptEval:
                 for request_rows in request:
                     # Iterate over rows
                     for row in request_rows.rows:
-                        # Retrieve numerical data from duals
-                        params = self.get_arguments(context, arg_types, row.duals)
+                        params = extract_row(row.duals)
 
                         if aggr:
                             # Append value to list, for later aggregation
                             all_rows.append(params)
                         else:
                             # Evaluate script row wise
-                            yield self.evaluate(context, header.script, ret_type, params=params)
+                            yield self.evaluate(context, plan, params=params)
 
                 # Evaluate script based on data from all rows
                 if aggr:
                     params = [list(param) for param in zip(*all_rows)]
-                    yield self.evaluate(context, header.script, ret_type, params=params)
+                    yield self.evaluate(context, plan, params=params)
 
             else:
                 # This plugin does not support other argument types than numeric.
@@ -91,32 +106,6 @@ class ScriptEval:
         elif func_type == SSE.TENSOR:
             return FunctionType.Tensor
 
-    @staticmethod
-    def get_arguments(context, arg_types, duals):
-        """
-        Gets the array of arguments based on
-        the duals, and the type (string, numeric)
-        specified in the header.
-        :param context: the context sent from client
-        :param arg_types: argument types
-        :param duals: an iterable sequence of duals.
-        :return: list of numerical arguments
-        """
-
-        if arg_types == ArgType.Numeric:
-            # All parameters are of numeric type
-            script_args = [d.numData for d in duals]
-        else:
-            # This plugin does not support other arg types than numeric
-            # Make sure the error handling, including logging, works as intended in the client
-            msg = 'Argument type {} is not supported in this plugin.'.format(arg_types)
-            context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-            context.set_details(msg)
-            # Raise error on the plugin-side
-            raise grpc.RpcError(grpc.StatusCode.UNIMPLEMENTED, msg)
-
-        return script_args
-
     @staticmethod
     def get_arg_types(header):
         """
@@ -154,27 +143,26 @@ class ScriptEval:
             return ReturnType.Undefined
 
     @staticmethod
-    def evaluate(context, script, ret_type, params=[]):
+    def evaluate(context, plan, params=[]):
         """
         Evaluates a script with given params.
         :param context: the context sent from client
-        :param script:  script to evaluate
-        :param ret_type: return data type
+        :param plan: the CallPlan, with the compiled script and the return type
         :param params: params to evaluate. Default: []
         :return: a RowData of string dual
         """
-        if ret_type == ReturnType.Numeric:
-            # Evaluate script
-            result = eval(script, {'args': params})
+        if plan.ret_type == ReturnType.Numeric:
+            # Evaluate script, compiled once for the plan
+            result = eval(plan.code, {'args': params})
             # Transform the result to an iterable of dual data
-            duals = iter([SSE.Dual(numData=result)])
+            duals = iter([plan.encode(result)])
 
             # Create row data out of duals
             return SSE.BundledRows(rows=[SSE.Row(duals=duals)])
         else:
             # This plugin does not support other return types than numeric
             # Make sure the error handling, including logging, works as intended in the client
-            msg = 'Return type {} is not supported in this plugin.'.format(ret_type)
+            msg = 'Return type {} is not supported in this plugin.'.format(plan.ret_type)
             context.set_code(grpc.StatusCode.UNIMPLEMENTED)
             context.set_details(msg)
             # Raise error on the plugin-side
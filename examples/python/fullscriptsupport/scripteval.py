@@ -1,67 +1,140 @@
 import logging
 import logging.config
+import re
 
 import ServerSideExtension_pb2 as SSE
 import grpc
 import numpy
+from ssecommon.bundler import bundle_rows, encode_column
+from ssecommon.callplan import CallPlan, CallPlanCache, is_arrow_script
+from ssecommon.columnar import column_length, decode, decode_bundle, get_cardinality, is_spilled, to_list
+from ssecommon.registry import numeric_column
+from ssecommon.resultcache import ResultCache, is_no_store, script_request_key
+from ssecommon.scriptcache import compile_script
 from ssedata import ArgType, FunctionType, ReturnType
 
+# A tensor script with this comment only uses the values of each row to compute the result of that row
+STREAM_PATTERN = re.compile(r'#\s*qlik-stream\s*:\s*bundles')
+
+# A script with this comment receives its numerical parameters as float64 arrays rather than lists
+NUMPY_PATTERN = re.compile(r'#\s*qlik-data\s*:\s*numpy')
+
+
+def run_script(columns, script, arrow_names=None, keep_numbers=False):
+    """
+    Evaluates a script over the decoded parameter columns. Defined on module level so that it can be run in a worker
+    process of a ScriptProcessPool.
+    :param columns: one decoded column per parameter
+    :param script: script to evaluate
+    :param arrow_names: the parameter names if the script receives its parameters as a pyarrow.Table, else None
+    :param keep_numbers: pass the numbers to the script as float64 arrays rather than lists, for scripts with the
+    comment '# qlik-data: numpy'
+    :return: the result of the script
+    """
+    if arrow_names is not None:
+        # pyarrow is only required by scripts with the comment '# qlik-data: arrow'
+        import pyarrow
+        from ssecommon.arrow import to_table
+        args = to_table(columns, arrow_names)
+        logging.debug('Received data from Qlik (args): {}'.format(args))
+        return eval(compile_script(script), {'args': args, 'numpy': numpy, 'pyarrow': pyarrow})
+
+    # First element in the parameter list should contain the data of the first parameter.
+    # For easier access to the numerical and string representation of duals, in the script, we
+    # split them to two list. For example, if the first parameter is dual, it will contain two lists
+    # the first one being the numerical representation and the second one the string.
+    params = [to_list(column, keep_numbers) for column in columns]
+    logging.debug('Received data from Qlik (args): {}'.format(params))
+
+    # Evaluate script, compiled once and cached
+    return eval(compile_script(script), {'args': params, 'numpy': numpy})
+
 
 class ScriptEval:
     """
     Class for SSE plugin ScriptEval functionality.
     """
 
-    def EvaluateScript(self, header, request, context):
+    def __init__(self, result_cache=None, pool=None, memory_budget=None):
+        """
+        Class initializer.
+        :param result_cache: ResultCache for the results of evaluated scripts, a cache with default limits if None
+        :param pool: ScriptProcessPool evaluating the scripts, None to evaluate them in the calling thread
+        :param memory_budget: maximum number of bytes of the numerical parameters of a request held in memory, None
+        for no limit. Larger parameters are buffered in memory-mapped temporary files, see ssecommon.columnar
+        """
+        self.result_cache = ResultCache() if result_cache is None else result_cache
+        self.pool = pool
+        self.memory_budget = memory_budget
+        # The call plans of the script headers sent from Qlik, each header is parsed and analyzed once
+        self.plans = CallPlanCache(self.build_plan)
+
+    def build_plan(self, header):
+        """
+        Determines the function, argument and return types of a script request, and reads the comments of the
+        script that change how it is evaluated.
+        :param header: the parsed ScriptRequestHeader
+        :return: a CallPlan
+        """
+        func_type = self.get_func_type(header)
+        plan = CallPlan(header, func_type, self.get_arg_types(header), self.get_return_type(header))
+        plan.no_store = is_no_store(header.script)
+        plan.row_independent = bool(header.params) and self.is_row_independent(header, func_type)
+        plan.arrow_names = [param.name for param in header.params] if is_arrow_script(header.script) else None
+        plan.keep_numbers = NUMPY_PATTERN.search(header.script) is not None
+        return plan
+
+    def EvaluateScript(self, plan, request, context):
         """
         Evaluates script provided in the header, given the
         arguments provided in the sequence of RowData objects, the request.
 
-        :param header:
+        :param plan: the CallPlan of the script header
         :param request: an iterable sequence of RowData.
         :param context: the context sent from client
         :return: an iterable sequence of RowData.
         """
-        # Retrieve function type
-        func_type = self.get_func_type(header)
-
-        # Retrieve data types from header
-        arg_types = self.get_arg_types(header)
-        ret_type = self.get_return_type(header)
+        header = plan.header
 
         logging.info('EvaluateScript: {} ({} {}) {}'
-                     .format(header.script, arg_types, ret_type, func_type))
+                     .format(header.script, plan.arg_types, plan.ret_type, plan.func_type))
+
+        # A script can disable caching, both in Qlik and in the plugin, with the comment '# qlik-cache: no-store'
+        if plan.no_store:
+            md = (('qlik-cache', 'no-store'),)
+            context.send_initial_metadata(md)
+        use_cache = self.result_cache.enabled and not plan.no_store
 
+        if plan.row_independent:
+            # Evaluate the script on each bundle as it arrives, rather than on the whole columns. The result of a
+            # streamed script cannot be looked up in the cache, as the data is not known until the last bundle
+            yield from self.evaluate_bundles(plan, request, context)
+            return
+
+        columns = []
         # Check if parameters are provided
         if header.params:
-            all_rows = []
-
-            # Iterate over bundled rows
-            for request_rows in request:
-                # Iterate over rows
-                for row in request_rows.rows:
-                    # Retrieve parameters
-                    params = self.get_arguments(context, arg_types, row.duals, header)
-                    all_rows.append(params)
-
-            # First element in the parameter list should contain the data of the first parameter.
-            all_rows = [list(param) for param in zip(*all_rows)]
-
-            if arg_types == ArgType.Mixed:
-                param_datatypes = [param.dataType for param in header.params]
-                for i, datatype in enumerate(param_datatypes):
-                    if datatype == SSE.DUAL:
-                        # For easier access to the numerical and string representation of duals, in the script, we
-                        # split them to two list. For example, if the first parameter is dual, it will contain two lists
-                        # the first one being the numerical representation and the second one the string.
-                        all_rows[i] = [list(datatype) for datatype in zip(*all_rows[i])]
-
-            logging.debug('Received data from Qlik (args): {}'.format(all_rows))
-            yield self.evaluate(header.script, ret_type, params=all_rows)
+            # Decode all rows into one typed column buffer per parameter, preallocated using the cardinality
+            # sent in the common request header
+            try:
+                columns = decode(request, plan.data_types, get_cardinality(context), self.memory_budget)
+            except ValueError as e:
+                self.raise_grpc_error(context, grpc.StatusCode.INVALID_ARGUMENT, str(e))
 
-        else:
-            # No parameters provided
-            yield self.evaluate(header.script, ret_type)
+        # Reuse the result if the same script was evaluated over the same data before
+        if use_cache:
+            key = script_request_key(header, columns)
+            bundles = self.result_cache.get(key)
+            if bundles is not None:
+                logging.debug('Result cache hit: {}'.format(self.result_cache.stats()))
+                yield from bundles
+                return
+
+        bundles = self.evaluate(plan, columns)
+
+        if use_cache:
+            self.result_cache.put(key, bundles, sum(bundle.ByteSize() for bundle in bundles))
+        yield from bundles
 
     @staticmethod
     def get_func_type(header):
@@ -79,42 +152,32 @@ class ScriptEval:
             return FunctionType.Tensor
 
     @staticmethod
-    def get_arguments(context, arg_types, duals, header):
+    def is_row_independent(header, func_type):
+        """
+        Scalar scripts return one value per row computed from that row only. A tensor script may use all rows, e.g.
+        to normalize the values, unless it has the comment '# qlik-stream: bundles'.
+        :param header: the script header
+        :param func_type: function type
+        :return: True if the script can be evaluated bundle by bundle
         """
-        Gets the array of arguments based on
-        the duals, and the type (string, numeric)
-        specified in the header.
+        if func_type == FunctionType.Scalar:
+            return True
+        return func_type == FunctionType.Tensor and STREAM_PATTERN.search(header.script) is not None
+
+    @staticmethod
+    def raise_grpc_error(context, status_code, msg):
+        """
+        Sets the status of the call and raises an error on the plugin-side.
         :param context: the context sent from client
-        :param header: the script header.
-        :param duals: an iterable sequence of duals.
-        :return: an array of (potentially mixed data type) arguments.
-        """
-
-        if arg_types == ArgType.String:
-            # All parameters are of string type
-            script_args = [d.strData for d in duals]
-        elif arg_types == ArgType.Numeric:
-            # All parameters are of numeric type
-            script_args = [d.numData for d in duals]
-        elif arg_types == ArgType.Mixed:
-            # Parameters can be either string, numeric or dual
-            script_args = []
-            for dual, param in zip(duals, header.params):
-                if param.dataType == SSE.STRING:
-                    script_args.append(dual.strData)
-                elif param.dataType == SSE.NUMERIC:
-                    script_args.append(dual.numData)
-                elif param.dataType == SSE.DUAL:
-                    script_args.append((dual.numData, dual.strData))
-        else:
-            # Undefined argument types
-            # Make sure the error handling, including logging, works as intended in the client
-            msg = 'Undefined argument type: '.format(arg_types)
-            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
-            context.set_details(msg)
-            # Raise error on the plugin-side
-            raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, msg)
-        return script_args
+        :param status_code: the grpc.StatusCode sent to Qlik
+        :param msg: the details of the error
+        :return: never, grpc.RpcError is raised
+        """
+        # Make sure the error handling, including logging, works as intended in the client
+        context.set_code(status_code)
+        context.set_details(msg)
+        # Raise error on the plugin-side
+        raise grpc.RpcError(status_code, msg)
 
     @staticmethod
     def get_arg_types(header):
@@ -152,36 +215,73 @@ class ScriptEval:
             return ReturnType.Undefined
 
     @staticmethod
-    def get_duals(result, ret_type):
+    def get_duals(result, encode):
+        """
+        :param result: one row of the result, a single value or an iterable of values
+        :param encode: function creating the Dual of a value, see CallPlan.encode
+        :return: one row of data as an iterable of duals
+        """
         if isinstance(result, str) or not hasattr(result, '__iter__'):
             result = [result]
         # Transform the result to an iterable of Dual data
-        if ret_type == ReturnType.String:
-            duals = [SSE.Dual(strData=col) for col in result]
-        elif ret_type == ReturnType.Numeric:
-            duals = [SSE.Dual(numData=col) for col in result]
-        return iter(duals)
+        return iter([encode(col) for col in result])
 
-    def evaluate(self, script, ret_type, params=[]):
+    def evaluate(self, plan, columns=()):
         """
         Evaluates a script with given parameters and construct the result to a Row of duals.
-        :param script:  script to evaluate
-        :param ret_type: return data type
-        :param params: params to evaluate. Default: []
-        :return: a RowData of string dual
+        The script is evaluated in a worker process if the plugin is set up with a process pool.
+        :param plan: the CallPlan, with the script to evaluate and the encoder of the return type
+        :param columns: decoded parameter columns. Default: ()
+        :return: a list of BundledRows, the result split into bundles of a bounded size
         """
-        # Evaluate script
-        result = eval(script, {'args': params, 'numpy': numpy})
+        script = plan.header.script
+        encode = plan.encode
+        # The script receives the same types whether or not the parameters are above the memory budget: memory-mapped
+        # numbers become lists too, unless the script has the comment '# qlik-data: numpy'
+        if any(is_spilled(column) for column in columns):
+            logging.info('The numerical parameters of {} rows are memory-mapped temporary files'
+                         .format(column_length(columns[0])))
+        if self.pool is None:
+            result = run_script(columns, script, plan.arrow_names, plan.keep_numbers)
+        else:
+            # The columns are passed to the worker process through shared memory, or as temporary files if memory-mapped
+            result = self.pool.run(run_script, columns, script, plan.arrow_names, plan.keep_numbers)
         logging.debug('Result: {}'.format(result))
 
-        bundledRows = SSE.BundledRows()
+        if plan.arrow_names is not None:
+            from ssecommon.arrow import encode_result, is_arrow_data
+            if is_arrow_data(result):
+                # Each column of an Arrow result is encoded as a whole, with the return type of the function
+                return encode_result(result, return_type=plan.header.returnType)
+
         if isinstance(result, str) or not hasattr(result, '__iter__'):
             # A single value is returned
-            bundledRows.rows.add(duals=self.get_duals(result, ret_type))
+            rows = [self.get_duals(result, encode)]
         else:
-            for row in result:
-                # note that each element of the result should represent a row
-                bundledRows.rows.add(duals=self.get_duals(row, ret_type))
+            column = numeric_column(result) if plan.header.returnType == SSE.NUMERIC else None
+            if column is not None:
+                # A column of numbers is serialized as a whole, without creating a Dual per value
+                return list(encode_column(column)) or [SSE.BundledRows()]
+            # note that each element of the result should represent a row
+            rows = (self.get_duals(row, encode) for row in result)
 
-        return bundledRows
+        # A large result is sent in several bundles, each below the gRPC message size limit
+        return list(bundle_rows(rows))
+
+    def evaluate_bundles(self, plan, request, context):
+        """
+        Evaluates a row independent script on each bundle of rows as it is received. Only one bundle is held in
+        memory, and the result of the first bundle is sent while later bundles are still arriving.
+        :param plan: the CallPlan of the script header
+        :param request: an iterable sequence of BundledRows
+        :param context: the context sent from client
+        :return: generator of BundledRows
+        """
+        data_types = plan.data_types
+        for bundled_rows in request:
+            try:
+                columns = decode_bundle(bundled_rows, data_types)
+            except ValueError as e:
+                self.raise_grpc_error(context, grpc.StatusCode.INVALID_ARGUMENT, str(e))
+            yield from self.evaluate(plan, columns)
 
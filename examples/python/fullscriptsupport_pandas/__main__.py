@@ -4,18 +4,17 @@ import logging
 import logging.config
 import os
 import sys
-import time
-from concurrent import futures
 
 # Add Generated folder to module path.
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+# Add the folder of the shared ssecommon package to module path.
+sys.path.append(PARENT_DIR)
 
 import ServerSideExtension_pb2 as SSE
-import grpc
-from scripteval import ScriptEval
-
-_ONE_DAY_IN_SECONDS = 60 * 60 * 24
+from scripteval import ENGINES, ScriptEval
+from ssecommon import serving
+from ssecommon.accounting import Quotas
 
 
 class ExtensionService(SSE.ConnectorServicer):
@@ -23,17 +22,28 @@ class ExtensionService(SSE.ConnectorServicer):
     SSE-plugin with support for full script functionality.
     """
 
-    def __init__(self):
+    def __init__(self, processes=0, warm_up=True, engine='pandas'):
         """
         Class initializer.
-        :param funcdef_file: a function definition JSON file
+        :param processes: number of worker processes executing the scripts. 0 executes them in the server threads
+        :param warm_up: wait at startup until the worker processes are ready
+        :param engine: the data frame library executing the scripts by default, 'pandas' or 'polars'
         """
-        self.ScriptEval = ScriptEval()
         os.makedirs('logs', exist_ok=True)
         log_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logger.config')
         logging.config.fileConfig(log_file)
         logging.info('Logging enabled')
 
+        pool = None
+        if processes:
+            # Shared memory requires Python 3.8 or later, only import it when asked for
+            from ssecommon.processpool import ScriptProcessPool
+            preload = ('numpy', 'pandas', 'polars') if engine == 'polars' else ('numpy', 'pandas')
+            pool = ScriptProcessPool(processes, preload=preload, warm_up=warm_up)
+            logging.info('Executing scripts in {} worker processes'.format(processes))
+        self.ScriptEval = ScriptEval(pool, engine)
+        logging.info('Executing scripts with {} by default'.format(engine))
+
     """
     Implementation of rpc functions.
     """
@@ -65,58 +75,53 @@ class ExtensionService(SSE.ConnectorServicer):
         :param context:
         :return:
         """
-        # Parse header for script request
-        metadata = dict(context.invocation_metadata())
-        header = SSE.ScriptRequestHeader()
-        header.ParseFromString(metadata['qlik-scriptrequestheader-bin'])
+        # Retrieve the plan of the script header, parsed and analyzed once per distinct header
+        plan = self.ScriptEval.plans.get_from_context(context)
 
-        return self.ScriptEval.EvaluateScript(header, request, context)
+        return self.ScriptEval.EvaluateScript(plan, request, context)
 
     """
     Implementation of the Server connecting to gRPC.
     """
 
-    def Serve(self, port, pem_dir):
+    def Serve(self, port, pem_dir, aio=False, metrics_port=None, quotas=None):
         """
-        Sets up the gRPC Server with insecure connection on port
+        Sets up the gRPC Server and runs it until the plugin is interrupted, see ssecommon.serving.
         :param port: port to listen on.
         :param pem_dir: Directory including certificates
+        :param aio: serve the streams with a grpc.aio server on an asyncio event loop instead of a thread each
+        :param metrics_port: port of the HTTP endpoint serving metrics of the calls, None to not record metrics
+        :param quotas: ssecommon.accounting.Quotas limiting the calls of each Qlik app, None for no limits
         :return: None
         """
-        # Create gRPC server
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-        SSE.add_ConnectorServicer_to_server(self, server)
-
-        if pem_dir:
-            # Secure connection
-            with open(os.path.join(pem_dir, 'sse_server_key.pem'), 'rb') as f:
-                private_key = f.read()
-            with open(os.path.join(pem_dir, 'sse_server_cert.pem'), 'rb') as f:
-                cert_chain = f.read()
-            with open(os.path.join(pem_dir, 'root_cert.pem'), 'rb') as f:
-                root_cert = f.read()
-            credentials = grpc.ssl_server_credentials([(private_key, cert_chain)], root_cert, True)
-            server.add_secure_port('[::]:{}'.format(port), credentials)
-            logging.info('*** Running server in secure mode on port: {} ***'.format(port))
-        else:
-            # Insecure connection
-            server.add_insecure_port('[::]:{}'.format(port))
-            logging.info('*** Running server in insecure mode on port: {} ***'.format(port))
-
-        # Start gRPC server
-        server.start()
-        try:
-            while True:
-                time.sleep(_ONE_DAY_IN_SECONDS)
-        except KeyboardInterrupt:
-            server.stop(0)
+        serving.serve(self, port, pem_dir, aio, metrics_port, quotas=quotas, on_stop=self.close)
+
+    def close(self):
+        """
+        Stops the worker processes executing the scripts, if any.
+        :return: None
+        """
+        if self.ScriptEval.pool is not None:
+            self.ScriptEval.pool.close()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', nargs='?', default='50056')
     parser.add_argument('--pem_dir', nargs='?')
+    parser.add_argument('--aio', action='store_true')
+    parser.add_argument('--metrics_port', nargs='?', type=int)
+    parser.add_argument('--app_max_calls', nargs='?', type=int)
+    parser.add_argument('--app_cpu_quota', nargs='?', type=float)
+    parser.add_argument('--processes', nargs='?', type=int, default=0)
+    parser.add_argument('--no_warm_up', action='store_true')
+    parser.add_argument('--engine', nargs='?', choices=ENGINES, default='pandas')
     args = parser.parse_args()
 
-    calc = ExtensionService()
-    calc.Serve(args.port, args.pem_dir)
+    # Limits of the calls of each Qlik app, in calls in progress and in CPU seconds per minute
+    quotas = None
+    if args.app_max_calls is not None or args.app_cpu_quota is not None:
+        quotas = Quotas(max_calls=args.app_max_calls, cpu_seconds=args.app_cpu_quota)
+
+    calc = ExtensionService(args.processes, not args.no_warm_up, args.engine)
+    calc.Serve(args.port, args.pem_dir, args.aio, args.metrics_port, quotas=quotas)
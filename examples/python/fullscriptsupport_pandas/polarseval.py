@@ -0,0 +1,101 @@
+"""
+The Polars engine of the full script example: the parameters are exposed to the script as a polars.DataFrame q and a
+qResult that is a polars DataFrame or Series is encoded column by column. Requires polars, which runs group-bys,
+joins and filters on all cores.
+
+The script contract is the same as with pandas, see scripteval.run_script: the result is saved to qResult and a
+TableDescription is sent by setting tableDescription to True. Numerical parameters are Float64 columns, string
+parameters String columns and a dual parameter a Struct column with the fields 'num' and 'str', together with the
+columns '<name>_num' and '<name>_str'.
+"""
+import polars
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.bundler import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS, encode_columns
+from ssecommon.columnar import DualColumn
+
+
+def column_names(params):
+    """
+    :param params: the parameters of the request, e.g. ScriptRequestHeader.params
+    :return: the names of the columns of q, which must be unique in a polars.DataFrame
+    """
+    names = []
+    for param in params:
+        names.append(param.name)
+        if param.dataType == SSE.DUAL:
+            names.extend([param.name + '_num', param.name + '_str'])
+    return names
+
+
+def get_data_frame(header, columns):
+    """
+    Creates the data frame of the parameters received from Qlik.
+    :param header: the script header
+    :param columns: one decoded column per parameter
+    :return: a polars.DataFrame with the parameter names as column names
+    """
+    series = []
+    for param, column in zip(header.params, columns):
+        if isinstance(column, DualColumn):
+            numbers = polars.Series(param.name + '_num', column.numbers)
+            strings = polars.Series(param.name + '_str', column.strings, dtype=polars.String)
+            series.append(polars.DataFrame([numbers.alias('num'), strings.alias('str')]).to_struct(param.name))
+            series.extend([numbers, strings])
+        elif param.dataType == SSE.STRING:
+            series.append(polars.Series(param.name, column, dtype=polars.String))
+        else:
+            # The float64 buffer is used without copying
+            series.append(polars.Series(param.name, column))
+    return polars.DataFrame(series)
+
+
+def is_polars_data(result):
+    """
+    :param result: the result of a script
+    :return: True if the result is a polars DataFrame or Series that encode_result can encode
+    """
+    return isinstance(result, (polars.DataFrame, polars.Series))
+
+
+def _is_dual(series):
+    return isinstance(series.dtype, polars.Struct) and [field.name for field in series.dtype.fields] == ['num', 'str']
+
+
+def from_series(series, to_type):
+    """
+    :param series: a polars.Series
+    :param to_type: SSE.DataType the column is sent as
+    :return: a column that can be encoded, see ssecommon.columnar.encode_bundle
+    """
+    if to_type == SSE.DUAL:
+        if _is_dual(series):
+            return DualColumn(from_series(series.struct.field('num'), SSE.NUMERIC),
+                              from_series(series.struct.field('str'), SSE.STRING))
+        return DualColumn(from_series(series, SSE.NUMERIC), from_series(series, SSE.STRING))
+    if _is_dual(series):
+        series = series.struct.field('num' if to_type == SSE.NUMERIC else 'str')
+    if to_type == SSE.NUMERIC:
+        # Values that are not numbers, and missing values, are sent as NaN, which Qlik shows as null
+        return series.cast(polars.Float64, strict=False).to_numpy()
+    # Missing values are sent as empty strings
+    return series.cast(polars.String).fill_null('').to_numpy()
+
+
+def encode_result(result, data_types, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Encodes a qResult that is a polars DataFrame or Series into bundles of a bounded size, see
+    ssecommon.bundler.encode_columns.
+    :param result: the result
+    :param data_types: list of SSE.DataType, one per column, e.g. from TableDescription.fields, or a single
+    SSE.DataType for all columns
+    :param max_bytes: target encoded size of a message
+    :param max_rows: maximum number of rows of a message
+    :return: list of SerializedRows or BundledRows, at least one
+    """
+    if isinstance(result, polars.Series):
+        result = result.to_frame()
+    if not isinstance(data_types, list):
+        data_types = [data_types] * result.width
+    columns = [from_series(series, to_type) for series, to_type in zip(result, data_types)]
+    return list(encode_columns(columns, max_bytes, max_rows)) or [SSE.BundledRows()]
@@ -1,69 +1,144 @@
 import logging
 import logging.config
+import re
 
 import ServerSideExtension_pb2 as SSE
 import grpc
 import numpy
 import pandas
+from ssecommon.bundler import bundle_rows, encode_column
+from ssecommon.callplan import CallPlan, CallPlanCache, dual_encoder, is_arrow_script
+from ssecommon.columnar import DualColumn, decode, get_cardinality
+from ssecommon.registry import numeric_column
+from ssecommon.scriptcache import compile_script
 from ssedata import ArgType, FunctionType, ReturnType
 
+try:
+    _STRING_DTYPE = pandas.StringDtype()
+except AttributeError:
+    # pandas versions before 1.0 store strings as objects
+    _STRING_DTYPE = object
+
+ENGINES = ('pandas', 'polars')
+# A script with this comment is executed by the given engine rather than the default engine of the plugin
+ENGINE_PATTERN = re.compile(r'#\s*qlik-engine\s*:\s*({})\b'.format('|'.join(ENGINES)))
+
+
+def get_engine(script, default='pandas'):
+    """
+    :param script: the script sent from Qlik
+    :param default: the engine of scripts without the '# qlik-engine: <engine>' comment
+    :return: the engine executing the script, 'pandas' or 'polars'
+    """
+    match = ENGINE_PATTERN.search(script)
+    return match.group(1) if match else default
+
+
+def run_script(columns, header, engine='pandas'):
+    """
+    Executes a script with the data frame q created from the decoded parameter columns. Defined on module level so
+    that it can be run in a worker process of a ScriptProcessPool.
+    :param columns: one decoded column per parameter
+    :param header: the script header, with the script and the parameter names
+    :param engine: 'pandas' or 'polars', the library of the data frame q
+    :return: a tuple of: whether the script set qResult, qResult, and the table description if the script set
+    tableDescription to True, otherwise None
+    """
+    script_globals = {'numpy': numpy, 'pandas': pandas}
+    if is_arrow_script(header.script):
+        # pyarrow is only required by scripts with the comment '# qlik-data: arrow', q is then a pyarrow.Table
+        import pyarrow
+        from ssecommon.arrow import to_table
+        q = to_table(columns, [param.name for param in header.params])
+        script_globals['pyarrow'] = pyarrow
+    elif engine == 'polars':
+        # polars is only required by scripts executed by the polars engine
+        import polars
+        import polarseval
+        q = polarseval.get_data_frame(header, columns)
+        script_globals['polars'] = polars
+    else:
+        # Create a panda data frame, for retrieved parameters
+        q = ScriptEval.get_data_frame(header, columns) if header.params else pandas.DataFrame()
+    table = SSE.TableDescription()
+    logging.debug('Received data frame (q): {}'.format(q))
+    locals_added = {}  # The variables set while executing the script will be saved to this dict
+    # Evaluate script, compiled once and cached, the result must be saved to the qResult object
+    code = compile_script(header.script, 'exec')
+    exec(code, dict(script_globals, q=q, table=table), locals_added)
+
+    if locals_added.get('tableDescription') is not True:
+        table = None
+    return 'qResult' in locals_added, locals_added.get('qResult'), table
+
 
 class ScriptEval:
     """
     Class for SSE plugin ScriptEval functionality.
     """
 
-    def EvaluateScript(self, header, request, context):
+    def __init__(self, pool=None, engine='pandas'):
+        """
+        Class initializer.
+        :param pool: ScriptProcessPool executing the scripts, None to execute them in the calling thread
+        :param engine: the engine executing scripts without the '# qlik-engine: <engine>' comment, 'pandas' or
+        'polars'
+        """
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine: {}'.format(engine))
+        if engine == 'polars':
+            # Fail at startup rather than at the first script if polars is not installed
+            import polarseval  # noqa: F401
+        self.pool = pool
+        self.engine = engine
+        # The call plans of the script headers sent from Qlik, each header is parsed and analyzed once
+        self.plans = CallPlanCache(self.build_plan)
+
+    def build_plan(self, header):
+        """
+        Determines the function, argument and return types of a script request.
+        :param header: the parsed ScriptRequestHeader
+        :return: a CallPlan, the script is executed as statements
+        """
+        plan = CallPlan(header, self.get_func_type(header), self.get_arg_types(header), self.get_return_type(header),
+                        mode='exec')
+        plan.arrow = is_arrow_script(header.script)
+        plan.engine = get_engine(header.script, self.engine)
+        return plan
+
+    def EvaluateScript(self, plan, request, context):
         """
         Evaluates script provided in the header, given the
         arguments provided in the sequence of RowData objects, the request.
 
-        :param header:
+        :param plan: the CallPlan of the script header
         :param request: an iterable sequence of RowData.
         :param context: the context sent from client
         :return: an iterable sequence of RowData.
         """
-        # Retrieve function type
-        func_type = self.get_func_type(header)
-
-        # Retrieve data types from header
-        arg_types = self.get_arg_types(header)
-        ret_type = self.get_return_type(header)
+        header = plan.header
 
         logging.info('EvaluateScript: {} ({} {}) {}'
-                     .format(header.script, arg_types, ret_type, func_type))
+                     .format(header.script, plan.arg_types, plan.ret_type, plan.func_type))
 
-        # Create a panda data frame, for retrieved parameters
-        q = pandas.DataFrame()
+        if plan.engine == 'polars' and not plan.arrow:
+            from polarseval import column_names
+            names = column_names(header.params)
+            if len(set(names)) < len(names):
+                msg = 'The column names of a polars data frame must be unique: {}'.format(', '.join(names))
+                self.raise_grpc_error(context, grpc.StatusCode.INVALID_ARGUMENT, msg)
 
+        columns = []
         # Check if parameters are provided
         if header.params:
-            # Iterate over bundled rows
-            for request_rows in request:
-                # Iterate over rows
-                for row in request_rows.rows:
-                    # Retrieve parameters and append to data frame
-                    params, dual_exist = self.get_arguments(context, arg_types, row.duals, header)
-                    q = q.append(params, ignore_index=True)
-
-            # Rename columns based on arg names in header
-            arg_names = [param.name for param in header.params]
-            if dual_exist:
-                # find what column(s) are dual
-                param_types = [param.dataType for param in header.params]
-                col_index = [i for i, arg_type in enumerate(param_types) if arg_type == SSE.DUAL]
-                # add _num and _str columns representing the dual column
-                # for an easier access in the script
-                for col in col_index:
-                    arg_names.insert(col + 1, arg_names[col] + '_str')
-                    arg_names.insert(col + 2, arg_names[col] + '_num')
-            q.rename(columns=lambda i: arg_names[i], inplace=True)
-
-            yield self.evaluate(context, header.script, ret_type, q)
+            # Decode all rows to one typed column buffer per parameter, preallocated using the cardinality sent in
+            # the common request header. The data frame is created from the buffers in one step
+            try:
+                columns = decode(request, plan.data_types, get_cardinality(context))
+            except ValueError as e:
+                self.raise_grpc_error(context, grpc.StatusCode.INVALID_ARGUMENT, str(e))
 
-        else:
-            # No parameters provided
-            yield self.evaluate(context, header.script, ret_type, q)
+        yield from self.evaluate(context, plan, columns)
 
     @staticmethod
     def get_func_type(header):
@@ -88,46 +163,36 @@ class ScriptEval:
         # Raise error on the plugin-side
         raise grpc.RpcError(status_code, msg)
 
-    def get_arguments(self, context, arg_types, duals, header):
+    @staticmethod
+    def get_data_frame(header, columns):
         """
-        Gets the array of arguments based on
-        the duals, and the type (string, numeric)
-        specified in the header.
-        :param context: the context sent from client
-        :param arg_types: the argument data type
-        :param duals: an iterable sequence of duals.
+        Creates the data frame of the parameters received from Qlik.
+        Numerical parameters are stored as float64 columns and string parameters with the pandas string data type.
+        For a dual parameter we add additional columns, '_str' and '_num', with the string and numeric
+        representation, for easier access in the script.
         :param header: the script header.
-        :return: a panda Series containing (potentially mixed data type) arguments.
-        """
-        dual_type = False
-        if arg_types == ArgType.String:
-            # All parameters are of string type
-            script_args = [d.strData for d in duals]
-        elif arg_types == ArgType.Numeric:
-            # All parameters are of numeric type
-            script_args = [d.numData for d in duals]
-        elif arg_types == ArgType.Mixed:
-            # Parameters can be either string, numeric or dual
-            script_args = []
-            for dual, param in zip(duals, header.params):
-                if param.dataType == SSE.STRING:
-                    script_args.append(dual.strData)
-                elif param.dataType == SSE.NUMERIC:
-                    script_args.append(dual.numData)
-                elif param.dataType == SSE.DUAL:
-                    script_args.append((dual.numData, dual.strData))
-                    # We add additional columns with string and numeric representation
-                    # for easier access in script
-                    script_args.append(dual.strData)
-                    script_args.append(dual.numData)
-                    dual_type = True
-        else:
-            # Undefined argument types
-            msg = 'Undefined argument type: '.format(arg_types)
-            self.raise_grpc_error(context, grpc.StatusCode.INVALID_ARGUMENT, msg)
+        :param columns: one decoded column per parameter.
+        :return: a pandas DataFrame with the parameter names as column names.
+        """
+        data = []
+        arg_names = []
+        for param, column in zip(header.params, columns):
+            if isinstance(column, DualColumn):
+                data.append(pandas.Series(list(zip(column.numbers.tolist(), column.strings.tolist())), dtype=object))
+                data.append(pandas.Series(column.strings, dtype=_STRING_DTYPE))
+                data.append(pandas.Series(column.numbers))
+                arg_names.extend([param.name, param.name + '_str', param.name + '_num'])
+            elif param.dataType == SSE.STRING:
+                data.append(pandas.Series(column, dtype=_STRING_DTYPE))
+                arg_names.append(param.name)
+            else:
+                data.append(pandas.Series(column))
+                arg_names.append(param.name)
 
-        # dtype=object is needed if the data is not homogeneous, e.g. data type dual
-        return pandas.Series(script_args, dtype=object), dual_type
+        # Columns are keyed by position, parameter names sent from Qlik are not necessarily unique
+        q = pandas.DataFrame(dict(enumerate(data)))
+        q.columns = arg_names
+        return q
 
     @staticmethod
     def get_arg_types(header):
@@ -165,27 +230,18 @@ class ScriptEval:
             return ReturnType.Undefined
 
     @staticmethod
-    def get_duals(result, ret_type):
+    def get_duals(result, encoders):
         """
         Transforms one row in qResult to an iterable of duals.
         :param result: one row of qResult
-        :param ret_type: a list containing a data type for each column in qResult
+        :param encoders: a list containing the function creating the Dual of a value, for each column in qResult.
+        A dual value is a tuple with a numeric and string representation
         :return: one row of data as an iterable of duals
         """
         # result must be iterable
         result = [result] if isinstance(result, (str, tuple)) or not hasattr(result, '__iter__') else result
         # Transform the result to an iterable of Dual data
-        duals = []
-        for i, col in enumerate(result):
-            data_type = ret_type[i]
-            if data_type == ReturnType.String:
-                duals.append(SSE.Dual(strData=col))
-            elif data_type == ReturnType.Numeric:
-                duals.append(SSE.Dual(numData=col))
-            elif data_type == ReturnType.Dual:
-                # col is a tuple with a numeric and string representation
-                duals.append(SSE.Dual(numData=col[0], strData=col[1]))
-        return iter(duals)
+        return iter([encode(col) for encode, col in zip(encoders, result)])
 
     @staticmethod
     def send_table_description(table, context):
@@ -203,51 +259,72 @@ class ScriptEval:
         table_header = (('qlik-tabledescription-bin', table.SerializeToString()),)
         context.send_initial_metadata(table_header)
 
-    def evaluate(self, context, script, ret_type, q):
+    def evaluate(self, context, plan, arg_columns):
         """
         Evaluates a script with given parameters and construct the result to a Row of duals.
+        The script is executed in a worker process if the plugin is set up with a process pool.
         :param context:
-        :param script:  script to evaluate
-        :param ret_type: return data type
-        :param q: data frame of received parameters, empty if no parameter was sent
-        :return: a RowData of string dual
-        """
-        table = SSE.TableDescription()
-        logging.debug('Received data frame (q): {}'.format(q))
-        locals_added = {}  # The variables set while executing the script will be saved to this dict
-        # Evaluate script, the result must be saved to the qResult object
-        exec(script, {'q': q, 'numpy': numpy, 'pandas': pandas, 'table': table}, locals_added)
-
-        if 'qResult' in locals_added:
-            qResult = locals_added['qResult']
+        :param plan: the CallPlan, with the script header and the encoder of the return type
+        :param arg_columns: decoded parameter columns, empty if no parameter was sent
+        :return: a list of BundledRows, the result split into bundles of a bounded size
+        """
+        header = plan.header
+        if self.pool is None:
+            has_result, qResult, table = run_script(arg_columns, header, plan.engine)
+        else:
+            # The columns are passed to the worker process through shared memory
+            has_result, qResult, table = self.pool.run(run_script, arg_columns, header, plan.engine)
+
+        if has_result:
             logging.debug('Result (qResult): {}'.format(qResult))
 
-            if 'tableDescription' in locals_added and locals_added['tableDescription'] is True:
+            if table is not None:
                 self.send_table_description(table, context)
+
+            if plan.arrow:
+                from ssecommon.arrow import encode_result, is_arrow_data
+                if is_arrow_data(qResult):
+                    # Each column of an Arrow result is encoded as a whole, typed as the fields of the table
+                    # description or with the return type of the function
+                    data_types = [field.dataType for field in table.fields] if table is not None else None
+                    return encode_result(qResult, data_types, plan.header.returnType)
+            elif plan.engine == 'polars':
+                from polarseval import encode_result, is_polars_data
+                if is_polars_data(qResult):
+                    # Each column of a polars result is encoded as a whole, typed as the fields of the table
+                    # description or with the return type of the function
+                    data_types = [field.dataType for field in table.fields] if table is not None else header.returnType
+                    return encode_result(qResult, data_types)
+
+            if table is not None:
                 # If a tableDescription is sent, the return type should be updated accordingly
-                ret_type = [ReturnType(field.dataType) for field in table.fields]
+                encoders = [dual_encoder(field.dataType) for field in table.fields]
             else:
                 # All returned columns have the same data type as the return type of the function
                 if isinstance(qResult, str) or not hasattr(qResult, '__iter__'):
                     columns = 1
                 else:
+                    column = numeric_column(qResult) if header.returnType == SSE.NUMERIC else None
+                    if column is not None:
+                        # A column of numbers is serialized as a whole, without creating a Dual per value
+                        return list(encode_column(column)) or [SSE.BundledRows()]
                     if type(qResult) in [list, tuple]:
                         # Transformed to an array for simplifying getting the shape of the result, which can be of
                         # different types
                         qResult = numpy.array(qResult)
                     columns = 1 if len(qResult.shape) == 1 else qResult.shape[1]
-                ret_type = [ret_type] * columns
+                encoders = [plan.encode] * columns
 
-            # Transform the result to bundled rows
-            bundledRows = SSE.BundledRows()
+            # Transform the result to rows of duals
             if isinstance(qResult, str) or not hasattr(qResult, '__iter__'):
                 # A single value is returned
-                bundledRows.rows.add(duals=self.get_duals(qResult, ret_type))
+                rows = [self.get_duals(qResult, encoders)]
             else:
-                for row in qResult:
-                    bundledRows.rows.add(duals=self.get_duals(row, ret_type))
+                rows = (self.get_duals(row, encoders) for row in qResult)
 
-            return bundledRows
+            # A large table, e.g. from a LOAD ... EXTENSION statement, is sent in several bundles, each below the
+            # gRPC message size limit
+            return list(bundle_rows(rows))
         else:
             # No result was saved to qResult object
             msg = 'No result was saved to qResult, check your script.'
@@ -1,25 +1,28 @@
 #! /usr/bin/env python3
 import argparse
-import json
 import logging
 import logging.config
 import os
 import sys
-import time
-from concurrent import futures
 from datetime import datetime
 
 # Add Generated folder to module path.
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+# Add the folder of the shared ssecommon package to module path.
+sys.path.append(PARENT_DIR)
 
 import ServerSideExtension_pb2 as SSE
 import grpc
+from ssecommon import prefork, serving
+from ssecommon.accounting import Quotas
+from ssecommon.aggregation import Join
+from ssecommon.bundler import bundle_columns
+from ssecommon.capabilities import CapabilitiesCache
+from ssecommon.columnar import DistinctMapper
 from ssedata import FunctionType
 from scripteval import ScriptEval
 
-_ONE_DAY_IN_SECONDS = 60 * 60 * 24
-
 
 class ExtensionService(SSE.ConnectorServicer):
     """
@@ -38,6 +41,12 @@ class ExtensionService(SSE.ConnectorServicer):
         logging.config.fileConfig(log_file)
         logging.info('Logging enabled')
 
+        # The function definitions are validated and compiled once, and again when the file is changed
+        implementations = {func_id: getattr(self, name) if isinstance(name, str) else name
+                           for func_id, name in self.functions.items()}
+        self._capabilities = CapabilitiesCache(funcdef_file, implementations, 'Hello World - Qlik', 'v1.1.0')
+        self._capabilities.watch()
+
     @property
     def function_definitions(self):
         """
@@ -48,11 +57,13 @@ class ExtensionService(SSE.ConnectorServicer):
     @property
     def functions(self):
         """
-        :return: Mapping of function id and implementation
+        :return: Mapping of function id and the name of the implementing method, or the Aggregator class of an
+        aggregation
         """
         return {
             0: '_hello_world',
-            1: '_hello_world_aggr',
+            # HelloWorldAggr, a comma separated string of the values, joined bundle by bundle
+            1: Join,
             2: '_cache',
             3: '_no_cache',
             4: '_echo_table'
@@ -82,35 +93,9 @@ class ExtensionService(SSE.ConnectorServicer):
         :param request: iterable sequence of bundled rows
         :return: the same iterable sequence as received
         """
-        for request_rows in request:
-            yield request_rows
-
-    @staticmethod
-    def _hello_world_aggr(request, context):
-        """
-        Aggregates the parameters to a single comma separated string.
-        :param request: iterable sequence of bundled rows
-        :return: string
-        """
-        params = []
-
-        # Iterate over bundled rows
-        for request_rows in request:
-            # Iterate over rows
-            for row in request_rows.rows:
-                # Retrieve string value of parameter and append to the params variable
-                # Length of param is 1 since one column is received, the [0] collects the first value in the list
-                param = [d.strData for d in row.duals][0]
-                params.append(param)
-
-        # Aggregate parameters to a single string
-        result = ', '.join(params)
-
-        # Create an iterable of dual with the result
-        duals = iter([SSE.Dual(strData=result)])
-
-        # Yield the row data as bundled rows
-        yield SSE.BundledRows(rows=[SSE.Row(duals=duals)])
+        # Each received bundle, a ssecommon.wire.ReceivedRows, is sent back as its received bytes, without parsing
+        # and serializing its rows
+        yield from request
 
     @staticmethod
     def _cache(request, context):
@@ -120,21 +105,7 @@ class ExtensionService(SSE.ConnectorServicer):
         :param context: not used.
         :return: string
         """
-        # Iterate over bundled rows
-        for request_rows in request:
-            # Iterate over rows
-            for row in request_rows.rows:
-                # Retrieve string value of parameter and append to the params variable
-                # Length of param is 1 since one column is received, the [0] collects the first value in the list
-                param = [d.strData for d in row.duals][0]
-
-                # Join with current timedate stamp
-                result = param + ' ' + datetime.now().isoformat()
-                # Create an iterable of dual with the result
-                duals = iter([SSE.Dual(strData=result)])
-
-                # Yield the row data as bundled rows
-                yield SSE.BundledRows(rows=[SSE.Row(duals=duals)])
+        return ExtensionService._add_timestamp(request)
 
     @staticmethod
     def _no_cache(request, context):
@@ -148,35 +119,36 @@ class ExtensionService(SSE.ConnectorServicer):
         md = (('qlik-cache', 'no-store'),)
         context.send_initial_metadata(md)
 
-        # Iterate over bundled rows
-        for request_rows in request:
-            # Iterate over rows
-            for row in request_rows.rows:
-                # Retrieve string value of parameter and append to the params variable
-                # Length of param is 1 since one column is received, the [0] collects the first value in the list
-                param = [d.strData for d in row.duals][0]
+        return ExtensionService._add_timestamp(request)
 
-                # Join with current timedate stamp
-                result = param + ' ' + datetime.now().isoformat()
-                # Create an iterable of dual with the result
-                duals = iter([SSE.Dual(strData=result)])
+    @staticmethod
+    def _add_timestamp(request):
+        """
+        Adds the datetime stamp of each received bundle to the end of each string value of the bundle. Qlik sends the
+        values of a dimension many times, so each string is built once per distinct value of a bundle and reused for
+        the rows with the same value.
+        :param request: iterable sequence of bundled rows
+        :return: generator of bundled rows
+        """
+        def add_stamp(request_rows):
+            stamp = ' ' + datetime.now().isoformat()
+            # The string value of the single parameter of each row
+            strings = DistinctMapper(lambda param: param + stamp)
+            return strings.map([row.duals[0].strData for row in request_rows.rows])
 
-                # Yield the row data as bundled rows
-                yield SSE.BundledRows(rows=[SSE.Row(duals=duals)])
+        # The results of the bundles are collected into response bundles of a bounded size
+        return bundle_columns(add_stamp(request_rows) for request_rows in request)
 
     @staticmethod
     def _echo_table(request, context):
         """
         Echo the input table.
-        :param request:
-        :param context:
-        :return:
+        :param request: iterable sequence of bundled rows
+        :param context: not used.
+        :return: the same iterable sequence as received
         """
-        for request_rows in request:
-            response_rows = []
-            for row in request_rows.rows:
-                response_rows.append(row)
-            yield SSE.BundledRows(rows=response_rows)
+        # The rows of the table are sent back as received, see _hello_world
+        yield from request
 
     """
     Implementation of rpc functions.
@@ -193,31 +165,8 @@ class ExtensionService(SSE.ConnectorServicer):
         :return: the capabilities.
         """
         logging.info('GetCapabilities')
-        # Create an instance of the Capabilities grpc message
-        # Enable(or disable) script evaluation
-        # Set values for pluginIdentifier and pluginVersion
-        capabilities = SSE.Capabilities(allowScript=True,
-                                        pluginIdentifier='Hello World - Qlik',
-                                        pluginVersion='v1.1.0')
-
-        # If user defined functions supported, add the definitions to the message
-        with open(self.function_definitions) as json_file:
-            # Iterate over each function definition and add data to the capabilities grpc message
-            for definition in json.load(json_file)['Functions']:
-                function = capabilities.functions.add()
-                function.name = definition['Name']
-                function.functionId = definition['Id']
-                function.functionType = definition['Type']
-                function.returnType = definition['ReturnType']
-
-                # Retrieve name and type of each parameter
-                for param_name, param_type in sorted(definition['Params'].items()):
-                    function.params.add(name=param_name, dataType=param_type)
-
-                logging.info('Adding to capabilities: {}({})'.format(function.name,
-                                                                     [p.name for p in function.params]))
-
-        return capabilities
+        # Built from the function definitions at startup, and rebuilt by the watcher when the file changes
+        return self._capabilities.capabilities
 
     def ExecuteFunction(self, request_iterator, context):
         """
@@ -232,7 +181,16 @@ class ExtensionService(SSE.ConnectorServicer):
         # Call corresponding function
         logging.info('ExecuteFunction (functionId: {})'.format(func_id))
 
-        return getattr(self, self.functions[func_id])(request_iterator, context)
+        function = self._capabilities.get_function(func_id)
+        if function is None:
+            # Make sure the error handling, including logging, works as intended in the client
+            msg = 'Function id {} is not defined in this plugin.'.format(func_id)
+            context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+            context.set_details(msg)
+            # Raise error on the plugin-side
+            raise grpc.RpcError(grpc.StatusCode.UNIMPLEMENTED, msg)
+
+        return function(request_iterator, context)
 
     def EvaluateScript(self, request, context):
         """
@@ -241,17 +199,13 @@ class ExtensionService(SSE.ConnectorServicer):
         :param context:
         :return:
         """
-        # Parse header for script request
-        metadata = dict(context.invocation_metadata())
-        header = SSE.ScriptRequestHeader()
-        header.ParseFromString(metadata['qlik-scriptrequestheader-bin'])
-
-        # Retrieve function type
-        func_type = self.ScriptEval.get_func_type(header)
+        # Retrieve the plan of the script header, parsed and analyzed once per distinct header
+        plan = self.ScriptEval.plans.get_from_context(context)
+        func_type = plan.func_type
 
         # Verify function type
         if (func_type == FunctionType.Aggregation) or (func_type == FunctionType.Tensor):
-            return self.ScriptEval.EvaluateScript(header, request, context, func_type)
+            return self.ScriptEval.EvaluateScript(plan, request, context)
         else:
             # This plugin does not support other function types than aggregation  and tensor.
             # Make sure the error handling, including logging, works as intended in the client
@@ -265,51 +219,44 @@ class ExtensionService(SSE.ConnectorServicer):
     Implementation of the Server connecting to gRPC.
     """
 
-    def Serve(self, port, pem_dir):
+    def Serve(self, port, pem_dir, aio=False, metrics_port=None, reuse_port=False, quotas=None):
         """
-        Sets up the gRPC Server with insecure connection on port
+        Sets up the gRPC Server and runs it until the plugin is interrupted, see ssecommon.serving.
         :param port: port to listen on.
         :param pem_dir: Directory including certificates
+        :param aio: serve the streams with a grpc.aio server on an asyncio event loop instead of a thread each
+        :param metrics_port: port of the HTTP endpoint serving metrics of the calls, None to not record metrics
+        :param reuse_port: let the worker processes of ssecommon.prefork listen on the same port
+        :param quotas: ssecommon.accounting.Quotas limiting the calls of each Qlik app, None for no limits
         :return: None
         """
-        # Create gRPC server
-        server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-        SSE.add_ConnectorServicer_to_server(self, server)
-
-        if pem_dir:
-            # Secure connection
-            with open(os.path.join(pem_dir, 'sse_server_key.pem'), 'rb') as f:
-                private_key = f.read()
-            with open(os.path.join(pem_dir, 'sse_server_cert.pem'), 'rb') as f:
-                cert_chain = f.read()
-            with open(os.path.join(pem_dir, 'root_cert.pem'), 'rb') as f:
-                root_cert = f.read()
-            credentials = grpc.ssl_server_credentials([(private_key, cert_chain)], root_cert, True)
-            server.add_secure_port('[::]:{}'.format(port), credentials)
-            logging.info('*** Running server in secure mode on port: {} ***'.format(port))
-        else:
-            # Insecure connection
-            server.add_insecure_port('[::]:{}'.format(port))
-            logging.info('*** Running server in insecure mode on port: {} ***'.format(port))
-
-        # Start gRPC server
-        server.start()
-        try:
-            while True:
-                time.sleep(_ONE_DAY_IN_SECONDS)
-        except KeyboardInterrupt:
-            server.stop(0)
+        serving.serve(self, port, pem_dir, aio, metrics_port, reuse_port, quotas)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--port', nargs='?', default='50052')
     parser.add_argument('--pem_dir', nargs='?')
+    parser.add_argument('--aio', action='store_true')
+    parser.add_argument('--metrics_port', nargs='?', type=int)
+    parser.add_argument('--app_max_calls', nargs='?', type=int)
+    parser.add_argument('--app_cpu_quota', nargs='?', type=float)
     parser.add_argument('--definition_file', nargs='?', default='functions.json')
+    parser.add_argument('--workers', nargs='?', type=int, default=1)
     args = parser.parse_args()
 
+    # Limits of the calls of each Qlik app, in calls in progress and in CPU seconds per minute
+    quotas = None
+    if args.app_max_calls is not None or args.app_cpu_quota is not None:
+        quotas = Quotas(max_calls=args.app_max_calls, cpu_seconds=args.app_cpu_quota)
+
     # need to locate the file when script is called from outside it's location dir.
     def_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), args.definition_file)
 
-    calc = ExtensionService(def_file)
-    calc.Serve(args.port, args.pem_dir)
+    if args.workers > 1:
+        # Each worker process creates the servicer, after the modules are loaded by the supervisor
+        prefork.serve(lambda: ExtensionService(def_file), args.workers, args.port, args.pem_dir, args.aio,
+                      args.metrics_port, quotas)
+    else:
+        calc = ExtensionService(def_file)
+        calc.Serve(args.port, args.pem_dir, args.aio, args.metrics_port, quotas=quotas)
@@ -2,6 +2,11 @@ import logging
 import logging.config
 
 import grpc
+import numpy
+from ssecommon.bundler import ColumnBundler
+from ssecommon.callplan import CallPlan, CallPlanCache
+from ssecommon.columnar import DistinctMapper, decode_bundle
+from ssecommon.vectorize import vectorize
 from ssedata import ArgType, ReturnType, FunctionType
 
 import ServerSideExtension_pb2 as SSE
@@ -12,52 +17,49 @@ class ScriptEval:
     Class for SSE plugin ScriptEval functionality.
     """
 
-    def EvaluateScript(self, header, request, context, func_type):
+    def __init__(self):
+        """
+        Class initializer.
+        """
+        # The call plans of the script headers sent from Qlik, each header is parsed and analyzed once
+        self.plans = CallPlanCache(self.build_plan)
+
+    def build_plan(self, header):
+        """
+        Determines the function, argument and return types of a script request.
+        :param header: the parsed ScriptRequestHeader
+        :return: a CallPlan, with the whole-column evaluation of the script if it is elementwise
+        """
+        plan = CallPlan(header, self.get_func_type(header), self.get_arg_types(header), self.get_return_type(header))
+        plan.vectorized = vectorize(header.script)
+        return plan
+
+    def EvaluateScript(self, plan, request, context):
         """
         Evaluates script provided in the header, given the
         arguments provided in the sequence of RowData objects, the request.
 
-        :param header:
+        :param plan: the CallPlan of the script header
         :param request: an iterable sequence of RowData.
         :param context: the context sent from client
-        :param func_type: function type.
         :return: an iterable sequence of RowData.
         """
-        # Retrieve data types from header
-        arg_types = self.get_arg_types(header)
-        ret_type = self.get_return_type(header)
+        arg_types = plan.arg_types
+        ret_type = plan.ret_type
 
         logging.info('EvaluateScript: {} ({} {}) {}'
-                     .format(header.script, arg_types, ret_type, func_type))
+                     .format(plan.script, arg_types, ret_type, plan.func_type))
 
-        aggr = (func_type == FunctionType.Aggregation)
+        aggr = (plan.func_type == FunctionType.Aggregation)
 
         # Check if parameters are provided
-        if header.params:
+        if plan.header.params:
             # Verify argument type
             if arg_types == ArgType.String:
-                # Create an empty list if tensor function
                 if aggr:
-                    all_rows = []
-
-                # Iterate over bundled rows
-                for request_rows in request:
-                    # Iterate over rows
-                    for row in request_rows.rows:
-                        # Retrieve numerical data from duals
-                        params = self.get_arguments(context, arg_types, row.duals)
-
-                        if aggr:
-                            # Append value to list, for later aggregation
-                            all_rows.append(params)
-                        else:
-                            # Evaluate script row wise
-                            yield self.evaluate(context, header.script, ret_type, params=params)
-
-                # Evaluate script based on data from all rows
-                if aggr:
-                    params = [list(param) for param in zip(*all_rows)]
-                    yield self.evaluate(context, header.script, ret_type, params=params)
+                    yield self.evaluate_aggregation(context, plan, request)
+                else:
+                    yield from self.evaluate_rows(context, plan, request)
             else:
                 # This plugin does not support other argument types than string.
                 # Make sure the error handling, including logging, works as intended in the client
@@ -76,6 +78,83 @@ class ScriptEval:
             # Raise error on the plugin-side
             raise grpc.RpcError(grpc.StatusCode.UNIMPLEMENTED, msg)
 
+    def evaluate_aggregation(self, context, plan, request):
+        """
+        Evaluates the script once, with all rows of the request.
+        :param context: the context sent from client
+        :param plan: the CallPlan of the script header
+        :param request: an iterable sequence of BundledRows
+        :return: a RowData of string dual
+        """
+        # The string values of each row are extracted by the function prepared in the plan
+        extract_row = plan.extract_row
+        all_rows = [extract_row(row.duals) for request_rows in request for row in request_rows.rows]
+
+        # Evaluate script based on data from all rows
+        params = [list(param) for param in zip(*all_rows)]
+        return self.evaluate(context, plan, params=params)
+
+    def evaluate_rows(self, context, plan, request):
+        """
+        Evaluates the script row wise. An elementwise script is evaluated over the columns of each bundle at once, see
+        ssecommon.vectorize. Other scripts, and the bundles with a row the whole-column evaluation failed on, are
+        evaluated row by row. The rows sent from Qlik repeat the same values, so the script is then evaluated once per
+        distinct combination of parameter values, and the result reused for the other rows with the same values.
+        :param context: the context sent from client
+        :param plan: the CallPlan of the script header
+        :param request: an iterable sequence of BundledRows
+        :return: generator of BundledRows
+        """
+        if plan.ret_type != ReturnType.String:
+            # Raises the error of an unsupported return type
+            self.evaluate(context, plan)
+
+        code = plan.code
+        results = DistinctMapper(lambda params: eval(code, {'args': list(params)}))
+        # The results of the bundles are collected into response bundles of a bounded size
+        bundler = ColumnBundler()
+
+        # Iterate over bundled rows
+        for request_rows in request:
+            try:
+                columns = decode_bundle(request_rows, plan.data_types)
+            except ValueError as e:
+                # Make sure the error handling, including logging, works as intended in the client
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                # Raise error on the plugin-side
+                raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+            result = None
+            if plan.vectorized is not None:
+                try:
+                    result = self.string_column(plan.vectorized(columns))
+                except Exception as e:
+                    # The rows of the bundle are evaluated one by one, raising the error of the failing row
+                    logging.debug('Evaluating the bundle row by row, whole-column evaluation failed: {}'.format(e))
+                if result is None:
+                    logging.debug('Evaluating the bundle row by row, whole-column evaluation did not return strings')
+            if result is None:
+                # The parameter values of each row, as a tuple
+                result = results.map(list(zip(*columns)))
+            yield from bundler.add(result)
+        yield bundler.flush()
+
+    @staticmethod
+    def string_column(result):
+        """
+        :param result: the result of the whole-column evaluation of a script, one value per row
+        :return: the result as an object array, or None if a value is not a string. The script is then evaluated row
+        by row, so that a result of another type is reported as for a single row rather than converted to a string
+        """
+        if not isinstance(result, numpy.ndarray) or result.dtype != object:
+            values = result
+            result = numpy.empty(len(values), dtype=object)
+            result[:] = list(values)
+        if all(isinstance(value, str) for value in result.tolist()):
+            return result
+        return None
+
     @staticmethod
     def get_func_type(header):
         """
@@ -91,31 +170,6 @@ class ScriptEval:
         elif func_type == SSE.TENSOR:
             return FunctionType.Tensor
 
-    @staticmethod
-    def get_arguments(context, arg_types, duals):
-        """
-        Gets the array of arguments based on
-        the duals, and the type (string, numeric)
-        specified in the header.
-        :param context: the context sent from client
-        :param arg_types: argument types
-        :param duals: an iterable sequence of duals.
-        :return: list of string arguments
-        """
-        if arg_types == ArgType.String:
-            # All parameters are of string type
-            script_args = [d.strData for d in duals]
-        else:
-            # This plugin does not support other arg types than string
-            # Make sure the error handling, including logging, works as intended in the client
-            msg = 'Argument type {} is not supported in this plugin.'.format(arg_types)
-            context.set_code(grpc.StatusCode.UNIMPLEMENTED)
-            context.set_details(msg)
-            # Raise error on the plugin-side
-            raise grpc.RpcError(grpc.StatusCode.UNIMPLEMENTED, msg)
-
-        return script_args
-
     @staticmethod
     def get_arg_types(header):
         """
@@ -152,27 +206,26 @@ class ScriptEval:
             return ReturnType.Undefined
 
     @staticmethod
-    def evaluate(context, script, ret_type, params=[]):
+    def evaluate(context, plan, params=[]):
         """
         Evaluates a script with given parameters.
         :param context: the context sent from client
-        :param script:  script to evaluate
-        :param ret_type: return data type
+        :param plan: the CallPlan, with the compiled script and the return type
         :param params: params to evaluate. Default: []
         :return: a RowData of string dual
         """
-        if ret_type == ReturnType.String:
-            # Evaluate script
-            result = eval(script, {'args': params})
+        if plan.ret_type == ReturnType.String:
+            # Evaluate script, compiled once for the plan
+            result = eval(plan.code, {'args': params})
             # Transform the result to an iterable of Dual data with a string value
-            duals = iter([SSE.Dual(strData=result)])
+            duals = iter([plan.encode(result)])
 
             # Create row data out of duals
             return SSE.BundledRows(rows=[SSE.Row(duals=duals)])
         else:
             # This plugin does not support other return types than string
             # Make sure the error handling, including logging, works as intended in the client
-            msg = 'Return type {} is not supported in this plugin.'.format(ret_type)
+            msg = 'Return type {} is not supported in this plugin.'.format(plan.ret_type)
             context.set_code(grpc.StatusCode.UNIMPLEMENTED)
             context.set_details(msg)
             # Raise error on the plugin-side
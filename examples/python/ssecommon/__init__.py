@@ -0,0 +1,14 @@
+"""
+Shared building blocks for the Python SSE example plugins.
+
+The examples add the parent folder of this package to the module path, in the same way as they add the
+generated folder, and import the modules they need, e.g. `from ssecommon.columnar import ColumnDecoder`.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GENERATED_DIR = os.path.join(PARENT_DIR, 'generated')
+if GENERATED_DIR not in sys.path:
+    sys.path.append(GENERATED_DIR)
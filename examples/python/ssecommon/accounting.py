@@ -0,0 +1,281 @@
+"""
+Accounting of the resources used by each Qlik app and user, and quotas limiting the calls of an app.
+
+Qlik sends a CommonRequestHeader, with the appId and userId of the call, as metadata of every ExecuteFunction and
+EvaluateScript call. The InstrumentedServicer of ssecommon.metrics parses it once per call and records, per app and
+user:
+- the number of calls, and of calls rejected by a quota,
+- the CPU seconds spent by the threads serving the calls, and the duration of the calls,
+- the rows received and sent,
+- the size of the largest request of a call, in serialized bytes, which is what the decoded columns of a call take
+  in memory.
+The CPU time of scripts evaluated in a process pool is not included. The usage of an app and user without calls for
+an hour is forgotten, as is the least recently used one beyond 10 000 pairs of app and user, so the memory used does
+not grow with every user that ever called the plugin. Its series then disappear from the metrics.
+
+The quotas apply to an app, whatever its users: the number of its calls in progress at the same time, and the CPU
+seconds its calls used within a sliding window of time. A call of an app over its quota is rejected, before any of
+its rows are read, so that a runaway app does not take the capacity of the plugin from the other apps. With
+ssecommon.prefork each worker process enforces the quotas on its own calls.
+"""
+import threading
+from collections import OrderedDict, deque
+from time import monotonic
+
+# Seconds after the last call of an app and user that its usage is kept
+DEFAULT_IDLE_SECONDS = 3600.0
+# Maximum number of pairs of app and user whose usage is kept
+DEFAULT_MAX_ENTRIES = 10000
+
+_USAGE = (
+    ('calls', 'counter', 'sse_app_calls_total', 'Number of calls of the app and user.'),
+    ('rejected', 'counter', 'sse_app_rejected_total', 'Number of calls of the app and user rejected by a quota.'),
+    ('cpu_seconds', 'counter', 'sse_app_cpu_seconds_total', 'CPU seconds of the threads serving the calls.'),
+    ('wall_seconds', 'counter', 'sse_app_wall_seconds_total', 'Seconds from the start to the end of the calls.'),
+    ('rows_in', 'counter', 'sse_app_rows_in_total', 'Number of rows received.'),
+    ('rows_out', 'counter', 'sse_app_rows_out_total', 'Number of rows sent.'),
+    ('peak_bytes_in', 'gauge', 'sse_app_peak_request_bytes', 'Serialized bytes of the largest request of a call.'),
+)
+
+
+class QuotaExceeded(Exception):
+    """
+    Raised when a call is rejected because its app is over a quota.
+    """
+
+
+class Quotas:
+    """
+    The limits of the calls of each app. A limit of None is not enforced.
+    """
+
+    def __init__(self, max_calls=None, cpu_seconds=None, window=60.0):
+        """
+        Class initializer.
+        :param max_calls: maximum number of calls of an app in progress at the same time
+        :param cpu_seconds: maximum number of CPU seconds the calls of an app may use within the window
+        :param window: length, in seconds, of the sliding window of the CPU quota
+        """
+        self.max_calls = max_calls
+        self.cpu_seconds = cpu_seconds
+        self.window = window
+
+
+class AppUsage:
+    """
+    The resources used by the calls of one app and user.
+    """
+
+    def __init__(self):
+        for name, _, _, _ in _USAGE:
+            setattr(self, name, 0)
+
+
+class _CpuWindow:
+    """
+    The CPU seconds used within a sliding window of time.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._entries = deque()  # (time, seconds)
+        self._total = 0.0
+
+    def add(self, now, seconds):
+        self._entries.append((now, seconds))
+        self._total += seconds
+
+    def total(self, now):
+        """
+        :param now: the current time.monotonic()
+        :return: the CPU seconds used since now - window
+        """
+        entries = self._entries
+        while entries and entries[0][0] < now - self.window:
+            self._total -= entries.popleft()[1]
+        if not entries:
+            # Forget the rounding errors of the running total
+            self._total = 0.0
+        return self._total
+
+
+class CallAccount:
+    """
+    Records the resources used by one call in the usage of its app and user.
+    """
+
+    def __init__(self, accounting, app, user):
+        self._accounting = accounting
+        self.app = app
+        self.user = user
+
+    def add_cpu(self, seconds):
+        """
+        :param seconds: CPU seconds used by the call since the last time
+        """
+        self._accounting._add_cpu(self.app, self.user, seconds)
+
+    def finish(self, wall_seconds, rows_in, rows_out, bytes_in):
+        """
+        Records the end of the call.
+        :param wall_seconds: duration of the call
+        :param rows_in: number of rows received
+        :param rows_out: number of rows sent
+        :param bytes_in: serialized bytes received
+        """
+        self._accounting._finish(self, wall_seconds, rows_in, rows_out, bytes_in)
+
+
+class Accounting:
+    """
+    A thread safe registry of the usage of each app and user, enforcing the quotas of the apps.
+    """
+
+    def __init__(self, quotas=None, idle_seconds=DEFAULT_IDLE_SECONDS, max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        Class initializer.
+        :param quotas: the Quotas of each app, None for no limits
+        :param idle_seconds: seconds after the last call of an app and user that its usage is forgotten
+        :param max_entries: maximum number of pairs of app and user whose usage is kept, the least recently used is
+        forgotten first
+        """
+        self.quotas = Quotas() if quotas is None else quotas
+        self.idle_seconds = idle_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._usage = OrderedDict()  # (app, user) -> AppUsage, the least recently used first
+        self._last_used = {}  # (app, user) -> time.monotonic() of the last use of the usage
+        self._in_flight = {}  # app -> number of calls in progress, apps without calls in progress are left out
+        self._cpu = OrderedDict()  # app -> _CpuWindow, only with a CPU quota, the least recently used first
+
+    def __len__(self):
+        """
+        :return: number of pairs of app and user whose usage is kept
+        """
+        return len(self._usage)
+
+    def _get_usage(self, app, user, now):
+        # The caller holds the lock
+        key = (app, user)
+        usage = self._usage.get(key)
+        if usage is None:
+            usage = self._usage[key] = AppUsage()
+        else:
+            self._usage.move_to_end(key)
+        self._last_used[key] = now
+        return usage
+
+    def _expire(self, now, adding):
+        """
+        Forgets the usage of the apps and users without calls within idle_seconds, and the least recently used beyond
+        max_entries, and the CPU windows of the apps without CPU seconds within the window. The caller holds the lock.
+        :param now: the current time.monotonic()
+        :param adding: whether the usage of another app and user is about to be added
+        """
+        usage = self._usage
+        max_entries = self.max_entries - 1 if adding else self.max_entries
+        while usage:
+            key = next(iter(usage))
+            if len(usage) <= max_entries and self._last_used[key] >= now - self.idle_seconds:
+                break
+            del usage[key]
+            del self._last_used[key]
+        cpu = self._cpu
+        while cpu:
+            app = next(iter(cpu))
+            if cpu[app].total(now):
+                break
+            del cpu[app]
+
+    def usage(self, app, user):
+        """
+        :param app: the appId
+        :param user: the userId
+        :return: a copy of the AppUsage of the app and user, zero if it has not called recently
+        """
+        copy = AppUsage()
+        with self._lock:
+            usage = self._usage.get((app, user))
+            if usage is not None:
+                copy.__dict__.update(usage.__dict__)
+        return copy
+
+    def start(self, app, user):
+        """
+        Admits a call of the app and user.
+        :param app: the appId of the call, from the CommonRequestHeader
+        :param user: the userId of the call
+        :return: the CallAccount of the call
+        :raise QuotaExceeded: if the app is over a quota, the call is counted as rejected
+        """
+        quotas = self.quotas
+        now = monotonic()
+        with self._lock:
+            self._expire(now, (app, user) not in self._usage)
+            usage = self._get_usage(app, user, now)
+            in_flight = self._in_flight.get(app, 0)
+            cpu = self._cpu.get(app)
+            cpu_seconds = cpu.total(now) if cpu is not None else 0.0
+
+            if quotas.max_calls is not None and in_flight >= quotas.max_calls:
+                usage.rejected += 1
+                raise QuotaExceeded('App {} has {} calls in progress, its quota is {}'
+                                    .format(app, in_flight, quotas.max_calls))
+            if quotas.cpu_seconds is not None and cpu_seconds >= quotas.cpu_seconds:
+                usage.rejected += 1
+                raise QuotaExceeded('App {} used {:.1f} CPU seconds in the last {:g} seconds, its quota is {:g}'
+                                    .format(app, cpu_seconds, quotas.window, quotas.cpu_seconds))
+
+            usage.calls += 1
+            self._in_flight[app] = in_flight + 1
+        return CallAccount(self, app, user)
+
+    def _add_cpu(self, app, user, seconds):
+        now = monotonic()
+        with self._lock:
+            self._get_usage(app, user, now).cpu_seconds += seconds
+            if self.quotas.cpu_seconds is None:
+                # The CPU seconds within the window are only needed to enforce the quota
+                return
+            cpu = self._cpu.get(app)
+            if cpu is None:
+                cpu = self._cpu[app] = _CpuWindow(self.quotas.window)
+            else:
+                self._cpu.move_to_end(app)
+            cpu.add(now, seconds)
+
+    def _finish(self, account, wall_seconds, rows_in, rows_out, bytes_in):
+        app = account.app
+        with self._lock:
+            usage = self._get_usage(app, account.user, monotonic())
+            usage.wall_seconds += wall_seconds
+            usage.rows_in += rows_in
+            usage.rows_out += rows_out
+            usage.peak_bytes_in = max(usage.peak_bytes_in, bytes_in)
+            if self._in_flight[app] > 1:
+                self._in_flight[app] -= 1
+            else:
+                del self._in_flight[app]
+
+    def render(self):
+        """
+        :return: list of the lines of the usage of each app and user, in the Prometheus text exposition format
+        """
+        with self._lock:
+            usage = sorted((key, dict(value.__dict__)) for key, value in self._usage.items())
+
+        lines = []
+        for name, metric_type, metric, description in _USAGE:
+            lines.append('# HELP {} {}'.format(metric, description))
+            lines.append('# TYPE {} {}'.format(metric, metric_type))
+            for (app, user), values in usage:
+                lines.append('{}{{app="{}",user="{}"}} {!r}'.format(metric, _escape(app), _escape(user), values[name]))
+        return lines
+
+
+def _escape(value):
+    """
+    :param value: a label value, e.g. an app id, which is a file path in QlikView
+    :return: the value escaped for the Prometheus text exposition format
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
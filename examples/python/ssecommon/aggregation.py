@@ -0,0 +1,167 @@
+"""
+Incremental aggregation functions.
+
+An aggregation function, Type 1 in functions.json, returns a single value computed over all rows sent from Qlik.
+Rather than collecting every value before reducing them, an Aggregator keeps a small state that is updated with the
+decoded columns of each bundle as it arrives, so memory does not grow with the number of rows.
+
+A plugin binds an Aggregator class to the definition of a function by giving the class as the implementation of
+the function id, see ssecommon.capabilities. The aggregator is then created for the parameters and return type of
+that definition, and created again when the function definitions file is reloaded.
+"""
+import grpc
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.columnar import iter_bundles
+
+
+class Aggregator:
+    """
+    Base class of aggregation functions. Subclasses implement init, update and finalize.
+
+    An instance is called as the ExecuteFunction implementation of the function, with the request and the context,
+    and yields the result as one row with one value.
+    """
+
+    def __init__(self, data_types, return_type):
+        """
+        Class initializer.
+        :param data_types: list of SSE.DataType, one per parameter of the function
+        :param return_type: SSE.DataType of the result
+        """
+        self.data_types = list(data_types)
+        self.return_type = return_type
+
+    @classmethod
+    def for_definition(cls, definition):
+        """
+        Creates the aggregator of a function definition, an aggregation (Type 1) in functions.json.
+        :param definition: the function definition
+        :return: an instance of the class aggregating the parameters of the function
+        :raise ValueError: if the function is not an aggregation, or its return type is not that of the class
+        """
+        if definition['Type'] != SSE.AGGREGATION:
+            raise ValueError('{} is implemented by {}, but is not an aggregation'.format(definition['Name'],
+                                                                                         cls.__name__))
+        # Qlik sends the parameters ordered by name, see ssecommon.capabilities.build_capabilities
+        aggregator = cls(data_types=[data_type for _, data_type in sorted(definition['Params'].items())])
+        if definition['ReturnType'] != aggregator.return_type:
+            raise ValueError('ReturnType of {} is {}, {} returns {}'.format(
+                definition['Name'], definition['ReturnType'], cls.__name__, aggregator.return_type))
+        return aggregator
+
+    def init(self):
+        """
+        :return: the state of an aggregation over no rows
+        """
+        raise NotImplementedError
+
+    def update(self, state, columns):
+        """
+        Adds the rows of a bundle to the state.
+        :param state: the state of the rows aggregated so far
+        :param columns: the decoded columns of the bundle, see ssecommon.columnar
+        :return: the updated state
+        """
+        raise NotImplementedError
+
+    def finalize(self, state):
+        """
+        :param state: the state of all rows
+        :return: the result, a number, a string or a tuple (number, string) for a dual
+        """
+        raise NotImplementedError
+
+    def aggregate(self, bundles):
+        """
+        :param bundles: an iterable of decoded bundles, each a list of columns
+        :return: the result of the aggregation over all bundles
+        """
+        state = self.init()
+        for columns in bundles:
+            state = self.update(state, columns)
+        return self.finalize(state)
+
+    def to_dual(self, result):
+        """
+        :param result: the result of finalize
+        :return: the result as a Dual of the return type
+        """
+        if self.return_type == SSE.STRING:
+            return SSE.Dual(strData=result)
+        elif self.return_type == SSE.NUMERIC:
+            return SSE.Dual(numData=result)
+        else:
+            return SSE.Dual(numData=result[0], strData=result[1])
+
+    def __call__(self, request, context):
+        """
+        Aggregates the rows of an ExecuteFunction request.
+        :param request: an iterable sequence of BundledRows
+        :param context: the context sent from client
+        :return: generator of one BundledRows with the result
+        """
+        try:
+            result = self.aggregate(iter_bundles(request, self.data_types))
+        except ValueError as e:
+            # Make sure the error handling, including logging, works as intended in the client
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            # Raise error on the plugin-side
+            raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+        yield SSE.BundledRows(rows=[SSE.Row(duals=[self.to_dual(result)])])
+
+
+class Sum(Aggregator):
+    """
+    Sum of a numerical column.
+    """
+
+    def __init__(self, column=0, data_types=(SSE.NUMERIC,)):
+        """
+        Class initializer.
+        :param column: index of the parameter to sum
+        :param data_types: list of SSE.DataType, one per parameter of the function
+        """
+        super().__init__(data_types, SSE.NUMERIC)
+        self.column = column
+
+    def init(self):
+        return 0.0
+
+    def update(self, state, columns):
+        return state + float(columns[self.column].sum())
+
+    def finalize(self, state):
+        return state
+
+
+class Join(Aggregator):
+    """
+    Concatenation of the values of a string column.
+    """
+
+    def __init__(self, separator=', ', column=0, data_types=(SSE.STRING,)):
+        """
+        Class initializer.
+        :param separator: string put between the values
+        :param column: index of the parameter to concatenate
+        :param data_types: list of SSE.DataType, one per parameter of the function
+        """
+        super().__init__(data_types, SSE.STRING)
+        self.separator = separator
+        self.column = column
+
+    def init(self):
+        # The values of each bundle joined to a single string, the result itself grows with the number of rows
+        return []
+
+    def update(self, state, columns):
+        values = columns[self.column]
+        if len(values):
+            state.append(self.separator.join(values.tolist()))
+        return state
+
+    def finalize(self, state):
+        return self.separator.join(state)
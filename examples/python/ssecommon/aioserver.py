@@ -0,0 +1,296 @@
+"""
+Serving mode built on grpc.aio, for plugins with many concurrent or slow streams.
+
+In the default mode every ExecuteFunction and EvaluateScript stream occupies a thread of the server's thread pool
+for its whole lifetime, also while it is waiting for rows from Qlik. Here the streams are served by async generator
+methods on a single event loop instead. The rows of a request are received on the event loop and handed to the
+plugin's own implementation, running in a thread pool, bundle by bundle through a bounded queue. A step of the plugin
+is only handed off to a thread once a bundle is there for it, so waiting for rows from Qlik rarely holds a thread.
+At most max_workers steps run the plugin's code at a time. A step reading several bundles, e.g. of an aggregation,
+gives up its worker while it waits for the next one, so that slow streams never keep the others from running.
+"""
+import asyncio
+import logging
+import queue
+import threading
+from concurrent import futures
+
+from grpc import aio
+
+from ssecommon.prefork import REUSE_PORT_OPTIONS
+from ssecommon.serving import read_credentials
+from ssecommon.wire import add_to_server
+
+# Returned by next() when a generator is exhausted
+_DONE = object()
+
+# Put in the queue of a _RequestBridge when the call ended before all rows were received
+_CANCELLED = object()
+
+# Number of received bundles a call buffers before the next is read from the stream
+MAX_BUFFERED_BUNDLES = 4
+
+# Threads of the executor: the steps running on one of the max_workers workers, the steps waiting for a worker and
+# the steps waiting in the middle for a bundle
+MAX_THREADS = 256
+
+
+class SyncContext:
+    """
+    Gives the synchronous plugin code, running in a worker thread, the ServicerContext interface it is written for.
+    """
+
+    def __init__(self, context, loop):
+        """
+        Class initializer.
+        :param context: the grpc.aio ServicerContext of the call
+        :param loop: the event loop serving the call
+        """
+        self._context = context
+        self._loop = loop
+        self.code = None
+        self.details = None
+
+    def invocation_metadata(self):
+        return self._context.invocation_metadata()
+
+    def send_initial_metadata(self, initial_metadata):
+        # Sending metadata is a coroutine in grpc.aio, run it on the event loop and wait for it
+        asyncio.run_coroutine_threadsafe(self._context.send_initial_metadata(initial_metadata), self._loop).result()
+
+    def set_code(self, code):
+        self.code = code
+        self._context.set_code(code)
+
+    def set_details(self, details):
+        self.details = details
+        self._context.set_details(details)
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+class WorkerSlots:
+    """
+    Bounds the number of steps running the plugin's code at the same time, entered by the thread running a step.
+    """
+
+    def __init__(self, max_workers):
+        """
+        Class initializer.
+        :param max_workers: number of steps running at the same time
+        """
+        self._semaphore = threading.Semaphore(max_workers)
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+
+    @property
+    def queued(self):
+        """
+        :return: number of steps waiting for a worker, see ssecommon.metrics
+        """
+        return self._queued
+
+    def acquire(self):
+        if self._semaphore.acquire(blocking=False):
+            return
+        with self._queued_lock:
+            self._queued += 1
+        try:
+            self._semaphore.acquire()
+        finally:
+            with self._queued_lock:
+                self._queued -= 1
+
+    def release(self):
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class _RequestBridge:
+    """
+    Passes the BundledRows of a request stream, received on the event loop, to the synchronous plugin code iterating
+    over them in a worker thread.
+    """
+
+    def __init__(self, request_iterator, loop, slots, max_buffered=MAX_BUFFERED_BUNDLES):
+        """
+        Class initializer.
+        :param request_iterator: async iterator of the BundledRows sent from Qlik
+        :param loop: the event loop serving the call
+        :param slots: the WorkerSlots of the steps of the plugin
+        :param max_buffered: number of received bundles kept before the next is read from the stream
+        """
+        self._request_iterator = request_iterator
+        self._loop = loop
+        self._slots = slots
+        self._queue = queue.Queue()
+        # Bounds the bundles in the queue, released by the worker thread as it takes them
+        self._free = asyncio.Semaphore(max_buffered)
+        self._received = asyncio.Event()
+        self._task = loop.create_task(self._pump())
+
+    async def _pump(self):
+        try:
+            async for bundled_rows in self._request_iterator:
+                await self._free.acquire()
+                self._put(bundled_rows)
+        except Exception as e:
+            # E.g. the call was cancelled by Qlik, raised in the thread reading the rows
+            self._put(e)
+        else:
+            self._put(_DONE)
+
+    def _put(self, item):
+        self._queue.put(item)
+        self._received.set()
+
+    async def wait_ready(self):
+        """
+        Waits until a bundle, or the end of the stream, is there for the plugin to read.
+        """
+        while self._queue.empty() and not self._task.done():
+            self._received.clear()
+            await self._received.wait()
+
+    def close(self):
+        """
+        Stops reading the stream and ends a plugin waiting for rows, at the end of the call.
+        """
+        self._task.cancel()
+        self._queue.put(_CANCELLED)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            item = self._queue.get_nowait()
+        except queue.Empty:
+            # The step reads more bundles than have been received, let the steps of other calls run while it waits
+            self._slots.release()
+            try:
+                item = self._queue.get()
+            finally:
+                self._slots.acquire()
+        if item is _DONE or item is _CANCELLED:
+            # Also the next calls of next() end
+            self._queue.put(item)
+            if item is _CANCELLED:
+                raise RuntimeError('The call ended before all rows were received')
+            raise StopIteration
+        if isinstance(item, Exception):
+            self._queue.put(_CANCELLED)
+            raise item
+        self._loop.call_soon_threadsafe(self._free.release)
+        return item
+
+
+class AsyncServicer:
+    """
+    Serves a synchronous ExtensionService with async generator methods.
+    """
+
+    def __init__(self, servicer, executor, max_workers):
+        """
+        Class initializer.
+        :param servicer: the plugin's ExtensionService
+        :param executor: executor running the CPU bound steps of the servicer, with more threads than max_workers
+        :param max_workers: number of steps running the plugin's code at the same time
+        """
+        self.servicer = servicer
+        self.executor = executor
+        self.slots = WorkerSlots(max_workers)
+
+    def _run(self, func, *args):
+        with self.slots:
+            return func(*args)
+
+    async def GetCapabilities(self, request, context):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._run, self.servicer.GetCapabilities, request,
+                                          SyncContext(context, loop))
+
+    async def ExecuteFunction(self, request_iterator, context):
+        async for response in self._stream(self.servicer.ExecuteFunction, request_iterator, context):
+            yield response
+
+    async def EvaluateScript(self, request_iterator, context):
+        async for response in self._stream(self.servicer.EvaluateScript, request_iterator, context):
+            yield response
+
+    async def _stream(self, method, request_iterator, context):
+        """
+        Runs the synchronous method in the executor, passing it the rows of the request as they are received and
+        yielding each response as soon as it is produced.
+        :param method: servicer method taking an iterator of BundledRows and the context
+        :param request_iterator: async iterator of the BundledRows sent from Qlik
+        :param context: the grpc.aio ServicerContext
+        :return: async generator of BundledRows
+        """
+        loop = asyncio.get_event_loop()
+        sync_context = SyncContext(context, loop)
+        requests = _RequestBridge(request_iterator, loop, self.slots)
+
+        try:
+            responses = await loop.run_in_executor(self.executor, self._run, method, requests, sync_context)
+            responses = iter(responses)
+            while True:
+                # Most steps of the plugin read a bundle first, do not hold a thread waiting for it
+                await requests.wait_ready()
+                response = await loop.run_in_executor(self.executor, self._run, next, responses, _DONE)
+                if response is _DONE:
+                    break
+                yield response
+        except Exception as e:
+            if sync_context.code is None:
+                raise
+            # The plugin set a status code before raising, as the sync server would, pass it on to Qlik
+            logging.error('{}: {}'.format(sync_context.code, sync_context.details or e))
+            await context.abort(sync_context.code, sync_context.details or '')
+        finally:
+            requests.close()
+
+
+async def serve(servicer, port, pem_dir, max_workers=10, metrics=None, reuse_port=False):
+    """
+    Sets up and runs a grpc.aio server for the servicer until it is stopped.
+    :param servicer: the plugin's ExtensionService
+    :param port: port to listen on.
+    :param pem_dir: Directory including certificates
+    :param max_workers: number of steps of the calls running the plugin's code at the same time
+    :param metrics: ssecommon.metrics.Metrics recording the calls, None to not record metrics
+    :param reuse_port: let the worker processes of ssecommon.prefork listen on the same port
+    :return: None
+    """
+    server = aio.server(options=REUSE_PORT_OPTIONS if reuse_port else None)
+    executor = futures.ThreadPoolExecutor(max_workers=max(MAX_THREADS, max_workers))
+    if metrics is None:
+        add_to_server(AsyncServicer(servicer, executor, max_workers), server)
+    else:
+        async_servicer = AsyncServicer(metrics.instrument(servicer), executor, max_workers)
+        # The calls waiting for a worker are counted as those waiting for a thread of the threaded server
+        metrics.executor = async_servicer.slots
+        metrics.add_to_server(async_servicer, server)
+
+    if pem_dir:
+        # Secure connection
+        server.add_secure_port('[::]:{}'.format(port), read_credentials(pem_dir))
+        logging.info('*** Running asyncio server in secure mode on port: {} ***'.format(port))
+    else:
+        # Insecure connection
+        server.add_insecure_port('[::]:{}'.format(port))
+        logging.info('*** Running asyncio server in insecure mode on port: {} ***'.format(port))
+
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+        executor.shutdown(wait=False)
@@ -0,0 +1,158 @@
+"""
+Conversion between the BundledRows streams of Qlik and Apache Arrow record batches. Requires pyarrow.
+
+The parameters are typed from ScriptRequestHeader.params, through the columns decoded by ssecommon.columnar, and named
+after them: numeric parameters become float64 arrays, string parameters string arrays and dual parameters struct
+arrays with a float64 field 'num' and a string field 'str'. The numerical buffers are handed to Arrow without copying.
+A result is typed from the fields of a TableDescription, or from the Arrow types of its columns, and encoded into
+bundles of a bounded size.
+
+A full script with the comment '# qlik-data: arrow', see ssecommon.callplan.is_arrow_script, receives its parameters
+as a pyarrow.Table and may return one.
+"""
+import pyarrow
+import pyarrow.compute
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.bundler import DEFAULT_MAX_BYTES, DEFAULT_MAX_ROWS, encode_columns
+from ssecommon.columnar import DualColumn, decode_bundle
+
+DUAL_TYPE = pyarrow.struct([('num', pyarrow.float64()), ('str', pyarrow.string())])
+
+
+def data_type(arrow_data_type):
+    """
+    :param arrow_data_type: a pyarrow.DataType
+    :return: the SSE.DataType a column of the Arrow type is sent as
+    """
+    if arrow_data_type == DUAL_TYPE:
+        return SSE.DUAL
+    elif pyarrow.types.is_integer(arrow_data_type) or pyarrow.types.is_floating(arrow_data_type) or \
+            pyarrow.types.is_boolean(arrow_data_type) or pyarrow.types.is_decimal(arrow_data_type):
+        return SSE.NUMERIC
+    return SSE.STRING
+
+
+def to_arrow_array(column):
+    """
+    :param column: a decoded column, see ssecommon.columnar
+    :return: a pyarrow.Array, float64 arrays are wrapped without copying
+    """
+    if isinstance(column, DualColumn):
+        return pyarrow.StructArray.from_arrays([pyarrow.array(column.numbers), to_arrow_array(column.strings)],
+                                               ['num', 'str'])
+    elif column.dtype == object:
+        return pyarrow.array(column, type=pyarrow.string())
+    return pyarrow.array(column)
+
+
+def to_record_batch(columns, names):
+    """
+    :param columns: the decoded parameter columns, see ssecommon.columnar
+    :param names: the names of the parameters, which are not necessarily unique
+    :return: a pyarrow.RecordBatch
+    """
+    return pyarrow.RecordBatch.from_arrays([to_arrow_array(column) for column in columns], names=list(names))
+
+
+def to_table(columns, names):
+    """
+    :param columns: the decoded parameter columns of all rows
+    :param names: the names of the parameters, which are not necessarily unique
+    :return: a pyarrow.Table
+    """
+    return pyarrow.Table.from_arrays([to_arrow_array(column) for column in columns], names=list(names))
+
+
+def record_batches(request, params):
+    """
+    Converts a request bundle by bundle.
+    :param request: an iterable sequence of BundledRows
+    :param params: the parameters of the request, e.g. ScriptRequestHeader.params
+    :return: generator of pyarrow.RecordBatch, one per bundle
+    """
+    names = [param.name for param in params]
+    data_types = [param.dataType for param in params]
+    for bundled_rows in request:
+        yield to_record_batch(decode_bundle(bundled_rows, data_types), names)
+
+
+def from_arrow_array(array, to_type):
+    """
+    :param array: a pyarrow.Array or pyarrow.ChunkedArray
+    :param to_type: SSE.DataType the column is sent as
+    :return: a column that can be encoded, see ssecommon.columnar.encode_bundle
+    """
+    if isinstance(array, pyarrow.ChunkedArray):
+        array = array.combine_chunks()
+    if to_type == SSE.DUAL:
+        if array.type == DUAL_TYPE:
+            return DualColumn(from_arrow_array(array.field('num'), SSE.NUMERIC),
+                              from_arrow_array(array.field('str'), SSE.STRING))
+        return DualColumn(from_arrow_array(array, SSE.NUMERIC), from_arrow_array(array, SSE.STRING))
+    elif to_type == SSE.NUMERIC:
+        if array.type == DUAL_TYPE:
+            array = array.field('num')
+        # Missing values are sent as NaN, which Qlik shows as null
+        return array.cast(pyarrow.float64()).to_numpy(zero_copy_only=False)
+    if array.type == DUAL_TYPE:
+        array = array.field('str')
+    strings = array.cast(pyarrow.string()).to_numpy(zero_copy_only=False)
+    # Missing values are sent as empty strings
+    strings[pyarrow.compute.is_null(array).to_numpy(zero_copy_only=False)] = ''
+    return strings
+
+
+def table_description(arrow_schema, name=''):
+    """
+    :param arrow_schema: the pyarrow.Schema of a result
+    :param name: name of the table
+    :return: an SSE.TableDescription with a field per column
+    """
+    table = SSE.TableDescription(name=name)
+    for field in arrow_schema:
+        table.fields.add(name=field.name, dataType=data_type(field.type))
+    return table
+
+
+def encode_table(table, data_types=None, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Encodes a pyarrow.Table or RecordBatch into BundledRows messages of a bounded size, see
+    ssecommon.bundler.encode_columns.
+    :param table: the result
+    :param data_types: list of SSE.DataType, one per column, e.g. from TableDescription.fields. Default: from the
+    Arrow types of the columns
+    :param max_bytes: target encoded size of a message
+    :param max_rows: maximum number of rows of a message
+    :return: generator of SerializedRows, see ssecommon.wire
+    """
+    if data_types is None:
+        data_types = [data_type(field.type) for field in table.schema]
+    columns = [from_arrow_array(table.column(i), to_type) for i, to_type in enumerate(data_types)]
+    return encode_columns(columns, max_bytes, max_rows)
+
+
+def encode_result(result, data_types=None, return_type=None, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Encodes the result of a script that returned Arrow data.
+    :param result: a pyarrow.Table, RecordBatch, Array or ChunkedArray
+    :param data_types: list of SSE.DataType, one per column, e.g. from TableDescription.fields
+    :param return_type: SSE.DataType of all columns, the return type of the function, if data_types is None.
+    Default: from the Arrow types of the columns
+    :param max_bytes: target encoded size of a message
+    :param max_rows: maximum number of rows of a message
+    :return: list of SerializedRows or BundledRows, at least one
+    """
+    if isinstance(result, (pyarrow.Array, pyarrow.ChunkedArray)):
+        result = pyarrow.table({'result': result})
+    if data_types is None and return_type is not None:
+        data_types = [return_type] * result.num_columns
+    return list(encode_table(result, data_types, max_bytes, max_rows)) or [SSE.BundledRows()]
+
+
+def is_arrow_data(result):
+    """
+    :param result: the result of a script
+    :return: True if the result is Arrow data that encode_result can encode
+    """
+    return isinstance(result, (pyarrow.Table, pyarrow.RecordBatch, pyarrow.Array, pyarrow.ChunkedArray))
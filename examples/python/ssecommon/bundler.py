@@ -0,0 +1,313 @@
+"""
+Bundling of the rows sent back to Qlik.
+
+Sending every row in a BundledRows message of its own wastes framing and system calls, while sending a whole result
+in one message fails for results larger than the gRPC message size limit, 4 MB by default. A ResponseBundler
+collects the rows and starts a new bundle when the current one reaches a target encoded size or number of rows. The
+encoded size of each row is estimated from its values as the row is added, without serializing it.
+
+A result computed as whole columns is split by encode_columns with the same rule and the same estimate, computed for
+all rows at once, and each bundle serialized directly from the columns, see ssecommon.wire. The results
+of the bundles of a request are collected by a ColumnBundler, so that they are sent in as few bundles as a whole
+column.
+"""
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.columnar import DualColumn
+from ssecommon.wire import serialize_columns
+
+# Well below the default gRPC message size limit of 4 MB
+DEFAULT_MAX_BYTES = 1024 * 1024
+DEFAULT_MAX_ROWS = 10000
+
+
+def _varint_size(value):
+    """
+    :param value: a non negative integer
+    :return: number of bytes of the protobuf varint encoding of value
+    """
+    return max((value.bit_length() + 6) // 7, 1)
+
+
+def _field_size(size):
+    """
+    :param size: encoded size of an embedded message or string
+    :return: encoded size of the field, including its tag and length prefix
+    """
+    return 1 + _varint_size(size) + size
+
+
+def _string_size(string):
+    """
+    :param string: a str
+    :return: encoded size of the string as the strData field of a Dual, 0 for an empty string
+    """
+    if not string:
+        return 0
+    return _field_size(len(string) if string.isascii() else len(string.encode('utf-8')))
+
+
+def dual_size(dual):
+    """
+    :param dual: a Dual message
+    :return: encoded size of the Dual message
+    """
+    return (9 if dual.numData else 0) + _string_size(dual.strData)
+
+
+def row_size(duals):
+    """
+    :param duals: the Dual messages of a row
+    :return: encoded size of the row as a field of BundledRows
+    """
+    return _field_size(sum(_field_size(dual_size(dual)) for dual in duals))
+
+
+def _field_sizes(sizes):
+    """
+    :param sizes: int64 array of encoded sizes of embedded messages
+    :return: int64 array of the encoded sizes of the fields, see _field_size
+    """
+    prefix = numpy.ones_like(sizes)
+    for limit in (1 << 7, 1 << 14, 1 << 21, 1 << 28):
+        prefix += sizes >= limit
+    return 1 + prefix + sizes
+
+
+def _cell_sizes(column):
+    """
+    :param column: a float64 array, an object array of strings or a DualColumn, see ssecommon.registry.to_column
+    :return: int64 array of the encoded size of each value of the column as a field of Row, see dual_size
+    """
+    if isinstance(column, DualColumn):
+        sizes = numpy.where(column.numbers != 0, 9, 0).astype(numpy.int64)
+        sizes += numpy.fromiter(map(_string_size, column.strings), dtype=numpy.int64, count=len(column.strings))
+    elif column.dtype == object:
+        sizes = numpy.fromiter(map(_string_size, column), dtype=numpy.int64, count=len(column))
+    else:
+        sizes = numpy.where(column != 0, 9, 0).astype(numpy.int64)
+    return _field_sizes(sizes)
+
+
+def column_row_sizes(columns):
+    """
+    :param columns: list of columns of equal length, see ssecommon.registry.to_column
+    :return: int64 array of the encoded size of each row of the columns as a field of BundledRows, see row_size
+    """
+    return _field_sizes(sum(_cell_sizes(column) for column in columns))
+
+
+def _bundle_ends(sizes, max_bytes, max_rows):
+    """
+    Splits rows into bundles as a ResponseBundler does.
+    :param sizes: int64 array of the encoded size of each row, see column_row_sizes
+    :param max_bytes: target encoded size of a bundle
+    :param max_rows: maximum number of rows in a bundle
+    :return: list of the index of the row after each bundle
+    """
+    # The encoded size of the rows before each row, and after the last one
+    offsets = numpy.concatenate([[0], numpy.cumsum(sizes)])
+    ends = []
+    begin = 0
+    while begin < len(sizes):
+        # The rows up to the last one ending within max_bytes of the first, at least one
+        end = int(numpy.searchsorted(offsets, offsets[begin] + max_bytes, side='right')) - 1
+        begin = min(max(end, begin + 1), begin + max_rows)
+        ends.append(begin)
+    return ends
+
+
+def _slice(column, begin, end):
+    if isinstance(column, DualColumn):
+        return DualColumn(column.numbers[begin:end], column.strings[begin:end])
+    return column[begin:end]
+
+
+def _concatenate(columns):
+    if isinstance(columns[0], DualColumn):
+        return DualColumn(numpy.concatenate([column.numbers for column in columns]),
+                          numpy.concatenate([column.strings for column in columns]))
+    return numpy.concatenate(columns)
+
+
+def encode_columns(columns, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Encodes result columns into bundles of a bounded size, the bundles a ResponseBundler collects from their rows.
+    The messages are serialized directly from the columns, see ssecommon.wire.
+    :param columns: list of columns of equal length, float64 arrays, object arrays of strings or DualColumns
+    :param max_bytes: target encoded size of a bundle. A single row larger than this is sent in a bundle of its own.
+    :param max_rows: maximum number of rows in a bundle
+    :return: generator of SerializedRows, none for columns without rows
+    """
+    if not columns:
+        return
+    begin = 0
+    for end in _bundle_ends(column_row_sizes(columns), max_bytes, max_rows):
+        yield serialize_columns([_slice(column, begin, end) for column in columns])
+        begin = end
+
+
+def encode_column(column, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Encodes a result column into bundles of a bounded size, see encode_columns.
+    :param column: a float64 array, an object array of strings or a DualColumn, see ssecommon.registry.to_column
+    :param max_bytes: target encoded size of a bundle
+    :param max_rows: maximum number of rows in a bundle
+    :return: generator of SerializedRows, none for an empty column
+    """
+    return encode_columns([column], max_bytes, max_rows)
+
+
+class ColumnBundler:
+    """
+    Collects result columns, e.g. one per bundle of a request, into bundles of a bounded size.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+        """
+        Class initializer.
+        :param max_bytes: target encoded size of a bundle. A single row larger than this is sent in a bundle of its own.
+        :param max_rows: maximum number of rows in a bundle
+        """
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.bundles_sent = 0
+        self._columns = []
+        self._sizes = []
+        self._rows = 0
+        self._bytes = 0
+
+    def __len__(self):
+        """
+        :return: number of rows collected and not yet returned in a bundle
+        """
+        return self._rows
+
+    def add(self, column):
+        """
+        Adds the rows of a column.
+        :param column: a float64 array, an object array of strings or a DualColumn, see ssecommon.registry.to_column
+        :return: list of SerializedRows, the bundles that are full with the rows collected
+        """
+        sizes = column_row_sizes([column])
+        self._columns.append(column)
+        self._sizes.append(sizes)
+        self._rows += len(sizes)
+        self._bytes += int(sizes.sum())
+        if self._rows <= self.max_rows and self._bytes <= self.max_bytes:
+            return []
+
+        column = _concatenate(self._columns)
+        sizes = numpy.concatenate(self._sizes)
+        ends = _bundle_ends(sizes, self.max_bytes, self.max_rows)
+        # The rows of the last bundle are kept, the next column may fill it further
+        bundles = []
+        begin = 0
+        for end in ends[:-1]:
+            bundles.append(serialize_columns([_slice(column, begin, end)]))
+            begin = end
+        self._columns = [_slice(column, begin, len(sizes))]
+        self._sizes = [sizes[begin:]]
+        self._rows = len(sizes) - begin
+        self._bytes = int(sizes[begin:].sum())
+        self.bundles_sent += len(bundles)
+        return bundles
+
+    def flush(self):
+        """
+        Returns the collected rows and starts a new bundle.
+        :return: a SerializedRows, empty if no rows were collected
+        """
+        bundle = serialize_columns([_concatenate(self._columns)] if self._columns else [])
+        self._columns = []
+        self._sizes = []
+        self._rows = 0
+        self._bytes = 0
+        self.bundles_sent += 1
+        return bundle
+
+
+class ResponseBundler:
+    """
+    Collects rows into BundledRows messages of a bounded size.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+        """
+        Class initializer.
+        :param max_bytes: target encoded size of a bundle. A single row larger than this is sent in a bundle of its own.
+        :param max_rows: maximum number of rows in a bundle
+        """
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.bundles_sent = 0
+        self._bundle = SSE.BundledRows()
+        self._rows = 0
+        self._bytes = 0
+
+    def __len__(self):
+        """
+        :return: number of rows collected and not yet returned in a bundle
+        """
+        return self._rows
+
+    def add(self, duals):
+        """
+        Adds a row.
+        :param duals: an iterable of Dual messages
+        :return: the collected bundle if it was full before this row was added, otherwise None
+        """
+        duals = list(duals)
+        size = row_size(duals)
+        full = None
+        if self._rows and (self._rows >= self.max_rows or self._bytes + size > self.max_bytes):
+            full = self.flush()
+        self._bundle.rows.add(duals=duals)
+        self._rows += 1
+        self._bytes += size
+        return full
+
+    def flush(self):
+        """
+        Returns the collected rows and starts a new bundle.
+        :return: a BundledRows message, empty if no rows were collected
+        """
+        bundle = self._bundle
+        self._bundle = SSE.BundledRows()
+        self._rows = 0
+        self._bytes = 0
+        self.bundles_sent += 1
+        return bundle
+
+
+def bundle_rows(rows, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Bundles a sequence of rows.
+    :param rows: an iterable of rows, each an iterable of Dual messages
+    :param max_bytes: target encoded size of a bundle
+    :param max_rows: maximum number of rows in a bundle
+    :return: generator of BundledRows, at least one bundle is generated also when there are no rows
+    """
+    bundler = ResponseBundler(max_bytes, max_rows)
+    for duals in rows:
+        bundle = bundler.add(duals)
+        if bundle is not None:
+            yield bundle
+    if len(bundler) or not bundler.bundles_sent:
+        yield bundler.flush()
+
+
+def bundle_columns(columns, max_bytes=DEFAULT_MAX_BYTES, max_rows=DEFAULT_MAX_ROWS):
+    """
+    Bundles the rows of a sequence of columns.
+    :param columns: an iterable of columns, see ColumnBundler.add
+    :param max_bytes: target encoded size of a bundle
+    :param max_rows: maximum number of rows in a bundle
+    :return: generator of SerializedRows, at least one bundle is generated also when there are no rows
+    """
+    bundler = ColumnBundler(max_bytes, max_rows)
+    for column in columns:
+        yield from bundler.add(column)
+    if len(bundler) or not bundler.bundles_sent:
+        yield bundler.flush()
@@ -0,0 +1,212 @@
+"""
+Call plans of script requests.
+
+Qlik sends the same ScriptRequestHeader with every request from a chart. Everything that only depends on the header,
+the parsed header itself, the function, argument and return types, the functions extracting the argument values from
+a row, the function encoding a result value and the compiled script, is worked out once per distinct header and
+reused. The rows are then processed without checking the data types of the parameters again for each row.
+"""
+import re
+import threading
+from collections import OrderedDict
+from operator import attrgetter
+
+import grpc
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.scriptcache import compile_script
+
+SCRIPT_HEADER_KEY = 'qlik-scriptrequestheader-bin'
+
+# A full script with this comment receives its parameters as Arrow data, see ssecommon.arrow
+ARROW_PATTERN = re.compile(r'#\s*qlik-data\s*:\s*arrow')
+
+_get_number = attrgetter('numData')
+_get_string = attrgetter('strData')
+
+
+def _get_dual(dual):
+    return dual.numData, dual.strData
+
+
+_VALUE_GETTERS = {SSE.NUMERIC: _get_number, SSE.STRING: _get_string, SSE.DUAL: _get_dual}
+
+
+def value_getter(data_type):
+    """
+    :param data_type: SSE.DataType of a parameter
+    :return: function returning the value of a dual, a tuple (number, string) for a dual parameter
+    """
+    try:
+        return _VALUE_GETTERS[data_type]
+    except KeyError:
+        raise ValueError('Undefined data type: {}'.format(data_type))
+
+
+def row_extractor(data_types):
+    """
+    Creates the function extracting the argument values from the duals of a row.
+    :param data_types: list of SSE.DataType, one per parameter
+    :return: function taking the duals of a row and returning the list of values
+    """
+    getters = [value_getter(data_type) for data_type in data_types]
+    if set(data_types) == {SSE.NUMERIC}:
+        return lambda duals: [d.numData for d in duals]
+    elif set(data_types) == {SSE.STRING}:
+        return lambda duals: [d.strData for d in duals]
+    # Mixed parameters, each column has its own getter
+    return lambda duals: [get(d) for get, d in zip(getters, duals)]
+
+
+def _encode_number(value):
+    return SSE.Dual(numData=value)
+
+
+def _encode_string(value):
+    return SSE.Dual(strData=value)
+
+
+def _encode_dual(value):
+    # A dual value is a tuple with the numeric and the string representation
+    return SSE.Dual(numData=value[0], strData=value[1])
+
+
+_ENCODERS = {SSE.NUMERIC: _encode_number, SSE.STRING: _encode_string, SSE.DUAL: _encode_dual}
+
+
+def dual_encoder(data_type):
+    """
+    :param data_type: SSE.DataType of the returned values
+    :return: function creating the Dual of a returned value
+    """
+    try:
+        return _ENCODERS[data_type]
+    except KeyError:
+        raise ValueError('Undefined data type: {}'.format(data_type))
+
+
+def is_arrow_script(script):
+    """
+    :param script: the script sent from Qlik
+    :return: True if the script has opted in to receive its parameters as a pyarrow.Table
+    """
+    return ARROW_PATTERN.search(script) is not None
+
+
+class CallPlan:
+    """
+    What a plugin needs to know about a script request before receiving its rows.
+    """
+
+    def __init__(self, header, func_type, arg_types, ret_type, mode='eval'):
+        """
+        Class initializer.
+        :param header: the parsed ScriptRequestHeader
+        :param func_type: the function type, as the plugin represents it
+        :param arg_types: the argument types, as the plugin represents them
+        :param ret_type: the return type, as the plugin represents it
+        :param mode: 'eval' or 'exec', how the script is compiled
+        """
+        self.header = header
+        self.func_type = func_type
+        self.arg_types = arg_types
+        self.ret_type = ret_type
+        self.data_types = [param.dataType for param in header.params]
+        # None if a data type is not defined, the plugin reports that the types are not supported
+        self.extract_row = row_extractor(self.data_types) if set(self.data_types) <= set(_VALUE_GETTERS) else None
+        # Raises ValueError if the return type is not defined, the plugin cannot encode the result
+        self.encode = dual_encoder(header.returnType)
+        self.mode = mode
+        self._code = None
+
+    @property
+    def script(self):
+        return self.header.script
+
+    @property
+    def code(self):
+        """
+        The compiled script. It is compiled when first used, so that a script with a syntax error is only reported
+        if it is evaluated, after the function and data types have been checked.
+        """
+        if self._code is None:
+            self._code = compile_script(self.header.script, self.mode)
+        return self._code
+
+
+class CallPlanCache:
+    """
+    A bounded, thread safe LRU cache of call plans keyed by the serialized ScriptRequestHeader.
+    """
+
+    def __init__(self, build, max_size=256):
+        """
+        Class initializer.
+        :param build: function creating the plan of a parsed ScriptRequestHeader
+        :param max_size: maximum number of plans kept, the least recently used is evicted first
+        """
+        self.build = build
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._plans)
+
+    def get(self, header_bytes):
+        """
+        Retrieves the plan of a header, parsing the header and building the plan on a cache miss.
+        :param header_bytes: the serialized ScriptRequestHeader, as sent in the metadata
+        :return: the plan returned by the build function
+        """
+        with self._lock:
+            plan = self._plans.get(header_bytes)
+            if plan is not None:
+                self._plans.move_to_end(header_bytes)
+                self.hits += 1
+                return plan
+            self.misses += 1
+
+        # Built outside the lock, a concurrent miss of the same header only costs an extra build
+        header = SSE.ScriptRequestHeader()
+        header.ParseFromString(header_bytes)
+        plan = self.build(header)
+
+        with self._lock:
+            self._plans[header_bytes] = plan
+            self._plans.move_to_end(header_bytes)
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+                self.evictions += 1
+        return plan
+
+    def get_from_context(self, context):
+        """
+        :param context: the context sent from client
+        :return: the plan of the ScriptRequestHeader sent in the metadata
+        :raises grpc.RpcError: with the INVALID_ARGUMENT status code if no plan can be built for the header
+        """
+        try:
+            return self.get(dict(context.invocation_metadata())[SCRIPT_HEADER_KEY])
+        except ValueError as e:
+            msg = str(e)
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(msg)
+            raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, msg)
+
+    def stats(self):
+        """
+        :return: dict with the size of the cache and its hit, miss and eviction counters
+        """
+        with self._lock:
+            return {'size': len(self._plans), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        """
+        Removes all plans, the counters are kept.
+        """
+        with self._lock:
+            self._plans.clear()
@@ -0,0 +1,226 @@
+"""
+Capabilities of a plugin built from its function definitions file.
+
+The function definitions are loaded and validated once, and compiled into the Capabilities message returned by
+GetCapabilities and a dispatch table from function id to implementation used by ExecuteFunction. A watcher thread
+rebuilds both when the file changes, and swaps them in as one object, so a call never sees the capabilities of one
+version of the file together with the functions of another. An invalid edit is logged and the previous version is
+kept. The functions registered with the ssecommon.registry decorator are added to those of the file. An
+ssecommon.aggregation.Aggregator class given as the implementation of an aggregation is created for its definition.
+"""
+import json
+import logging
+import os
+import threading
+from collections import namedtuple
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.aggregation import Aggregator
+
+# The Capabilities message and the mapping of function id to implementation, built from the same definitions
+FunctionTable = namedtuple('FunctionTable', ['capabilities', 'dispatch'])
+
+_DATA_TYPES = (SSE.STRING, SSE.NUMERIC, SSE.DUAL)
+_FUNCTION_TYPES = (SSE.SCALAR, SSE.AGGREGATION, SSE.TENSOR)
+
+
+def validate_definitions(definitions, implementations):
+    """
+    Checks the function definitions loaded from a JSON file.
+    :param definitions: the list of function definitions, the 'Functions' of the file
+    :param implementations: mapping of function id to implementation
+    :raise ValueError: describing the first invalid definition
+    """
+    if not isinstance(definitions, list):
+        raise ValueError("'Functions' must be a list of function definitions")
+
+    ids = set()
+    for i, definition in enumerate(definitions):
+        if not isinstance(definition, dict):
+            raise ValueError('Function definition {} is not an object'.format(i))
+        missing = {'Id', 'Name', 'Type', 'ReturnType', 'Params'} - set(definition)
+        if missing:
+            raise ValueError('Function definition {} is missing {}'.format(i, ', '.join(sorted(missing))))
+
+        name = definition['Name']
+        function_id = definition['Id']
+        if not isinstance(name, str) or not name:
+            raise ValueError('Function definition {} has no name'.format(i))
+        if not isinstance(function_id, int) or isinstance(function_id, bool):
+            raise ValueError('Id of {} is not an integer'.format(name))
+        if function_id in ids:
+            raise ValueError('Id {} of {} is used by another function'.format(function_id, name))
+        ids.add(function_id)
+        if function_id not in implementations:
+            raise ValueError('No implementation of {} with id {}'.format(name, function_id))
+        if definition['Type'] not in _FUNCTION_TYPES:
+            raise ValueError('Type of {} is not a function type: {}'.format(name, definition['Type']))
+        if definition['ReturnType'] not in _DATA_TYPES:
+            raise ValueError('ReturnType of {} is not a data type: {}'.format(name, definition['ReturnType']))
+        if not isinstance(definition['Params'], dict):
+            raise ValueError('Params of {} is not an object'.format(name))
+        for param_name, param_type in definition['Params'].items():
+            if param_type not in _DATA_TYPES:
+                raise ValueError('Parameter {} of {} is not a data type: {}'.format(param_name, name, param_type))
+
+
+def build_capabilities(definitions, plugin_identifier, plugin_version, allow_script=True):
+    """
+    :param definitions: the validated function definitions
+    :param plugin_identifier: the pluginIdentifier of the plugin
+    :param plugin_version: the pluginVersion of the plugin
+    :param allow_script: whether the plugin supports script evaluation
+    :return: the Capabilities message
+    """
+    capabilities = SSE.Capabilities(allowScript=allow_script,
+                                    pluginIdentifier=plugin_identifier,
+                                    pluginVersion=plugin_version)
+
+    for definition in definitions:
+        function = capabilities.functions.add()
+        function.name = definition['Name']
+        function.functionId = definition['Id']
+        function.functionType = definition['Type']
+        function.returnType = definition['ReturnType']
+
+        # The parameters are added, and therefore sent from Qlik, ordered by name
+        for param_name, param_type in sorted(definition['Params'].items()):
+            function.params.add(name=param_name, dataType=param_type)
+
+        logging.info('Adding to capabilities: {}({})'.format(function.name, [p.name for p in function.params]))
+
+    return capabilities
+
+
+def bind_implementation(implementation, definition):
+    """
+    :param implementation: a callable taking the request and the context, or an Aggregator class
+    :param definition: the validated function definition of the implementation
+    :return: the callable implementing the function, an Aggregator created for the definition
+    :raise ValueError: if an Aggregator does not match the definition
+    """
+    if isinstance(implementation, type) and issubclass(implementation, Aggregator):
+        return implementation.for_definition(definition)
+    return implementation
+
+
+class CapabilitiesCache:
+    """
+    The FunctionTable of a plugin, rebuilt when the function definitions file changes.
+    """
+
+    def __init__(self, path, implementations, plugin_identifier, plugin_version, allow_script=True, registry=None):
+        """
+        Class initializer. Loads the function definitions, raising an error if they are invalid.
+        :param path: the function definitions JSON file, None if all functions are registered in the registry
+        :param implementations: mapping of function id to a callable taking the request and the context, or to an
+        Aggregator class implementing an aggregation
+        :param plugin_identifier: the pluginIdentifier of the plugin
+        :param plugin_version: the pluginVersion of the plugin
+        :param allow_script: whether the plugin supports script evaluation
+        :param registry: FunctionRegistry with functions defined in addition to those of the file
+        """
+        self.path = path
+        self.implementations = dict(implementations)
+        self.registry = registry
+        self.plugin_identifier = plugin_identifier
+        self.plugin_version = plugin_version
+        self.allow_script = allow_script
+        self._stopped = threading.Event()
+        self._signature = self._file_signature()
+        self._table = self._load()
+
+    @property
+    def capabilities(self):
+        """
+        :return: the Capabilities message of the current function definitions
+        """
+        return self._table.capabilities
+
+    def get_function(self, function_id):
+        """
+        :param function_id: the functionId of the FunctionRequestHeader
+        :return: the implementation of the function, None if no such function is defined
+        """
+        return self._table.dispatch.get(function_id)
+
+    def _file_signature(self):
+        if self.path is None:
+            return None
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        """
+        :return: a FunctionTable built from the function definitions file
+        :raise ValueError: if the file is not valid
+        """
+        definitions = []
+        if self.path is not None:
+            with open(self.path) as json_file:
+                definitions = json.load(json_file).get('Functions', [])
+        implementations = self.implementations
+        if self.registry is not None:
+            # Registered functions are validated together with the file, e.g. an id used in both is an error
+            definitions = list(definitions) + self.registry.definitions()
+            implementations = dict(implementations)
+            implementations.update(self.registry.implementations())
+        validate_definitions(definitions, implementations)
+
+        capabilities = build_capabilities(definitions, self.plugin_identifier, self.plugin_version,
+                                          self.allow_script)
+        dispatch = {definition['Id']: bind_implementation(implementations[definition['Id']], definition)
+                    for definition in definitions}
+        return FunctionTable(capabilities, dispatch)
+
+    def reload(self):
+        """
+        Rebuilds the capabilities and the dispatch table from the function definitions file.
+        :return: True if the file was valid, otherwise the error is logged and the previous version kept
+        """
+        try:
+            table = self._load()
+        except (OSError, ValueError, AttributeError) as e:
+            # json.JSONDecodeError is a ValueError, AttributeError if the file is not a JSON object
+            logging.error('Invalid function definitions in {}, keeping the previous version: {}'.format(self.path, e))
+            return False
+        # A single assignment, calls see either the previous or the new table
+        self._table = table
+        logging.info('Reloaded function definitions from {}'.format(self.path))
+        return True
+
+    def check(self):
+        """
+        Reloads the function definitions if the file has changed since it was last checked.
+        :return: True if the file had changed
+        """
+        try:
+            signature = self._file_signature()
+        except OSError:
+            # The file may briefly be missing while an editor replaces it
+            return False
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        self.reload()
+        return True
+
+    def watch(self, interval=1.0):
+        """
+        Checks the function definitions file for changes every interval seconds, in a daemon thread.
+        :param interval: seconds between the checks
+        :return: the watcher thread
+        """
+        def run():
+            while not self._stopped.wait(interval):
+                self.check()
+
+        thread = threading.Thread(target=run, name='capabilities-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """
+        Stops the watcher thread.
+        """
+        self._stopped.set()
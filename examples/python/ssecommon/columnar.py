@@ -0,0 +1,444 @@
+"""
+Columnar decoding of the BundledRows streams sent from Qlik.
+
+Instead of building Python lists row by row, the request is decoded in a single pass into one typed buffer per
+parameter: a float64 array for numeric parameters, an object array for string parameters and a pair of such
+arrays, a DualColumn, for dual parameters.
+
+The numerical buffers of a request larger than a memory budget are memory-mapped temporary files instead, so that
+the size of the table sent from Qlik does not bound the memory of the plugin.
+
+Qlik sends the values of a dimension over and over again. A string column can also be dictionary encoded, as the
+distinct values and an int32 array of the index of each row's value, so that a function of the value is computed
+once per distinct value and the results scattered back to the rows through the codes.
+"""
+import tempfile
+from collections import namedtuple
+
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+
+# Both representations of a dual parameter, stored as two arrays of equal length
+DualColumn = namedtuple('DualColumn', ['numbers', 'strings'])
+
+# A dictionary encoded column: the distinct values, and for each row the index of its value
+DictionaryColumn = namedtuple('DictionaryColumn', ['values', 'codes'])
+
+
+def get_common_header(context):
+    """
+    Retrieves the CommonRequestHeader sent as metadata by Qlik.
+    :param context: the context sent from client
+    :return: the parsed header, an empty header if Qlik did not send one
+    """
+    header = SSE.CommonRequestHeader()
+    metadata = dict(context.invocation_metadata())
+    if 'qlik-commonrequestheader-bin' in metadata:
+        header.ParseFromString(metadata['qlik-commonrequestheader-bin'])
+    return header
+
+
+def get_cardinality(context):
+    """
+    :param context: the context sent from client
+    :return: the number of rows Qlik is about to send, 0 if unknown
+    """
+    return get_common_header(context).cardinality
+
+
+def param_types(params):
+    """
+    Data types of the parameters, e.g. from ScriptRequestHeader.params or FunctionDefinition.params.
+    :param params: an iterable sequence of Parameter
+    :return: list of SSE.DataType values
+    """
+    return [param.dataType for param in params]
+
+
+def definition_param_types(definition):
+    """
+    Data types of the parameters of a function definition in functions.json. The parameters are ordered by name,
+    which is the order they are added to the Capabilities message in and therefore the order Qlik sends them in.
+    :param definition: a function definition, as loaded from the JSON file
+    :return: list of SSE.DataType values
+    """
+    return [param_type for _, param_type in sorted(definition['Params'].items())]
+
+
+def empty_column(data_type, size=0):
+    """
+    Allocates an uninitialized column buffer.
+    :param data_type: SSE.DataType of the column
+    :param size: number of rows
+    :return: an array, or a DualColumn of two arrays
+    """
+    if data_type == SSE.NUMERIC:
+        return numpy.empty(size, dtype=numpy.float64)
+    elif data_type == SSE.STRING:
+        return numpy.empty(size, dtype=object)
+    elif data_type == SSE.DUAL:
+        return DualColumn(numpy.empty(size, dtype=numpy.float64), numpy.empty(size, dtype=object))
+    else:
+        raise ValueError('Undefined data type: {}'.format(data_type))
+
+
+def to_list(column, keep_numbers=False):
+    """
+    Converts a column to plain Python lists, a dual column to a list of two lists [numbers, strings].
+    :param column: an array or a DualColumn
+    :param keep_numbers: keep the float64 arrays as they are, e.g. memory-mapped buffers too large for lists
+    :return: list, or the float64 array
+    """
+    if isinstance(column, DualColumn):
+        return [column.numbers if keep_numbers else column.numbers.tolist(), column.strings.tolist()]
+    if keep_numbers and column.dtype != object:
+        return column
+    return column.tolist()
+
+
+def is_spilled(column):
+    """
+    :param column: an array or a DualColumn
+    :return: True if the numbers of the column are a memory-mapped temporary file, see ColumnDecoder
+    """
+    if isinstance(column, DualColumn):
+        column = column.numbers
+    return isinstance(column, numpy.memmap)
+
+
+def spilled_array(size, directory=None):
+    """
+    Allocates an uninitialized float64 buffer in a temporary file, mapped into memory. The file has no name and is
+    removed when the array, and the arrays viewing it, are freed.
+    :param size: number of values
+    :param directory: directory of the file, the default temporary directory if None
+    :return: a numpy.memmap
+    """
+    with tempfile.TemporaryFile(dir=directory) as file:
+        # The mapping keeps its own handle of the file open
+        return numpy.memmap(file, dtype=numpy.float64, mode='w+', shape=(max(size, 1),))[:size]
+
+
+def column_length(column):
+    """
+    :param column: an array or a DualColumn
+    :return: number of rows in the column
+    """
+    if isinstance(column, DualColumn):
+        return len(column.numbers)
+    return len(column)
+
+
+def check_row_sizes(row_sizes, n_cols):
+    """
+    :param row_sizes: the number of values of each row of a bundle
+    :param n_cols: the number of values expected in every row
+    :return: None
+    :raises ValueError: if a row does not hold n_cols values
+    """
+    for i, size in enumerate(row_sizes):
+        if size != n_cols:
+            raise ValueError('Expected {} values per row, received {} values in row {}'.format(n_cols, size, i))
+
+
+def decode_bundle(bundled_rows, data_types):
+    """
+    Decodes a single BundledRows message into columns.
+    :param bundled_rows: a BundledRows message, or a ReceivedRows, see ssecommon.wire
+    :param data_types: list of SSE.DataType, one per column
+    :return: list of columns, see empty_column
+    """
+    if hasattr(bundled_rows, 'decode_columns'):
+        # Decoded from the received bytes, without creating the messages
+        return bundled_rows.decode_columns(data_types)
+    rows = bundled_rows.rows
+    n_rows = len(rows)
+    n_cols = len(data_types)
+    check_row_sizes([len(row.duals) for row in rows], n_cols)
+
+    # Flatten the cells once, row by row, and pick every n_cols:th cell for each column
+    cells = [dual for row in rows for dual in row.duals]
+
+    columns = []
+    for i, data_type in enumerate(data_types):
+        column_cells = cells[i::n_cols]
+        if data_type == SSE.NUMERIC:
+            columns.append(numpy.fromiter((d.numData for d in column_cells), dtype=numpy.float64, count=n_rows))
+        elif data_type == SSE.STRING:
+            columns.append(numpy.array([d.strData for d in column_cells], dtype=object))
+        elif data_type == SSE.DUAL:
+            columns.append(DualColumn(
+                numpy.fromiter((d.numData for d in column_cells), dtype=numpy.float64, count=n_rows),
+                numpy.array([d.strData for d in column_cells], dtype=object)))
+        else:
+            raise ValueError('Undefined data type: {}'.format(data_type))
+    return columns
+
+
+def decode_numeric_bundle(bundled_rows):
+    """
+    Decodes a single BundledRows message with numerical values only into a two dimensional array. The number of
+    columns is given by the rows themselves, which is useful when the number of parameters is not fixed.
+    :param bundled_rows: a BundledRows message, or a ReceivedRows, see ssecommon.wire
+    :return: float64 array of shape (rows, columns)
+    """
+    if hasattr(bundled_rows, 'decode_numbers'):
+        return bundled_rows.decode_numbers()
+    rows = bundled_rows.rows
+    if not rows:
+        return numpy.empty((0, 0), dtype=numpy.float64)
+    check_row_sizes([len(row.duals) for row in rows], len(rows[0].duals))
+    values = numpy.fromiter((d.numData for row in rows for d in row.duals), dtype=numpy.float64)
+    return values.reshape(len(rows), -1)
+
+
+def encode_bundle(columns):
+    """
+    Encodes columns of equal length into a single BundledRows message, the inverse of decode_bundle.
+    Float arrays are sent as numerical values, object arrays as strings and DualColumns as both.
+    :param columns: list of columns, see empty_column
+    :return: a BundledRows message
+    """
+    cells = []
+    for column in columns:
+        if isinstance(column, DualColumn):
+            cells.append([{'numData': n, 'strData': s}
+                          for n, s in zip(column.numbers.tolist(), column.strings.tolist())])
+        elif column.dtype == object:
+            cells.append([{'strData': s} for s in column.tolist()])
+        else:
+            cells.append([{'numData': n} for n in column.tolist()])
+
+    bundled_rows = SSE.BundledRows()
+    add_row = bundled_rows.rows.add
+    for row_cells in zip(*cells):
+        duals = add_row().duals
+        for cell in row_cells:
+            duals.add(**cell)
+    return bundled_rows
+
+
+def iter_bundles(request, data_types):
+    """
+    Decodes the request bundle by bundle.
+    :param request: an iterable sequence of BundledRows
+    :param data_types: list of SSE.DataType, one per column
+    :return: generator of column lists, one per bundle
+    """
+    for bundled_rows in request:
+        yield decode_bundle(bundled_rows, data_types)
+
+
+class ColumnDecoder:
+    """
+    Collects the rows of a whole request into preallocated column buffers.
+    """
+
+    def __init__(self, data_types, cardinality=0, memory_budget=None, spill_dir=None):
+        """
+        Class initializer.
+        :param data_types: list of SSE.DataType, one per column
+        :param cardinality: expected number of rows, e.g. CommonRequestHeader.cardinality. The buffers grow if
+        more rows are received.
+        :param memory_budget: maximum number of bytes of the numerical buffers held in memory, None for no limit.
+        Larger numerical buffers are memory-mapped temporary files, see spilled_array. The strings are always held
+        in memory.
+        :param spill_dir: directory of the temporary files, the default temporary directory if None
+        """
+        self.data_types = list(data_types)
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._capacity = max(int(cardinality), 0)
+        self._rows = 0
+        self._buffers = [self._allocate(data_type, self._capacity) for data_type in self.data_types]
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def spilled(self):
+        """
+        :return: True if the numerical buffers are memory-mapped temporary files
+        """
+        return any(is_spilled(buffer) for buffer in self._buffers)
+
+    def _allocate(self, data_type, size):
+        """
+        Allocates a column buffer, in a temporary file if the numerical buffers of size rows exceed the budget.
+        :param data_type: SSE.DataType of the column
+        :param size: number of rows
+        :return: an array, or a DualColumn of two arrays
+        """
+        n_numbers = sum(1 for column_type in self.data_types if column_type != SSE.STRING)
+        if self.memory_budget is None or data_type == SSE.STRING or 8 * size * n_numbers <= self.memory_budget:
+            return empty_column(data_type, size)
+        numbers = spilled_array(size, self.spill_dir)
+        if data_type == SSE.DUAL:
+            return DualColumn(numbers, numpy.empty(size, dtype=object))
+        return numbers
+
+    def _grow(self, size):
+        """
+        Reallocates the buffers to hold at least size rows, at least doubling the capacity.
+        :param size: required number of rows
+        """
+        capacity = max(size, 2 * self._capacity)
+        buffers = []
+        for data_type, old in zip(self.data_types, self._buffers):
+            new = self._allocate(data_type, capacity)
+            if isinstance(old, DualColumn):
+                new.numbers[:self._rows] = old.numbers[:self._rows]
+                new.strings[:self._rows] = old.strings[:self._rows]
+            else:
+                new[:self._rows] = old[:self._rows]
+            buffers.append(new)
+        self._buffers = buffers
+        self._capacity = capacity
+
+    def append_columns(self, columns):
+        """
+        Appends already decoded columns to the buffers.
+        :param columns: list of columns of equal length, see decode_bundle
+        """
+        if not columns:
+            return
+        end = self._rows + column_length(columns[0])
+        if end > self._capacity:
+            self._grow(end)
+
+        for buffer, column in zip(self._buffers, columns):
+            if isinstance(buffer, DualColumn):
+                buffer.numbers[self._rows:end] = column.numbers
+                buffer.strings[self._rows:end] = column.strings
+            else:
+                buffer[self._rows:end] = column
+        self._rows = end
+
+    def append(self, bundled_rows):
+        """
+        Decodes a BundledRows message into the buffers.
+        :param bundled_rows: a BundledRows message, or a ReceivedRows
+        """
+        self.append_columns(decode_bundle(bundled_rows, self.data_types))
+
+    def columns(self):
+        """
+        :return: list of columns holding the rows decoded so far, views of the buffers
+        """
+        columns = []
+        for buffer in self._buffers:
+            if isinstance(buffer, DualColumn):
+                columns.append(DualColumn(buffer.numbers[:self._rows], buffer.strings[:self._rows]))
+            else:
+                columns.append(buffer[:self._rows])
+        return columns
+
+
+def decode(request, data_types, cardinality=0, memory_budget=None):
+    """
+    Decodes a whole request into columns.
+    :param request: an iterable sequence of BundledRows
+    :param data_types: list of SSE.DataType, one per column
+    :param cardinality: expected number of rows, 0 if unknown
+    :param memory_budget: maximum number of bytes of the numerical columns held in memory, see ColumnDecoder
+    :return: list of columns, see empty_column
+    """
+    decoder = ColumnDecoder(data_types, cardinality, memory_budget)
+    for bundled_rows in request:
+        decoder.append(bundled_rows)
+    return decoder.columns()
+
+
+def _object_array(values):
+    """
+    :param values: a list of values, e.g. strings or tuples
+    :return: a one dimensional object array of the values, tuples are not expanded to a second dimension
+    """
+    array = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        array[i] = value
+    return array
+
+
+class DictionaryEncoder:
+    """
+    Dictionary encoding of the values of a column received in several bundles. The codes are consistent across the
+    bundles, a value seen in an earlier bundle keeps its code.
+    """
+
+    def __init__(self):
+        self._index = {}
+        # The distinct values in the order they were first seen, the value of code i is values[i]
+        self.values = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, values):
+        """
+        :param values: a sequence of hashable values, e.g. the strings of a column or tuples of the values of a row
+        :return: int32 array with the code of each value
+        """
+        index = self._index
+        distinct = self.values
+        size = len(index)
+        codes = numpy.empty(len(values), dtype=numpy.int32)
+        for i, value in enumerate(values):
+            code = index.get(value)
+            if code is None:
+                code = index[value] = size
+                distinct.append(value)
+                size += 1
+            codes[i] = code
+        return codes
+
+
+def dictionary_encode(values):
+    """
+    :param values: a sequence of hashable values, e.g. the strings of a column
+    :return: a DictionaryColumn with the distinct values in an object array
+    """
+    encoder = DictionaryEncoder()
+    codes = encoder.encode(values)
+    return DictionaryColumn(_object_array(encoder.values), codes)
+
+
+class DistinctMapper:
+    """
+    Applies a function to the values of a column once per distinct value, remembering the results over all bundles
+    of a request.
+    """
+
+    def __init__(self, func):
+        """
+        Class initializer.
+        :param func: function of a single value, expected to return the same result for the same value
+        """
+        self.func = func
+        self.encoder = DictionaryEncoder()
+        self._results = numpy.empty(0, dtype=object)
+
+    @property
+    def evaluations(self):
+        """
+        :return: the number of times the function has been called, the number of distinct values seen
+        """
+        return len(self._results)
+
+    def map(self, values):
+        """
+        :param values: a sequence of hashable values
+        :return: object array with the result of the function for each value
+        """
+        codes = self.encoder.encode(values)
+        done = len(self._results)
+        if len(self.encoder) > done:
+            # Call the function for the values not seen before only
+            results = numpy.empty(len(self.encoder), dtype=object)
+            results[:done] = self._results
+            func = self.func
+            for i, value in enumerate(self.encoder.values[done:], done):
+                results[i] = func(value)
+            self._results = results
+        return self._results[codes]
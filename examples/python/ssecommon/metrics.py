@@ -0,0 +1,550 @@
+"""
+Metrics of the ExecuteFunction and EvaluateScript calls, exposed over HTTP in the Prometheus text format.
+
+The metrics are recorded per method and function, the function id of an ExecuteFunction call or a short hash of
+the script of an EvaluateScript call:
+- counters of calls, errors, bundles, rows and bytes received and sent,
+- histograms of the seconds spent decoding the values of each received bundle (decode), in the plugin's own code
+  for each call (compute), serializing each sent bundle (encode), and of the duration of each call,
+- gauges of the number of streams in flight and of the calls queued for a thread of the server.
+The resources used by each Qlik app and user are recorded as well, and the calls of an app limited by quotas, see
+ssecommon.accounting.
+
+The received and sent bytes are counted by the deserializer and serializer registered with the server, so no message
+is serialized only to measure it. A received bundle is kept in the wire format until the plugin decodes its values,
+see ssecommon.wire.ReceivedRows, and the bundle the deserializer returns times its decoding in the CallStats of the
+call it is read by, so decoding is part of the compute time. A sent bundle is passed to the serializer together with
+the CallStats of its call, so the measures of a message reach its call also when the same message is sent by several
+calls.
+"""
+import bisect
+import hashlib
+import logging
+import threading
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, thread_time
+
+import ServerSideExtension_pb2 as SSE
+import grpc
+from ssecommon.accounting import Accounting, QuotaExceeded
+from ssecommon.columnar import get_common_header
+from ssecommon.wire import ReceivedRows, add_to_server, row_count
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+_COUNTERS = (
+    ('calls', 'Number of calls.'),
+    ('errors', 'Number of calls ended by an exception.'),
+    ('bundles_in', 'Number of BundledRows received.'),
+    ('rows_in', 'Number of rows received.'),
+    ('bytes_in', 'Number of serialized bytes received.'),
+    ('bundles_out', 'Number of BundledRows sent.'),
+    ('rows_out', 'Number of rows sent.'),
+    ('bytes_out', 'Number of serialized bytes sent.'),
+)
+
+_HISTOGRAMS = (
+    ('decode', 'Seconds decoding the values of a received bundle.'),
+    ('compute', 'Seconds spent in the plugin during a call, not counting the time waiting for bundles.'),
+    ('encode', 'Seconds serializing a sent bundle.'),
+    ('duration', 'Seconds from the start to the end of a call.'),
+)
+
+
+class Histogram:
+    """
+    Counts of observed values in buckets of fixed upper bounds.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Class initializer.
+        :param buckets: sorted upper bounds of the buckets, a last bucket without bound is added
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Not thread safe, the caller holds the lock of the CallStats.
+        :param value: the observed value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self):
+        """
+        :return: list of (upper bound, number of observations less than or equal to the bound), the last bound is
+        float('inf')
+        """
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class CallStats:
+    """
+    The counters and histograms of one method and function.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        for name, _ in _COUNTERS:
+            setattr(self, name, 0)
+        for name, _ in _HISTOGRAMS:
+            setattr(self, name, Histogram(buckets))
+
+
+class CountingExecutor(futures.ThreadPoolExecutor):
+    """
+    A ThreadPoolExecutor counting the tasks submitted to it that are waiting for a thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+
+    @property
+    def queued(self):
+        """
+        :return: number of submitted tasks not started yet
+        """
+        return self._queued
+
+    def _add_queued(self, delta):
+        with self._queued_lock:
+            self._queued += delta
+
+    def submit(self, fn, *args, **kwargs):
+        def run():
+            self._add_queued(-1)
+            return fn(*args, **kwargs)
+
+        self._add_queued(1)
+        try:
+            return super().submit(run)
+        except RuntimeError:
+            # The executor is shut down
+            self._add_queued(-1)
+            raise
+
+
+class _ReceivedRows(ReceivedRows):
+    """
+    A received bundle, recording the seconds spent decoding its values in the decode histogram of its call.
+    """
+
+    __slots__ = ('stats',)
+
+    def __init__(self, data):
+        super().__init__(data)
+        # The CallStats of the call reading the bundle
+        self.stats = None
+
+    def _observe(self, start):
+        stats = self.stats
+        if stats is not None:
+            seconds = perf_counter() - start
+            with stats.lock:
+                stats.decode.observe(seconds)
+
+    def parse(self):
+        if self._message is not None:
+            return self._message
+        start = perf_counter()
+        message = super().parse()
+        self._observe(start)
+        return message
+
+    def decode_columns(self, data_types):
+        start = perf_counter()
+        columns = super().decode_columns(data_types)
+        self._observe(start)
+        return columns
+
+    def decode_numbers(self):
+        start = perf_counter()
+        matrix = super().decode_numbers()
+        self._observe(start)
+        return matrix
+
+
+class _SentRows:
+    """
+    A bundle sent by an instrumented call, passed to the serializer with the CallStats of the call.
+    """
+
+    __slots__ = ('bundled_rows', 'stats')
+
+    def __init__(self, bundled_rows, stats):
+        self.bundled_rows = bundled_rows
+        self.stats = stats
+
+
+class _Call:
+    """
+    Iterates over the received bundles of a call, counting them and the time spent waiting for them.
+    """
+
+    def __init__(self, stats, request_iterator):
+        self._stats = stats
+        self._request_iterator = request_iterator
+        self.waiting = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        start = perf_counter()
+        try:
+            bundled_rows = next(self._request_iterator)
+        finally:
+            self.waiting += perf_counter() - start
+        if isinstance(bundled_rows, _ReceivedRows):
+            size = len(bundled_rows.data)
+            bundled_rows.stats = self._stats
+        else:
+            # Not received through Metrics.deserialize, e.g. in a test
+            size = 0
+        rows = row_count(bundled_rows)
+        self.rows += rows
+        self.bytes += size
+        stats = self._stats
+        with stats.lock:
+            stats.bundles_in += 1
+            stats.rows_in += rows
+            stats.bytes_in += size
+        return bundled_rows
+
+
+class InstrumentedServicer:
+    """
+    Records the metrics of the calls to a servicer.
+    """
+
+    def __init__(self, servicer, metrics):
+        """
+        Class initializer.
+        :param servicer: the plugin's ExtensionService
+        :param metrics: the Metrics to record
+        """
+        self.servicer = servicer
+        self.metrics = metrics
+
+    def GetCapabilities(self, request, context):
+        return self.servicer.GetCapabilities(request, context)
+
+    def ExecuteFunction(self, request_iterator, context):
+        metadata = dict(context.invocation_metadata())
+        header = SSE.FunctionRequestHeader()
+        header.ParseFromString(metadata.get('qlik-functionrequestheader-bin', b''))
+        return self._stream('ExecuteFunction', str(header.functionId), self.servicer.ExecuteFunction,
+                            request_iterator, context)
+
+    def EvaluateScript(self, request_iterator, context):
+        metadata = dict(context.invocation_metadata())
+        header = SSE.ScriptRequestHeader()
+        header.ParseFromString(metadata.get('qlik-scriptrequestheader-bin', b''))
+        script_hash = hashlib.sha1(header.script.encode('utf-8')).hexdigest()[:12]
+        return self._stream('EvaluateScript', script_hash, self.servicer.EvaluateScript, request_iterator, context)
+
+    def _admit(self, context):
+        """
+        Admits the call within the quotas of its app, from the CommonRequestHeader sent by Qlik.
+        :param context: the context of the call
+        :return: the CallAccount of the call
+        """
+        header = get_common_header(context)
+        try:
+            return self.metrics.accounting.start(header.appId, header.userId)
+        except QuotaExceeded as e:
+            # Make sure the error handling, including logging, works as intended in the client
+            msg = str(e)
+            logging.warning(msg)
+            context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+            context.set_details(msg)
+            # Raise error on the plugin-side
+            raise grpc.RpcError(grpc.StatusCode.RESOURCE_EXHAUSTED, msg)
+
+    def _stream(self, method, function, servicer_method, request_iterator, context):
+        """
+        Calls the servicer method, recording the metrics of the call.
+        :return: generator of the BundledRows sent by the servicer method, each wrapped with the CallStats of the call
+        for the serializer
+        """
+        metrics = self.metrics
+        stats = metrics.stats(method, function)
+        call = _Call(stats, request_iterator)
+        metrics.add_in_flight(1)
+        start = perf_counter()
+        computing = 0.0
+        account = None
+        rows_out = 0
+        try:
+            account = self._admit(context)
+            responses = iter(servicer_method(call, context))
+            while True:
+                resumed = perf_counter()
+                # A step of the generator runs in a single thread, also when served by ssecommon.aioserver
+                resumed_cpu = thread_time()
+                waiting = call.waiting
+                try:
+                    response = next(responses)
+                except StopIteration:
+                    break
+                finally:
+                    computing += perf_counter() - resumed - (call.waiting - waiting)
+                    account.add_cpu(thread_time() - resumed_cpu)
+                rows = row_count(response)
+                rows_out += rows
+                with stats.lock:
+                    stats.bundles_out += 1
+                    stats.rows_out += rows
+                yield _SentRows(response, stats)
+        except Exception:
+            with stats.lock:
+                stats.errors += 1
+            raise
+        finally:
+            metrics.add_in_flight(-1)
+            duration = perf_counter() - start
+            with stats.lock:
+                stats.calls += 1
+                stats.compute.observe(computing)
+                stats.duration.observe(duration)
+            if account is not None:
+                account.finish(duration, call.rows, rows_out, call.bytes)
+
+
+class Metrics:
+    """
+    Registry of the metrics of a plugin.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, quotas=None):
+        """
+        Class initializer.
+        :param buckets: upper bounds, in seconds, of the histogram buckets
+        :param quotas: ssecommon.accounting.Quotas limiting the calls of each app, None for no limits
+        """
+        self.buckets = tuple(buckets)
+        # The resources used by each app and user
+        self.accounting = Accounting(quotas)
+        # The CountingExecutor of the server, or the WorkerSlots of ssecommon.aioserver, for the number of queued calls
+        self.executor = None
+        self._stats = {}  # (method, function) -> CallStats
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def stats(self, method, function):
+        """
+        :param method: the rpc method
+        :param function: the function id or script hash
+        :return: CallStats of the method and function
+        """
+        key = (method, function)
+        stats = self._stats.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(key, CallStats(self.buckets))
+        return stats
+
+    def add_in_flight(self, delta):
+        with self._lock:
+            self._in_flight += delta
+
+    def create_executor(self, max_workers):
+        """
+        :param max_workers: number of threads of the server
+        :return: the executor of the server, of which the calls waiting for a thread are counted
+        """
+        self.executor = CountingExecutor(max_workers=max_workers)
+        return self.executor
+
+    def instrument(self, servicer):
+        """
+        :param servicer: the plugin's ExtensionService
+        :return: an InstrumentedServicer recording the metrics of the calls to servicer
+        """
+        return InstrumentedServicer(servicer, self)
+
+    def deserialize(self, data):
+        """
+        The request deserializer of the BundledRows streams.
+        :param data: a serialized BundledRows
+        :return: a ReceivedRows, see ssecommon.wire, of which the values are decoded by the plugin
+        """
+        return _ReceivedRows(data)
+
+    @staticmethod
+    def serialize(bundled_rows):
+        """
+        The response serializer of the BundledRows streams.
+        :param bundled_rows: a BundledRows, or a SerializedRows, to send, wrapped by the InstrumentedServicer
+        :return: the serialized message
+        """
+        stats = None
+        if isinstance(bundled_rows, _SentRows):
+            bundled_rows, stats = bundled_rows.bundled_rows, bundled_rows.stats
+        start = perf_counter()
+        data = bundled_rows.SerializeToString()
+        if stats is not None:
+            seconds = perf_counter() - start
+            with stats.lock:
+                stats.bytes_out += len(data)
+                stats.encode.observe(seconds)
+        return data
+
+    def add_to_server(self, servicer, server):
+        """
+        Adds the servicer to the server, see ssecommon.wire.add_to_server, with a deserializer and serializer of the
+        BundledRows streams recording their sizes and timings.
+        :param servicer: the servicer, e.g. an InstrumentedServicer
+        :param server: a grpc.Server or grpc.aio.Server
+        """
+        add_to_server(servicer, server, self.deserialize, self.serialize)
+
+    def queue_depth(self):
+        """
+        :return: number of calls waiting for a thread of the executor, 0 if unknown
+        """
+        return self.executor.queued if self.executor is not None else 0
+
+    def render(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            stats = sorted(self._stats.items())
+            in_flight = self._in_flight
+
+        lines = []
+        for name, description in _COUNTERS:
+            lines.append('# HELP sse_{}_total {}'.format(name, description))
+            lines.append('# TYPE sse_{}_total counter'.format(name))
+            for (method, function), call_stats in stats:
+                lines.append('sse_{}_total{{method="{}",function="{}"}} {}'
+                             .format(name, method, function, getattr(call_stats, name)))
+
+        for name, description in _HISTOGRAMS:
+            lines.append('# HELP sse_{}_seconds {}'.format(name, description))
+            lines.append('# TYPE sse_{}_seconds histogram'.format(name))
+            for (method, function), call_stats in stats:
+                labels = 'method="{}",function="{}"'.format(method, function)
+                with call_stats.lock:
+                    histogram = getattr(call_stats, name)
+                    buckets = histogram.cumulative_counts()
+                    total, count = histogram.sum, histogram.count
+                for bound, cumulative in buckets:
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('sse_{}_seconds_bucket{{{},le="{}"}} {}'.format(name, labels, le, cumulative))
+                lines.append('sse_{}_seconds_sum{{{}}} {!r}'.format(name, labels, total))
+                lines.append('sse_{}_seconds_count{{{}}} {}'.format(name, labels, count))
+
+        lines.extend(self.accounting.render())
+
+        lines.append('# HELP sse_in_flight_streams Number of ExecuteFunction and EvaluateScript calls in progress.')
+        lines.append('# TYPE sse_in_flight_streams gauge')
+        lines.append('sse_in_flight_streams {}'.format(in_flight))
+        lines.append('# HELP sse_executor_queue_depth Number of calls waiting for a thread of the server.')
+        lines.append('# TYPE sse_executor_queue_depth gauge')
+        lines.append('sse_executor_queue_depth {}'.format(self.queue_depth()))
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host=''):
+        """
+        Serves the metrics on http://host:port/metrics from a daemon thread.
+        :param port: port to listen on, 0 for any free port
+        :param host: interface to listen on, all interfaces if empty
+        :return: the HTTPServer, its server_address holds the port listened on
+        """
+        return serve_http(self.render, port, host)
+
+
+def serve_http(render, port, host=''):
+    """
+    Serves metrics on http://host:port/metrics from a daemon thread.
+    :param render: function returning the metrics in the Prometheus text exposition format
+    :param port: port to listen on, 0 for any free port
+    :param host: interface to listen on, all interfaces if empty
+    :return: the HTTPServer, its server_address holds the port listened on
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.debug('Metrics endpoint: ' + format % args)
+
+    server = ThreadingHTTPServer((host, int(port)), Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logging.info('*** Serving metrics on port: {} ***'.format(server.server_address[1]))
+    return server
+
+
+def _number(text):
+    """
+    :param text: the value of a sample
+    :return: the value as an int, or a float if it is not an integer
+    """
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def combine(texts):
+    """
+    Combines the metrics of several processes serving the same plugin, e.g. the workers of ssecommon.prefork, by
+    summing the values of the samples with the same name and labels. The samples of a peak, a metric named
+    *_peak_*, are combined by their maximum instead.
+    :param texts: the metrics of each process, in the Prometheus text exposition format
+    :return: the combined metrics in the same format, the samples grouped by metric as in the texts
+    """
+    # For each metric, in the order seen: its HELP and TYPE lines, and its samples with their summed values
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('#'):
+                fields = line.split(' ', 3)
+                if len(fields) >= 3 and fields[1] in ('HELP', 'TYPE'):
+                    family = families.setdefault(fields[2], ([], {}))
+                    if line not in family[0]:
+                        family[0].append(line)
+            elif line and family is not None:
+                sample, _, value = line.rpartition(' ')
+                samples = family[1]
+                value = _number(value)
+                if sample not in samples:
+                    samples[sample] = value
+                elif '_peak_' in sample:
+                    samples[sample] = max(samples[sample], value)
+                else:
+                    samples[sample] += value
+
+    lines = []
+    for comments, samples in families.values():
+        lines.extend(comments)
+        lines.extend('{} {!r}'.format(sample, value) for sample, value in samples.items())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,143 @@
+"""
+Pre-fork serving mode, for plugins whose functions are computed in Python.
+
+Only one thread at a time runs Python code in a process, however many threads the server has, so a plugin computing
+its functions in Python uses a single core. Here a supervisor process forks a number of worker processes that each
+create the servicer and serve it on the same port, which the grpc.so_reuseport option allows on Linux. The kernel
+spreads the connections from Qlik over the workers.
+
+The modules the plugin imports, e.g. numpy, are loaded by the supervisor before the workers are forked, so the
+workers share those pages of memory instead of loading a copy each. The workers are forked before the supervisor
+starts any thread of its own. A worker that exits is started again, and first closes the listening socket it inherits
+from the supervisor. With metrics, each worker serves its own metrics on a local port chosen by the system, which it
+reports to the supervisor through a pipe, and the supervisor serves their sum on the metrics port. The counters of a
+restarted worker start again from zero.
+
+Forking requires a POSIX platform, and sharing the port SO_REUSEPORT, e.g. Linux.
+"""
+import gc
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+import sys
+import time
+from urllib.request import urlopen
+
+from ssecommon.metrics import Metrics, combine, serve_http
+
+# grpc server options letting the processes listen on the same port
+REUSE_PORT_OPTIONS = [('grpc.so_reuseport', 1)]
+
+# Minimum number of seconds between the starts of a worker, so that a worker failing at start is not restarted in
+# a busy loop
+_RESTART_INTERVAL = 1.0
+
+
+def _run_worker(create_servicer, port, pem_dir, aio, metrics_sender, quotas, inherited_servers):
+    """
+    The target of a worker process.
+    :param metrics_sender: the Connection the port of the worker's metrics is sent to, None to not record metrics
+    :param inherited_servers: the HTTPServers of the supervisor when the worker was forked, closed in the worker
+    """
+    # Circular import, ssecommon.serving uses the options of this module
+    from ssecommon import serving
+
+    # The supervisor stops the workers with SIGTERM
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    for server in inherited_servers:
+        server.server_close()
+
+    metrics = None
+    if metrics_sender is not None:
+        metrics = Metrics(quotas=quotas)
+        metrics_sender.send(metrics.start_http_server(0, '127.0.0.1').server_address[1])
+        metrics_sender.close()
+    serving.serve(create_servicer(), port, pem_dir, aio, reuse_port=True, quotas=quotas, metrics=metrics)
+
+
+def _render_combined(metrics_ports):
+    """
+    :param metrics_ports: the metrics ports of the workers
+    :return: the sum of the metrics of the workers, in the Prometheus text exposition format
+    """
+    texts = []
+    for port in metrics_ports:
+        if port is None:
+            # The worker is being restarted
+            continue
+        try:
+            with urlopen('http://127.0.0.1:{}/metrics'.format(port), timeout=5) as response:
+                texts.append(response.read().decode('utf-8'))
+        except OSError as e:
+            # The worker is starting or being restarted
+            logging.warning('Metrics of the worker on port {} not available: {}'.format(port, e))
+    return combine(texts)
+
+
+def serve(create_servicer, workers, port, pem_dir, aio=False, metrics_port=None, quotas=None):
+    """
+    Runs the workers until the supervisor is interrupted or terminated.
+    :param create_servicer: function creating the plugin's ExtensionService, called in each worker, which serves it
+    with ssecommon.serving.serve
+    :param workers: number of worker processes
+    :param port: port to listen on.
+    :param pem_dir: Directory including certificates
+    :param aio: serve the streams of each worker with a grpc.aio server, see ExtensionService.Serve
+    :param metrics_port: port of the HTTP endpoint serving the sum of the metrics of the workers, None to not record
+    metrics
+    :param quotas: ssecommon.accounting.Quotas limiting the calls of each Qlik app, enforced by each worker
+    :return: None
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise RuntimeError('Serving with several worker processes requires a platform with fork, e.g. Linux')
+    context = multiprocessing.get_context('fork')
+
+    worker_metrics_ports = [None] * workers
+    # The HTTP server of the supervisor, once started, closed by the workers started after it
+    http_servers = []
+
+    # Objects created so far are never freed, keep the collector from touching them and copying their pages
+    gc.freeze()
+
+    def start(index):
+        worker_metrics_ports[index] = None
+        receiver, sender = context.Pipe(duplex=False) if metrics_port else (None, None)
+        process = context.Process(target=_run_worker, name='sse-worker-{}'.format(index),
+                                  args=(create_servicer, port, pem_dir, aio, sender, quotas, list(http_servers)))
+        process.start()
+        logging.info('Started worker {} (pid {})'.format(index, process.pid))
+        if receiver is not None:
+            sender.close()
+            try:
+                worker_metrics_ports[index] = receiver.recv()
+            except EOFError:
+                # The worker exited before serving its metrics, it is started again by the loop below
+                pass
+            receiver.close()
+        return process, time.monotonic()
+
+    # Terminating the supervisor stops the workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # The workers are forked before the thread of the HTTP server is started
+    processes = [start(index) for index in range(workers)]
+    if metrics_port:
+        http_servers.append(serve_http(lambda: _render_combined(worker_metrics_ports), metrics_port))
+    try:
+        while True:
+            sentinels = {process.sentinel: index for index, (process, _) in enumerate(processes)}
+            for sentinel in multiprocessing.connection.wait(list(sentinels)):
+                index = sentinels[sentinel]
+                process, started = processes[index]
+                process.join()
+                logging.warning('Worker {} (pid {}) exited with code {}, restarting it'
+                                .format(index, process.pid, process.exitcode))
+                time.sleep(max(0.0, started + _RESTART_INTERVAL - time.monotonic()))
+                processes[index] = start(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process, _ in processes:
+            process.terminate()
+        for process, _ in processes:
+            process.join()
@@ -0,0 +1,283 @@
+"""
+Execution of scripts in a pool of worker processes.
+
+A script evaluated in a gRPC worker thread holds the GIL, so one heavy script serializes the whole server. With a
+ScriptProcessPool the script runs in a separate process instead. The decoded argument columns are passed to the
+worker through shared memory rather than as pickled lists, and numerical array results come back the same way.
+Columns that ColumnDecoder has spilled to memory-mapped files are passed as temporary files instead, which the worker
+maps in turn, so that a column above the memory budget is never held in memory as a whole. Requires Python 3.8 or later.
+
+The worker processes are started by a fork server, or spawned where there is none, never forked from the plugin
+process itself: once the gRPC server runs, its threads may hold locks that a forked child would inherit locked.
+"""
+import importlib
+import multiprocessing
+import os
+import signal
+import tempfile
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy
+
+from ssecommon.columnar import DualColumn
+
+# Number of values copied at a time from a memory-mapped column to the temporary file passed to a worker process
+_FILE_CHUNK = 1 << 20
+
+
+class _SharedArray:
+    """
+    Reference to an array stored in a shared memory block, small enough to be pickled cheaply.
+    """
+
+    def __init__(self, name, dtype, shape, offsets_name=None):
+        self.name = name
+        self.dtype = dtype
+        self.shape = shape
+        # For strings: the shared memory block holding the offsets of each UTF-8 encoded string
+        self.offsets_name = offsets_name
+
+
+class _FileArray:
+    """
+    Reference to a one-dimensional numerical array stored in a temporary file.
+    """
+
+    def __init__(self, path, dtype, size):
+        self.path = path
+        self.dtype = dtype
+        self.size = size
+
+
+class _TemporaryFile:
+    """
+    A temporary file released along with the shared memory blocks, see _release.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def close(self):
+        pass
+
+    def unlink(self):
+        os.unlink(self.path)
+
+
+def _to_file(array, blocks):
+    """
+    Copies a memory-mapped array to a temporary file, a chunk at a time.
+    :param array: a one-dimensional numpy.memmap, see ssecommon.columnar.spilled_array
+    :param blocks: list the temporary file is added to, for later release
+    :return: _FileArray
+    """
+    with tempfile.NamedTemporaryFile(delete=False) as file:
+        blocks.append(_TemporaryFile(file.name))
+        for start in range(0, len(array), _FILE_CHUNK):
+            file.write(numpy.ascontiguousarray(array[start:start + _FILE_CHUNK]).tobytes())
+    return _FileArray(file.name, array.dtype.str, len(array))
+
+
+def _from_file(ref):
+    """
+    Maps an array stored in a temporary file. The mapping is copy-on-write, the file is left unchanged.
+    :param ref: _FileArray
+    :return: numpy.memmap, or an empty array as empty files cannot be mapped
+    """
+    if ref.size == 0:
+        return numpy.empty(0, dtype=ref.dtype)
+    return numpy.memmap(ref.path, dtype=ref.dtype, mode='c', shape=(ref.size,))
+
+
+def _to_shared(array, blocks):
+    """
+    Copies an array to shared memory.
+    :param array: a numerical array or an object array of strings
+    :param blocks: list the created SharedMemory blocks are added to, for later release
+    :return: _SharedArray
+    """
+    if array.dtype == object:
+        # Strings are stored as their concatenated UTF-8 encoding and the offset of the end of each string
+        encoded = [s.encode('utf-8') for s in array.tolist()]
+        ends = numpy.cumsum(numpy.fromiter(map(len, encoded), dtype=numpy.int64, count=len(encoded)))
+        data = _create_block(b''.join(encoded), blocks)
+        offsets = _create_block(ends.tobytes(), blocks)
+        return _SharedArray(data.name, object, array.shape, offsets.name)
+
+    array = numpy.ascontiguousarray(array)
+    block = _create_block(array.tobytes(), blocks)
+    return _SharedArray(block.name, array.dtype.str, array.shape)
+
+
+def _create_block(data, blocks):
+    # Zero sized shared memory blocks are not allowed
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    block.buf[:len(data)] = data
+    blocks.append(block)
+    return block
+
+
+def _from_shared(ref):
+    """
+    Copies an array out of shared memory.
+    :param ref: _SharedArray
+    :return: numpy array
+    """
+    block = shared_memory.SharedMemory(name=ref.name)
+    try:
+        if ref.offsets_name is None:
+            size = int(numpy.prod(ref.shape)) * numpy.dtype(ref.dtype).itemsize
+            return numpy.frombuffer(block.buf[:size], dtype=ref.dtype).reshape(ref.shape).copy()
+
+        offsets_block = shared_memory.SharedMemory(name=ref.offsets_name)
+        try:
+            ends = numpy.frombuffer(offsets_block.buf[:8 * ref.shape[0]], dtype=numpy.int64).tolist()
+        finally:
+            offsets_block.close()
+        data = bytes(block.buf[:ends[-1] if ends else 0])
+        strings = numpy.empty(len(ends), dtype=object)
+        strings[:] = [data[start:end].decode('utf-8') for start, end in zip([0] + ends[:-1], ends)]
+        return strings
+    finally:
+        block.close()
+
+
+def _pack(value, blocks, spilled=False):
+    """
+    Replaces the numerical arrays, string arrays and columns in value, also inside tuples, with shared memory
+    references. Other values are left as they are and will be pickled.
+    :param spilled: pass memory-mapped arrays as temporary files rather than in shared memory
+    """
+    if spilled and isinstance(value, numpy.memmap) and value.ndim == 1:
+        return _to_file(value, blocks)
+    elif isinstance(value, DualColumn):
+        return DualColumn(_pack(value.numbers, blocks, spilled), _to_shared(value.strings, blocks))
+    elif isinstance(value, numpy.ndarray) and value.dtype.kind in 'biuf':
+        return _to_shared(value, blocks)
+    elif isinstance(value, numpy.ndarray) and value.ndim == 1 and all(isinstance(s, str) for s in value.tolist()):
+        return _to_shared(value, blocks)
+    elif type(value) is tuple:
+        return tuple(_pack(v, blocks, spilled) for v in value)
+    return value
+
+
+def _unpack(value):
+    """
+    The inverse of _pack.
+    """
+    if isinstance(value, _SharedArray):
+        return _from_shared(value)
+    elif isinstance(value, _FileArray):
+        return _from_file(value)
+    elif isinstance(value, DualColumn):
+        return DualColumn(_unpack(value.numbers), _from_shared(value.strings))
+    elif type(value) is tuple:
+        return tuple(_unpack(v) for v in value)
+    return value
+
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _initialize(preload):
+    """
+    Runs in each worker process when it is started.
+    """
+    # Ctrl+C reaches every process of the group, leave it to the plugin to stop the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for module in preload:
+        importlib.import_module(module)
+
+
+def _warm_up(_):
+    return True
+
+
+def _call(func, columns, args):
+    """
+    Runs in a worker process: retrieves the columns from shared memory, calls the function and puts its result in
+    shared memory.
+    """
+    result = func(list(_unpack(columns)), *args)
+    blocks = []
+    packed = _pack(result, blocks)
+    for block in blocks:
+        # The caller unlinks the blocks once it has read them
+        block.close()
+    return packed
+
+
+def _receive(packed):
+    """
+    Reads and releases the shared memory blocks of a result returned from a worker process.
+    """
+    value = _unpack(packed)
+    names = []
+    _collect_names(packed, names)
+    for name in names:
+        block = shared_memory.SharedMemory(name=name)
+        block.close()
+        block.unlink()
+    return value
+
+
+def _collect_names(value, names):
+    if isinstance(value, _SharedArray):
+        names.append(value.name)
+        if value.offsets_name is not None:
+            names.append(value.offsets_name)
+    elif isinstance(value, tuple):
+        for v in value:
+            _collect_names(v, names)
+
+
+class ScriptProcessPool:
+    """
+    A pool of worker processes running script evaluations.
+    """
+
+    def __init__(self, processes=None, preload=('numpy',), warm_up=True):
+        """
+        Class initializer, starts the worker processes. Create the pool before the gRPC server is started.
+        :param processes: number of worker processes, the number of CPUs if None
+        :param preload: modules imported by each worker process when it is started
+        :param warm_up: wait until every worker process has started and imported the preloaded modules
+        """
+        self.processes = processes
+        self.preload = tuple(preload)
+        context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        # Start the resource tracker before the workers, so that they share it with this process. Otherwise each
+        # worker would start its own tracker, and unlink the shared memory blocks it has seen when it exits
+        resource_tracker.ensure_running()
+        self._pool = context.Pool(processes, initializer=_initialize, initargs=(self.preload,))
+        if warm_up:
+            self._pool.map(_warm_up, range(processes or os.cpu_count()), chunksize=1)
+
+    def run(self, func, columns, *args):
+        """
+        Calls func(columns, *args) in a worker process and waits for the result.
+        :param func: a module level function, so that it can be referenced from the worker process
+        :param columns: list of decoded columns, see ssecommon.columnar, passed through shared memory or, if
+        memory-mapped, as temporary files
+        :param args: further arguments, pickled
+        :return: the result of the function, numerical arrays returned through shared memory
+        """
+        blocks = []
+        try:
+            packed = _pack(tuple(columns), blocks, spilled=True)
+            return _receive(self._pool.apply(_call, (func, packed, args)))
+        finally:
+            _release(blocks)
+
+    def close(self):
+        """
+        Stops the worker processes and waits for them to exit.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
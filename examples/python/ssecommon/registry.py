@@ -0,0 +1,199 @@
+"""
+Registration of plugin defined functions with a decorator.
+
+A function decorated with @sse_function is called with the parameters of the function as whole columns, NumPy
+arrays decoded by the ssecommon.columnar module and passed as keyword arguments by parameter name, and returns its
+result as a column: an array, or a single value for an aggregation. The registry generates the function definitions,
+in the format of functions.json, and the implementations called by ExecuteFunction, so adding a function does not
+require editing the JSON file, writing a loop over the rows or adding the function to a mapping of ids.
+
+    @sse_function('SumOfRows', SSE.TENSOR, {'col1': SSE.NUMERIC, 'col2': SSE.NUMERIC}, SSE.NUMERIC)
+    def sum_of_rows(col1, col2):
+        return col1 + col2
+"""
+import json
+
+import grpc
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.bundler import encode_column
+from ssecommon.columnar import DualColumn, decode, decode_bundle, get_cardinality
+
+
+def to_column(result, return_type):
+    """
+    Converts the result of a registered function to a column of the return type.
+    :param result: an array or a sequence of values, a DualColumn or a tuple (numbers, strings) for a dual
+    :param return_type: SSE.DataType of the result
+    :return: a float64 array, an object array of strings or a DualColumn
+    """
+    if return_type == SSE.NUMERIC:
+        return numpy.asarray(result, dtype=numpy.float64).reshape(-1)
+    elif return_type == SSE.STRING:
+        return numpy.asarray(result).reshape(-1).astype(str).astype(object)
+    numbers, strings = result
+    return DualColumn(to_column(numbers, SSE.NUMERIC), to_column(strings, SSE.STRING))
+
+
+def numeric_column(result):
+    """
+    :param result: the result of a script
+    :return: the result as a float64 array if it is a one dimensional sequence of numbers, otherwise None
+    """
+    try:
+        array = numpy.asarray(result)
+    except (TypeError, ValueError):
+        # E.g. rows of different lengths
+        return None
+    if array.ndim != 1 or array.dtype.kind not in 'biuf':
+        return None
+    return array.astype(numpy.float64, copy=False)
+
+
+class RegisteredFunction:
+    """
+    The ExecuteFunction implementation of a registered function.
+    """
+
+    def __init__(self, func, function_id, name, function_type, params, return_type, row_independent=None):
+        """
+        Class initializer.
+        :param func: the decorated Python function, taking the parameter columns as keyword arguments
+        :param function_id: the function id
+        :param name: name of the function in Qlik
+        :param function_type: SSE.FunctionType, SCALAR, AGGREGATION or TENSOR
+        :param params: dict of parameter name and SSE.DataType
+        :param return_type: SSE.DataType of the result
+        :param row_independent: whether the result of a row only depends on that row, in which case the function
+        is called once per bundle of rows as they are received. Default: True for scalar functions
+        """
+        for param_name in params:
+            if not param_name.isidentifier():
+                raise ValueError('Parameter {} of {} is not a valid Python identifier'.format(param_name, name))
+        self.func = func
+        self.function_id = function_id
+        self.name = name
+        self.function_type = function_type
+        # Qlik sends the parameters ordered by name, see ssecommon.capabilities.build_capabilities
+        self.params = sorted(params.items())
+        self.return_type = return_type
+        self.row_independent = function_type == SSE.SCALAR if row_independent is None else row_independent
+
+    @property
+    def definition(self):
+        """
+        :return: the function definition, in the format of functions.json
+        """
+        return {'Id': self.function_id, 'Name': self.name, 'Type': self.function_type,
+                'ReturnType': self.return_type, 'Params': dict(self.params)}
+
+    @staticmethod
+    def _decode(context, decoder, *args):
+        try:
+            return decoder(*args)
+        except ValueError as e:
+            # Make sure the error handling, including logging, works as intended in the client
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
+            # Raise error on the plugin-side
+            raise grpc.RpcError(grpc.StatusCode.INVALID_ARGUMENT, str(e))
+
+    def call(self, columns):
+        """
+        :param columns: the decoded parameter columns, in the order Qlik sends them
+        :return: the result of the function
+        """
+        return self.func(**{param_name: column for (param_name, _), column in zip(self.params, columns)})
+
+    def __call__(self, request, context):
+        """
+        Decodes the request into columns, calls the function and encodes its result.
+        :param request: an iterable sequence of BundledRows
+        :param context: the context sent from client
+        :return: generator of BundledRows
+        """
+        data_types = [data_type for _, data_type in self.params]
+        if self.row_independent:
+            for bundled_rows in request:
+                columns = self._decode(context, decode_bundle, bundled_rows, data_types)
+                yield from encode_column(to_column(self.call(columns), self.return_type))
+            return
+
+        columns = self._decode(context, decode, request, data_types, get_cardinality(context))
+        result = self.call(columns)
+        if self.function_type == SSE.AGGREGATION:
+            # A single value
+            result = [result] if self.return_type != SSE.DUAL else ([result[0]], [result[1]])
+        yield from encode_column(to_column(result, self.return_type))
+
+
+class FunctionRegistry:
+    """
+    The functions registered with the function decorator, by function id.
+    """
+
+    def __init__(self):
+        self._functions = {}
+
+    def __len__(self):
+        return len(self._functions)
+
+    def __contains__(self, function_id):
+        return function_id in self._functions
+
+    def function(self, name, function_type, params, return_type, function_id=None, row_independent=None):
+        """
+        Decorator registering a function. The decorated function is returned unchanged, so it can still be called
+        directly, e.g. in a unit test.
+        :param name: name of the function in Qlik
+        :param function_type: SSE.FunctionType, SCALAR, AGGREGATION or TENSOR
+        :param params: dict of parameter name and SSE.DataType
+        :param return_type: SSE.DataType of the result
+        :param function_id: the function id, the next free id if None
+        :param row_independent: see RegisteredFunction
+        :return: the decorator
+        """
+        def register(func):
+            registered_id = function_id
+            if registered_id is None:
+                registered_id = max(self._functions, default=-1) + 1
+            if registered_id in self._functions:
+                raise ValueError('Id {} of {} is used by {}'
+                                 .format(registered_id, name, self._functions[registered_id].name))
+            self._functions[registered_id] = RegisteredFunction(func, registered_id, name, function_type, params,
+                                                                return_type, row_independent)
+            return func
+        return register
+
+    def definitions(self):
+        """
+        :return: the function definitions of the registered functions, in the format of functions.json
+        """
+        return [self._functions[function_id].definition for function_id in sorted(self._functions)]
+
+    def implementations(self):
+        """
+        :return: dict of function id and ExecuteFunction implementation
+        """
+        return dict(self._functions)
+
+    def write_definitions(self, path):
+        """
+        Writes the function definitions to a file in the format of functions.json.
+        :param path: the file to write
+        """
+        with open(path, 'w') as json_file:
+            json.dump({'Functions': self.definitions()}, json_file, indent=2)
+            json_file.write('\n')
+
+
+# Registry of the functions of the plugin, used by the sse_function decorator
+registry = FunctionRegistry()
+
+
+def sse_function(name, function_type, params, return_type, function_id=None, row_independent=None):
+    """
+    Registers a function, called with whole columns, in the registry of the plugin. See FunctionRegistry.function.
+    """
+    return registry.function(name, function_type, params, return_type, function_id, row_independent)
@@ -0,0 +1,137 @@
+"""
+Plugin side cache of script results.
+
+When many users open the same sheet the same script is evaluated over the same data again and again. The result
+is cached in memory, keyed by the script, its types and a digest of the received data, so that it can be reused
+across apps and engine restarts. A script containing the comment `# qlik-cache: no-store` is neither read from nor
+written to the cache, and tells Qlik not to cache it either.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy
+
+from ssecommon.columnar import DualColumn
+
+NO_STORE_PATTERN = re.compile(r'#\s*qlik-cache\s*:\s*no-store')
+
+
+def is_no_store(script):
+    """
+    :param script: the script sent from Qlik
+    :return: True if the script has disabled caching
+    """
+    return NO_STORE_PATTERN.search(script) is not None
+
+
+def script_request_key(header, columns=()):
+    """
+    Creates the cache key of a script request.
+    :param header: the ScriptRequestHeader
+    :param columns: the decoded parameter columns, see ssecommon.columnar
+    :return: a digest of the script, function type, return type, parameter types and data
+    """
+    digest = hashlib.sha1()
+    digest.update(header.script.encode('utf-8'))
+    digest.update(bytes([0, header.functionType, header.returnType]))
+    digest.update(bytes(param.dataType for param in header.params))
+
+    for column in columns:
+        arrays = (column.numbers, column.strings) if isinstance(column, DualColumn) else (column,)
+        for array in arrays:
+            digest.update(len(array).to_bytes(8, 'little'))
+            if array.dtype == object:
+                # The lengths make the joined strings unambiguous
+                strings = array.tolist()
+                digest.update(numpy.fromiter(map(len, strings), dtype=numpy.int64, count=len(strings)).tobytes())
+                digest.update('\0'.join(strings).encode('utf-8'))
+            else:
+                # Hashed in place, a memory-mapped column is not copied into memory
+                digest.update(numpy.ascontiguousarray(array))
+    return digest.digest()
+
+
+class ResultCache:
+    """
+    A thread safe LRU cache bounded by the total size of the cached values, with a time to live per entry.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=300, clock=time.monotonic):
+        """
+        Class initializer.
+        :param max_bytes: byte budget of the cached values, the least recently used entries are evicted first.
+        0 disables the cache.
+        :param ttl: seconds an entry is valid after it was stored
+        :param clock: function returning the current time in seconds
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expiry time, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """
+        :param key: the cache key
+        :return: the cached value, None if not cached or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expiry, size, value = entry
+            if expiry <= self._clock():
+                del self._entries[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size):
+        """
+        Stores a value. Values larger than the whole budget are not stored.
+        :param key: the cache key
+        :param value: the value to cache
+        :param size: size of the value in bytes
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (self._clock() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        """
+        :return: dict with the number of entries, their size in bytes, the counters and the hit rate
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'expirations': self.expirations,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
@@ -0,0 +1,85 @@
+"""
+Cache of compiled scripts.
+
+Qlik sends the same script with every request from a chart, so instead of letting eval and exec compile the script
+text each time, the plugins compile it once and reuse the code object.
+"""
+import threading
+from collections import OrderedDict
+
+
+class CompiledScriptCache:
+    """
+    A bounded, thread safe LRU cache of code objects keyed by script text and compile mode.
+    """
+
+    def __init__(self, max_size=256):
+        """
+        Class initializer.
+        :param max_size: maximum number of compiled scripts kept, the least recently used is evicted first
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._code = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._code)
+
+    def get(self, script, mode='eval'):
+        """
+        Retrieves the compiled script, compiling it on a cache miss.
+        A script with a syntax error raises SyntaxError, just as eval and exec do, and is not cached.
+        :param script: the script text
+        :param mode: 'eval' for an expression, 'exec' for statements
+        :return: a code object that can be passed to eval or exec
+        """
+        key = (script, mode)
+        with self._lock:
+            code = self._code.get(key)
+            if code is not None:
+                self._code.move_to_end(key)
+                self.hits += 1
+                return code
+            self.misses += 1
+
+        # Compile outside the lock, a concurrent miss of the same script only costs an extra compilation
+        code = compile(script, '<script>', mode)
+
+        with self._lock:
+            self._code[key] = code
+            self._code.move_to_end(key)
+            while len(self._code) > self.max_size:
+                self._code.popitem(last=False)
+                self.evictions += 1
+        return code
+
+    def stats(self):
+        """
+        :return: dict with the size of the cache and its hit, miss and eviction counters
+        """
+        with self._lock:
+            return {'size': len(self._code), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        """
+        Removes all compiled scripts, the counters are kept.
+        """
+        with self._lock:
+            self._code.clear()
+
+
+# Cache shared by all ScriptEval instances of the plugin
+script_cache = CompiledScriptCache()
+
+
+def compile_script(script, mode='eval'):
+    """
+    Compiles the script using the shared cache.
+    :param script: the script text
+    :param mode: 'eval' for an expression, 'exec' for statements
+    :return: a code object
+    """
+    return script_cache.get(script, mode)
@@ -0,0 +1,105 @@
+"""
+Serving of a plugin's ExtensionService, shared by the examples.
+
+The ExtensionService.Serve method of each example calls serve, which sets up the gRPC server in the mode given on
+the command line: a thread of the server for each stream, or a grpc.aio server, see ssecommon.aioserver; with the
+metrics and the quotas of the Qlik apps recorded by ssecommon.metrics, and the port shared with the other worker
+processes of ssecommon.prefork.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent import futures
+
+import grpc
+
+from ssecommon.metrics import Metrics
+from ssecommon.prefork import REUSE_PORT_OPTIONS
+from ssecommon.wire import add_to_server
+
+_ONE_DAY_IN_SECONDS = 60 * 60 * 24
+
+
+def read_credentials(pem_dir):
+    """
+    Creates the server credentials from the certificates in pem_dir.
+    :param pem_dir: Directory including certificates
+    :return: grpc.ServerCredentials
+    """
+    with open(os.path.join(pem_dir, 'sse_server_key.pem'), 'rb') as f:
+        private_key = f.read()
+    with open(os.path.join(pem_dir, 'sse_server_cert.pem'), 'rb') as f:
+        cert_chain = f.read()
+    with open(os.path.join(pem_dir, 'root_cert.pem'), 'rb') as f:
+        root_cert = f.read()
+    return grpc.ssl_server_credentials([(private_key, cert_chain)], root_cert, True)
+
+
+def serve(servicer, port, pem_dir, aio=False, metrics_port=None, reuse_port=False, quotas=None, on_stop=None,
+          max_workers=10, metrics=None):
+    """
+    Sets up the gRPC server of the servicer and runs it until the plugin is interrupted.
+    :param servicer: the plugin's ExtensionService
+    :param port: port to listen on.
+    :param pem_dir: Directory including certificates, None for an insecure connection
+    :param aio: serve the streams with a grpc.aio server on an asyncio event loop instead of a thread each
+    :param metrics_port: port of the HTTP endpoint serving metrics of the calls, None to not record metrics
+    :param reuse_port: let the worker processes of ssecommon.prefork listen on the same port
+    :param quotas: ssecommon.accounting.Quotas limiting the calls of each Qlik app, None for no limits
+    :param on_stop: function called when the server has stopped, e.g. to stop the plugin's worker processes
+    :param max_workers: number of threads of the server
+    :param metrics: ssecommon.metrics.Metrics recording the calls, e.g. served on a port chosen by the caller. Default:
+    created if metrics_port or quotas is set
+    :return: None
+    """
+    if metrics is None and (metrics_port or quotas is not None):
+        # The quotas are enforced by the instrumented servicer, from the usage it records
+        metrics = Metrics(quotas=quotas)
+        if metrics_port:
+            metrics.start_http_server(metrics_port)
+
+    try:
+        if aio:
+            # grpc.aio requires grpcio 1.32 or later, only import it when asked for
+            from ssecommon import aioserver
+            asyncio.run(aioserver.serve(servicer, port, pem_dir, max_workers, metrics, reuse_port))
+        else:
+            _serve_threads(servicer, port, pem_dir, max_workers, metrics, reuse_port)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if on_stop is not None:
+            on_stop()
+
+
+def _serve_threads(servicer, port, pem_dir, max_workers, metrics, reuse_port):
+    """
+    Runs a grpc.server serving each stream in a thread of its own, see serve.
+    """
+    # Create gRPC server
+    options = REUSE_PORT_OPTIONS if reuse_port else None
+    if metrics is None:
+        server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=options)
+        add_to_server(servicer, server)
+    else:
+        # Record the metrics of each call, and the number of calls waiting for a thread of the executor
+        server = grpc.server(metrics.create_executor(max_workers), options=options)
+        metrics.add_to_server(metrics.instrument(servicer), server)
+
+    if pem_dir:
+        # Secure connection
+        server.add_secure_port('[::]:{}'.format(port), read_credentials(pem_dir))
+        logging.info('*** Running server in secure mode on port: {} ***'.format(port))
+    else:
+        # Insecure connection
+        server.add_insecure_port('[::]:{}'.format(port))
+        logging.info('*** Running server in insecure mode on port: {} ***'.format(port))
+
+    # Start gRPC server
+    server.start()
+    try:
+        while True:
+            time.sleep(_ONE_DAY_IN_SECONDS)
+    finally:
+        server.stop(0)
@@ -0,0 +1,189 @@
+"""
+Whole-column evaluation of elementwise scripts.
+
+A row wise script is evaluated with args holding the values of one row. If the script only combines the values of
+that row with operators, string methods and formatting, e.g. args[0] + ' ' + args[1].upper() or
+'{}: {}'.format(args[0], args[1]), the same result is computed over the columns of a whole bundle at once: args[i]
+becomes the column of the parameter, an object array, and each operation a NumPy ufunc applied to all rows, instead
+of one eval per row.
+
+The script is analyzed once, from its syntax tree. Only the following expressions are evaluated column wise:
+    args[<int>]                                 the column of a parameter
+    constants                                   broadcast to all rows
+    a + b, a * b, a % b, a % (b, c, ...)        the Python operators, applied elementwise
+    a.method(b, ...)                            a method of str, e.g. 'sep'.join or args[0].upper()
+    a[<int>], a[<int>:<int>]                    indexing and slicing
+    f'{a} {b!r:>10}'                            f-strings with constant format specifications
+    str(a), len(a), int(a), float(a), repr(a)   conversions
+Any other script is evaluated row by row. A script with the comment '# qlik-eval: columns' is instead evaluated once
+as written, with args holding the whole columns and numpy available, and must return one value per row.
+"""
+import ast
+import operator
+import re
+
+import numpy
+
+from ssecommon.scriptcache import compile_script
+
+COLUMNS_PATTERN = re.compile(r'#\s*qlik-eval\s*:\s*columns')
+
+_OPERATORS = {ast.Add: numpy.add, ast.Mult: numpy.multiply, ast.Mod: numpy.remainder}
+_CONVERSIONS = {'str': str, 'len': len, 'int': int, 'float': float, 'repr': repr}
+_FORMAT_CONVERSIONS = {-1: None, ord('s'): str, ord('r'): repr, ord('a'): ascii}
+
+
+def _ufunc(func, nin):
+    """
+    :return: a ufunc applying func to the elements of its nin arguments, broadcasting scalars, as an object array
+    """
+    return numpy.frompyfunc(func, nin, 1)
+
+
+def _format_tuple(fmt, *values):
+    return fmt % values
+
+
+def _constant(node):
+    """
+    :return: the value of a constant node
+    :raise ValueError: if the node is not a constant
+    """
+    if isinstance(node, ast.Constant) and not isinstance(node.value, bytes):
+        return node.value
+    raise ValueError('Not a constant: {}'.format(ast.dump(node)))
+
+
+def _subscript(node):
+    """
+    :param node: an ast.Subscript
+    :return: the node of its index or slice. Before Python 3.9 an index is wrapped in an ast.Index
+    """
+    if isinstance(node.slice, getattr(ast, 'Index', ())):
+        return node.slice.value
+    return node.slice
+
+
+class _Compiler:
+    """
+    Translates the syntax tree of an elementwise script into a function of the parameter columns.
+    Every method returns a function taking the list of columns, and raises ValueError for an unsupported expression.
+    """
+
+    def compile(self, node):
+        method = getattr(self, '_' + type(node).__name__, None)
+        if method is None:
+            raise ValueError('Not elementwise: {}'.format(type(node).__name__))
+        return method(node)
+
+    def _Expression(self, node):
+        return self.compile(node.body)
+
+    def _Constant(self, node):
+        value = _constant(node)
+        return lambda columns: value
+
+    def _Subscript(self, node):
+        key_node = _subscript(node)
+        if isinstance(node.value, ast.Name) and node.value.id == 'args':
+            index = _constant(key_node)
+            if not isinstance(index, int) or isinstance(index, bool):
+                raise ValueError('Not a parameter index: {}'.format(index))
+            return lambda columns: columns[index]
+
+        value = self.compile(node.value)
+        if isinstance(key_node, ast.Slice):
+            if key_node.step is not None:
+                raise ValueError('Slices with a step are not elementwise')
+            bounds = (key_node.lower, key_node.upper)
+            key = slice(*[None if bound is None else _constant(bound) for bound in bounds])
+        else:
+            key = _constant(key_node)
+        getitem = _ufunc(operator.getitem, 2)
+        return lambda columns: getitem(value(columns), key)
+
+    def _BinOp(self, node):
+        ufunc = _OPERATORS.get(type(node.op))
+        if ufunc is None:
+            raise ValueError('Not elementwise: {}'.format(type(node.op).__name__))
+        left = self.compile(node.left)
+        if isinstance(node.op, ast.Mod) and isinstance(node.right, ast.Tuple):
+            # printf-style formatting of several values
+            values = [self.compile(element) for element in node.right.elts]
+            format_tuple = _ufunc(_format_tuple, 1 + len(values))
+            return lambda columns: format_tuple(left(columns), *[value(columns) for value in values])
+        right = self.compile(node.right)
+        return lambda columns: ufunc(left(columns), right(columns))
+
+    def _Call(self, node):
+        if node.keywords or any(isinstance(arg, ast.Starred) for arg in node.args):
+            raise ValueError('Keyword and starred arguments are not elementwise')
+        args = [self.compile(arg) for arg in node.args]
+
+        if isinstance(node.func, ast.Attribute) and hasattr(str, node.func.attr):
+            # A method of str, called on each value, e.g. args[0].upper() or ', '.join
+            func = getattr(str, node.func.attr)
+            args.insert(0, self.compile(node.func.value))
+        elif isinstance(node.func, ast.Name) and node.func.id in _CONVERSIONS:
+            func = _CONVERSIONS[node.func.id]
+        else:
+            raise ValueError('Not elementwise: call of {}'.format(ast.dump(node.func)))
+
+        ufunc = _ufunc(func, len(args))
+        return lambda columns: ufunc(*[arg(columns) for arg in args])
+
+    def _JoinedStr(self, node):
+        parts = [self.compile(value) for value in node.values]
+        concat = _ufunc(lambda *values: ''.join(values), len(parts))
+        return lambda columns: concat(*[part(columns) for part in parts])
+
+    def _FormattedValue(self, node):
+        if node.conversion not in _FORMAT_CONVERSIONS:
+            raise ValueError('Unknown conversion: {}'.format(node.conversion))
+        convert = _FORMAT_CONVERSIONS[node.conversion]
+        spec = ''
+        if node.format_spec is not None:
+            if not all(isinstance(value, ast.Constant) for value in node.format_spec.values):
+                raise ValueError('Format specifications must be constant')
+            spec = ''.join(_constant(value) for value in node.format_spec.values)
+        value = self.compile(node.value)
+        formatted = _ufunc(lambda v: format(v if convert is None else convert(v), spec), 1)
+        return lambda columns: formatted(value(columns))
+
+
+def _checked(evaluate):
+    """
+    :param evaluate: a function of the parameter columns
+    :return: the function returning one value per row, a single value repeated for all rows
+    """
+    def evaluate_checked(columns):
+        n_rows = len(columns[0]) if columns else 0
+        result = evaluate(columns)
+        if numpy.ndim(result) == 0:
+            # No parameter was used, the same value for all rows
+            return numpy.full(n_rows, result, dtype=object)
+        if len(result) != n_rows:
+            raise ValueError('The script returned {} values for {} rows'.format(len(result), n_rows))
+        return result
+    return evaluate_checked
+
+
+def vectorize(script):
+    """
+    Prepares the whole-column evaluation of a row wise script.
+    :param script: the script sent from Qlik, evaluated with args holding the values of a row
+    :return: a function taking the list of parameter columns, of the same length, and returning the result of each
+    row as a sequence, or None if the script must be evaluated row by row. The function raises the first error of a
+    row, or ValueError if the script does not return one value per row
+    """
+    if COLUMNS_PATTERN.search(script):
+        def evaluate_columns(columns):
+            return eval(compile_script(script), {'args': list(columns), 'numpy': numpy})
+        return _checked(evaluate_columns)
+
+    try:
+        tree = ast.parse(script, mode='eval')
+        evaluate = _Compiler().compile(tree)
+    except (SyntaxError, ValueError):
+        return None
+    return _checked(evaluate)
@@ -0,0 +1,501 @@
+"""
+Direct encoding and decoding of BundledRows messages in the protobuf wire format.
+
+Building a response with protobuf creates a Dual message per value and a Row message per row, which the pure Python
+implementation of protobuf then serializes one field at a time. The encoded messages are simple enough to be written
+directly from the column buffers instead:
+
+    BundledRows  rows   = 1  repeated Row     tag 0x0A, length, Row
+    Row          duals  = 1  repeated Dual    tag 0x0A, length, Dual
+    Dual         numData = 1 double           tag 0x09, 8 bytes little-endian
+                 strData = 2 string           tag 0x12, length, UTF-8 bytes
+
+A numData of which all bits are zero and an empty strData are not written, the proto3 defaults. Numerical columns
+are encoded with NumPy for all rows at once, string and dual columns value by value.
+
+A received message is kept as a ReceivedRows, its bytes, and the columnar decoders read the values from the bytes into
+NumPy arrays without creating a message per row and value. A numerical bundle in which every row holds the same
+number of non-zero numbers is decoded with NumPy for all rows at once, any other bundle value by value. The messages
+are only parsed by protobuf when the rows are read, e.g. by a row wise function.
+
+The plugins register add_to_server instead of SSE.add_ConnectorServicer_to_server, so that the BundledRows streams
+receive a ReceivedRows and can send a SerializedRows, returned as is by the response serializer, as well as a
+BundledRows message.
+"""
+import struct
+
+import grpc
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.columnar import DualColumn, check_row_sizes
+
+_TAG_ROW = b'\x0a'  # BundledRows.rows and Row.duals, field 1, length delimited
+_TAG_NUMBER = 0x09  # Dual.numData, field 1, 64-bit
+_TAG_STRING = b'\x12'  # Dual.strData, field 2, length delimited
+_NUMBER_SIZE = 9  # The tag and the 8 bytes of a double
+_pack_number = struct.Struct('<Bd').pack
+_unpack_number = struct.Struct('<d').unpack_from
+_SMALL_VARINTS = [bytes((value,)) for value in range(0x80)]
+
+
+class SerializedRows:
+    """
+    A BundledRows message already serialized to the wire format. It is sent as is by the response serializer, and
+    can be used in place of the message where a response is sent or its size is needed.
+    """
+    __slots__ = ('data', 'row_count')
+
+    def __init__(self, data, row_count):
+        """
+        Class initializer.
+        :param data: the serialized BundledRows message
+        :param row_count: number of rows of the message
+        """
+        self.data = data
+        self.row_count = row_count
+
+    def SerializeToString(self):
+        """
+        :return: the serialized message
+        """
+        return self.data
+
+    def ByteSize(self):
+        """
+        :return: the size of the serialized message
+        """
+        return len(self.data)
+
+    def parse(self):
+        """
+        :return: the BundledRows message, e.g. for inspecting the rows in a test
+        """
+        return SSE.BundledRows.FromString(self.data)
+
+
+class ReceivedRows:
+    """
+    A received BundledRows message kept in the wire format. The values are decoded from the bytes by decode_columns
+    and decode_numbers, which ssecommon.columnar uses, and the message is parsed by protobuf when its rows are read.
+    """
+    __slots__ = ('data', '_message', '_row_count')
+
+    def __init__(self, data):
+        """
+        Class initializer.
+        :param data: the serialized BundledRows message
+        """
+        self.data = data
+        self._message = None
+        self._row_count = None
+
+    @property
+    def rows(self):
+        """
+        :return: the rows of the parsed message
+        """
+        return self.parse().rows
+
+    @property
+    def row_count(self):
+        """
+        :return: number of rows of the message, counted without parsing the rows
+        """
+        if self._row_count is None:
+            self._row_count = _count_rows(self.data)
+        return self._row_count
+
+    def parse(self):
+        """
+        :return: the BundledRows message, parsed once
+        """
+        if self._message is None:
+            self._message = SSE.BundledRows.FromString(self.data)
+        return self._message
+
+    def SerializeToString(self):
+        """
+        :return: the serialized message
+        """
+        return self.data
+
+    def ByteSize(self):
+        """
+        :return: the size of the serialized message
+        """
+        return len(self.data)
+
+    def decode_columns(self, data_types):
+        """
+        Decodes the message into columns, see ssecommon.columnar.decode_bundle.
+        :param data_types: list of SSE.DataType, one per column
+        :return: list of columns
+        """
+        n_cols = len(data_types)
+        if n_cols and all(data_type == SSE.NUMERIC for data_type in data_types):
+            matrix = _decode_fixed_numbers(self.data)
+            if matrix is not None and matrix.shape[1] == n_cols:
+                return list(numpy.ascontiguousarray(matrix.T))
+
+        numbers, strings, row_sizes = _decode_cells(self.data)
+        check_row_sizes(row_sizes, n_cols)
+
+        columns = []
+        for i, data_type in enumerate(data_types):
+            if data_type == SSE.NUMERIC:
+                columns.append(numpy.array(numbers[i::n_cols], dtype=numpy.float64))
+            elif data_type == SSE.STRING:
+                columns.append(_object_array(strings[i::n_cols]))
+            elif data_type == SSE.DUAL:
+                columns.append(DualColumn(numpy.array(numbers[i::n_cols], dtype=numpy.float64),
+                                          _object_array(strings[i::n_cols])))
+            else:
+                raise ValueError('Undefined data type: {}'.format(data_type))
+        return columns
+
+    def decode_numbers(self):
+        """
+        Decodes a message with numerical values only, see ssecommon.columnar.decode_numeric_bundle.
+        :return: float64 array of shape (rows, columns)
+        """
+        matrix = _decode_fixed_numbers(self.data)
+        if matrix is not None:
+            return matrix
+        numbers, _, row_sizes = _decode_cells(self.data)
+        if not row_sizes:
+            return numpy.empty((0, 0), dtype=numpy.float64)
+        check_row_sizes(row_sizes, row_sizes[0])
+        return numpy.array(numbers, dtype=numpy.float64).reshape(len(row_sizes), -1)
+
+
+def row_count(bundled_rows):
+    """
+    :param bundled_rows: a BundledRows, a SerializedRows or a ReceivedRows
+    :return: number of rows of the message
+    """
+    if isinstance(bundled_rows, (SerializedRows, ReceivedRows)):
+        return bundled_rows.row_count
+    return len(bundled_rows.rows)
+
+
+def _object_array(values):
+    """
+    :param values: list of str
+    :return: the values as a one dimensional object array
+    """
+    array = numpy.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _read_varint(data, pos):
+    """
+    :param data: the serialized message
+    :param pos: position of a varint
+    :return: tuple of the value and the position after the varint
+    """
+    value = data[pos]
+    if value < 0x80:
+        return value, pos + 1
+    value &= 0x7F
+    shift = 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
+
+
+def _skip_field(data, pos, key):
+    """
+    Skips the value of a field that is not part of the messages as they are known here.
+    :param data: the serialized message
+    :param pos: position of the value
+    :param key: the tag of the field
+    :return: the position after the value
+    """
+    wire_type = key & 0x07
+    if wire_type == 0:
+        return _read_varint(data, pos)[1]
+    elif wire_type == 1:
+        return pos + 8
+    elif wire_type == 2:
+        length, pos = _read_varint(data, pos)
+        return pos + length
+    elif wire_type == 5:
+        return pos + 4
+    raise ValueError('Unsupported wire type {} in a BundledRows message'.format(wire_type))
+
+
+def _count_rows(data):
+    """
+    :param data: a serialized BundledRows
+    :return: number of rows, the value of each row is skipped
+    """
+    count = 0
+    pos = 0
+    end = len(data)
+    try:
+        while pos < end:
+            key, pos = _read_varint(data, pos)
+            if key == _TAG_ROW[0]:
+                count += 1
+            pos = _skip_field(data, pos, key)
+    except IndexError:
+        raise ValueError('Truncated BundledRows message')
+    return count
+
+
+def _decode_cells(data):
+    """
+    Decodes every Dual of a serialized BundledRows, in order.
+    :param data: the serialized message
+    :return: tuple of the list of numData and the list of strData of the Duals, and the list of the number of Duals
+    of each row
+    """
+    numbers = []
+    strings = []
+    row_sizes = []
+    add_number = numbers.append
+    add_string = strings.append
+    tag_row = _TAG_ROW[0]
+    tag_string = _TAG_STRING[0]
+    pos = 0
+    end = len(data)
+    try:
+        while pos < end:
+            key, pos = _read_varint(data, pos)
+            if key != tag_row:
+                pos = _skip_field(data, pos, key)
+                continue
+            length, pos = _read_varint(data, pos)
+            row_end = pos + length
+            n_duals = 0
+            while pos < row_end:
+                key, pos = _read_varint(data, pos)
+                if key != tag_row:
+                    pos = _skip_field(data, pos, key)
+                    continue
+                length, pos = _read_varint(data, pos)
+                dual_end = pos + length
+                number = 0.0
+                string = ''
+                while pos < dual_end:
+                    key, pos = _read_varint(data, pos)
+                    if key == _TAG_NUMBER:
+                        number = _unpack_number(data, pos)[0]
+                        pos += 8
+                    elif key == tag_string:
+                        length, pos = _read_varint(data, pos)
+                        string = data[pos:pos + length].decode('utf-8')
+                        pos += length
+                    else:
+                        pos = _skip_field(data, pos, key)
+                add_number(number)
+                add_string(string)
+                n_duals += 1
+            row_sizes.append(n_duals)
+    except (IndexError, struct.error):
+        raise ValueError('Truncated BundledRows message')
+    if pos != end:
+        raise ValueError('Truncated BundledRows message')
+    return numbers, strings, row_sizes
+
+
+def _decode_fixed_numbers(data):
+    """
+    Decodes a serialized BundledRows of which every row holds the same number of Duals with a numData only, the
+    layout of a numerical bundle without zeros, with NumPy for all rows at once.
+    :param data: the serialized message
+    :return: float64 array of shape (rows, columns), or None if the message is laid out otherwise
+    """
+    if len(data) < 2 or data[0] != _TAG_ROW[0]:
+        return None
+    row_size, start = _read_varint(data, 1)
+    n_cols, rest = divmod(row_size, 2 + _NUMBER_SIZE)
+    stride = start + row_size
+    if rest or not n_cols or len(data) % stride:
+        return None
+
+    rows = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, stride)
+    cells = rows[:, start:].reshape(len(rows), n_cols, 2 + _NUMBER_SIZE)
+    prefix = numpy.frombuffer(data, dtype=numpy.uint8, count=start)
+    if not (rows[:, :start] == prefix).all() or \
+            not (cells[:, :, :3] == (_TAG_ROW[0], _NUMBER_SIZE, _TAG_NUMBER)).all():
+        return None
+    return numpy.ascontiguousarray(cells[:, :, 3:]).view('<f8').reshape(len(rows), n_cols)
+
+
+def _varint(value):
+    """
+    :param value: a non-negative integer
+    :return: the value encoded as a protobuf varint
+    """
+    if value < 0x80:
+        return _SMALL_VARINTS[value]
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7F | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _varint_array(values):
+    """
+    Encodes an array of non-negative integers as varints, each prefixed by the tag of a repeated message field.
+    :param values: int64 array
+    :return: a tuple of a uint8 array, one row of bytes per value, and a mask of the bytes to keep
+    """
+    width = 1
+    while values.size and values.max() >> (7 * width):
+        width += 1
+    encoded = numpy.empty((len(values), 1 + width), dtype=numpy.uint8)
+    keep = numpy.empty(encoded.shape, dtype=bool)
+    encoded[:, 0] = _TAG_ROW[0]
+    keep[:, 0] = True
+    for i in range(width):
+        remaining = values >> (7 * i)
+        encoded[:, 1 + i] = (remaining & 0x7F) | numpy.where(remaining >> 7 != 0, 0x80, 0)
+        keep[:, 1 + i] = (remaining != 0) if i else True
+    return encoded, keep
+
+
+def _serialize_numbers(matrix):
+    """
+    Encodes the rows of a numerical matrix, all rows at once.
+    :param matrix: float64 array of shape (rows, columns)
+    :return: the serialized rows
+    """
+    n_rows, n_columns = matrix.shape
+    numbers = numpy.ascontiguousarray(matrix, dtype='<f8')
+    present = numbers.view('<u8') != 0
+
+    # Each value is a Dual of 0 or 9 bytes, with its tag and length in front
+    cells = numpy.empty((n_rows, n_columns, 2 + _NUMBER_SIZE), dtype=numpy.uint8)
+    cells[:, :, 0] = _TAG_ROW[0]
+    cells[:, :, 1] = numpy.where(present, _NUMBER_SIZE, 0)
+    cells[:, :, 2] = _TAG_NUMBER
+    cells[:, :, 3:] = numbers.view(numpy.uint8).reshape(n_rows, n_columns, 8)
+    cells = cells.reshape(n_rows, n_columns * (2 + _NUMBER_SIZE))
+
+    # Each row with the tag and length of the row in front
+    row_sizes = 2 * n_columns + _NUMBER_SIZE * present.sum(axis=1, dtype=numpy.int64)
+    prefixes, prefix_keep = _varint_array(row_sizes)
+    rows = numpy.concatenate([prefixes, cells], axis=1)
+    if present.all() and prefix_keep.all():
+        return rows.tobytes()
+    keep = numpy.empty((n_rows, n_columns, 2 + _NUMBER_SIZE), dtype=bool)
+    keep[:, :, :2] = True
+    keep[:, :, 2:] = present[:, :, None]
+    keep = numpy.concatenate([prefix_keep, keep.reshape(n_rows, n_columns * (2 + _NUMBER_SIZE))], axis=1)
+    return rows[keep].tobytes()
+
+
+def _number_fields(numbers):
+    """
+    :param numbers: float64 array
+    :return: list of the encoded numData field of each value
+    """
+    numbers = numpy.asarray(numbers, dtype=numpy.float64)
+    present = numbers.view(numpy.uint64) != 0
+    return [_pack_number(_TAG_NUMBER, number) if is_present else b''
+            for number, is_present in zip(numbers.tolist(), present.tolist())]
+
+
+def _string_fields(strings):
+    """
+    :param strings: sequence of str
+    :return: list of the encoded strData field of each value
+    """
+    fields = []
+    append = fields.append
+    for string in strings:
+        if string:
+            encoded = string.encode('utf-8')
+            append(_TAG_STRING + _varint(len(encoded)) + encoded)
+        else:
+            append(b'')
+    return fields
+
+
+def _cells(column):
+    """
+    :param column: a column, see ssecommon.columnar.encode_bundle
+    :return: list of the encoded Dual of each value, with its tag and length
+    """
+    if isinstance(column, DualColumn):
+        duals = [number + string for number, string in
+                 zip(_number_fields(column.numbers), _string_fields(column.strings.tolist()))]
+    elif column.dtype == object:
+        duals = _string_fields(column.tolist())
+    else:
+        duals = _number_fields(column)
+    return [_TAG_ROW + _varint(len(dual)) + dual for dual in duals]
+
+
+def serialize_columns(columns):
+    """
+    Encodes columns of equal length into a serialized BundledRows, the same message as
+    ssecommon.columnar.encode_bundle without creating the message.
+    Float arrays are sent as numerical values, object arrays as strings and DualColumns as both.
+    :param columns: list of columns, see ssecommon.columnar.empty_column
+    :return: a SerializedRows
+    """
+    if not columns:
+        return SerializedRows(b'', 0)
+    if all(not isinstance(column, DualColumn) and column.dtype != object for column in columns):
+        matrix = numpy.column_stack(columns)
+        return SerializedRows(_serialize_numbers(matrix), len(matrix))
+
+    parts = []
+    append = parts.append
+    for cells in zip(*[_cells(column) for column in columns]):
+        row = b''.join(cells)
+        append(_TAG_ROW)
+        append(_varint(len(row)))
+        append(row)
+    return SerializedRows(b''.join(parts), len(parts) // 3)
+
+
+def serialize_response(response):
+    """
+    The response serializer of the BundledRows streams.
+    :param response: a BundledRows or a SerializedRows
+    :return: the serialized message
+    """
+    return response.SerializeToString()
+
+
+def add_to_server(servicer, server, request_deserializer=ReceivedRows, response_serializer=serialize_response):
+    """
+    Adds the servicer to the server, as SSE.add_ConnectorServicer_to_server, with the given deserializer and
+    serializer of the BundledRows streams.
+    :param servicer: the plugin's ExtensionService
+    :param server: a grpc.Server or grpc.aio.Server
+    :param request_deserializer: parses a received BundledRows. Default: keeps the bytes as a ReceivedRows,
+    SSE.BundledRows.FromString parses the message with protobuf
+    :param response_serializer: serializes a BundledRows, or a SerializedRows, to send
+    """
+    rpc_method_handlers = {
+        'GetCapabilities': grpc.unary_unary_rpc_method_handler(
+            servicer.GetCapabilities,
+            request_deserializer=SSE.Empty.FromString,
+            response_serializer=SSE.Capabilities.SerializeToString,
+        ),
+        'ExecuteFunction': grpc.stream_stream_rpc_method_handler(
+            servicer.ExecuteFunction,
+            request_deserializer=request_deserializer,
+            response_serializer=response_serializer,
+        ),
+        'EvaluateScript': grpc.stream_stream_rpc_method_handler(
+            servicer.EvaluateScript,
+            request_deserializer=request_deserializer,
+            response_serializer=response_serializer,
+        ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler('qlik.sse.Connector', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
@@ -0,0 +1,78 @@
+"""
+Unit tests of the incremental aggregation functions.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import grpc
+import numpy
+import ServerSideExtension_pb2 as SSE
+from ssecommon.aggregation import Join, Sum
+from ssecommon.capabilities import bind_implementation
+from test.utils import Context, duals_to_rows, numbers_to_duals
+
+
+class TestAggregation:
+    """
+    Tests of the Aggregator protocol and its implementations.
+    """
+
+    def test_sum(self):
+        """
+        The bundles are summed incrementally.
+        """
+        bundles = [[numpy.array([1.0, 2.0])], [numpy.array([])], [numpy.array([3.5])]]
+
+        assert Sum().aggregate(bundles) == 6.5
+
+    def test_for_definition(self):
+        """
+        An Aggregator class given as the implementation of an aggregation is created for its definition.
+        """
+        definition = {'Id': 1, 'Name': 'HelloWorldAggr', 'Type': SSE.AGGREGATION, 'ReturnType': SSE.STRING,
+                      'Params': {'str1': SSE.STRING}}
+        request = [SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData='x')])]),
+                   SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(strData='y')])])]
+
+        join = bind_implementation(Join, definition)
+
+        assert join.data_types == [SSE.STRING]
+        response = list(join(iter(request), Context()))
+        assert [d.strData for row in response[0].rows for d in row.duals] == ['x, y']
+        for invalid in ({'Type': SSE.TENSOR}, {'ReturnType': SSE.NUMERIC}):
+            try:
+                bind_implementation(Join, dict(definition, **invalid))
+            except ValueError:
+                pass
+            else:
+                assert False, 'ValueError not raised for {}'.format(invalid)
+
+    def test_execute(self):
+        """
+        Called as an ExecuteFunction implementation the result is sent as one row.
+        """
+        request = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1), numbers_to_duals(2))),
+                   SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(4)))]
+
+        response = list(Sum()(iter(request), Context()))
+
+        assert len(response) == 1
+        assert [d.numData for row in response[0].rows for d in row.duals] == [7.0]
+
+    def test_invalid_argument(self):
+        """
+        Rows of the wrong length are reported to the client as an invalid argument.
+        """
+        request = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1, 2)))]
+        context = Context()
+
+        try:
+            list(Sum()(iter(request), context))
+        except grpc.RpcError:
+            assert context.code == grpc.StatusCode.INVALID_ARGUMENT
+        else:
+            assert False, 'RpcError not raised'
@@ -0,0 +1,120 @@
+"""
+Tests of a plugin served by the grpc.aio server of ssecommon.aioserver.
+"""
+import asyncio
+import os
+import sys
+import threading
+from concurrent import futures
+
+# Add Generated folder and the plugin folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+sys.path.append(os.path.join(PARENT_DIR, 'columnoperations'))
+
+import grpc
+import ServerSideExtension_pb2 as SSE
+from test.utils import duals_to_rows, numbers_to_duals
+
+SUM_OF_ROWS_ID = 0
+SUM_OF_COLUMN_ID = 1
+MAX_WORKERS = 2
+
+
+class TestAioServer:
+    """
+    Tests of the ColumnOperations plugin served on an asyncio event loop.
+    """
+
+    def setUp(self):
+        """
+        Test setup, starts the server on an event loop in a thread of its own.
+        """
+        from grpc import aio
+        from columnoperations.__main__ import ExtensionService
+        from ssecommon.aioserver import MAX_THREADS, AsyncServicer
+        from ssecommon.wire import add_to_server
+
+        self.executor = futures.ThreadPoolExecutor(max_workers=MAX_THREADS)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+        async def start():
+            server = aio.server()
+            servicer = ExtensionService(os.path.join(PARENT_DIR, 'columnoperations', 'functions.json'))
+            add_to_server(AsyncServicer(servicer, self.executor, MAX_WORKERS), server)
+            port = server.add_insecure_port('localhost:0')
+            await server.start()
+            return server, port
+
+        self.server, port = asyncio.run_coroutine_threadsafe(start(), self.loop).result()
+        self.channel = grpc.insecure_channel('localhost:{}'.format(port))
+        self.stub = SSE.ConnectorStub(self.channel)
+
+    def tearDown(self):
+        """
+        Stops the server and its event loop.
+        """
+        self.channel.close()
+        asyncio.run_coroutine_threadsafe(self.server.stop(0), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown()
+
+    def test_getcapabilities(self):
+        """
+        Unary calls are run in the executor.
+        """
+        assert self.stub.GetCapabilities(SSE.Empty()).pluginIdentifier == 'Column Operations - Qlik'
+
+    def test_streaming(self):
+        """
+        The plugin receives each bundle as soon as it arrives, so a response is sent before the request stream ends.
+        """
+        header = SSE.FunctionRequestHeader(functionId=SUM_OF_ROWS_ID, version="1")
+        metadata = (('qlik-functionrequestheader-bin', header.SerializeToString()),)
+        responded = threading.Event()
+
+        def request():
+            yield SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1, 2), numbers_to_duals(3, 4)))
+            # Sending the next bundle waits for the response to the first one
+            assert responded.wait(10), 'The first bundle was not answered before the end of the request'
+            yield SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(5, 6)))
+
+        sums = []
+        for bundled_rows in self.stub.ExecuteFunction(request(), metadata=metadata, timeout=30):
+            sums.extend(row.duals[0].numData for row in bundled_rows.rows)
+            responded.set()
+
+        assert sums == [3, 7, 11]
+
+    def test_more_streams_than_workers(self):
+        """
+        A step reading several bundles, an aggregation here, does not hold a worker while it waits for the next one.
+        Aggregations waiting for rows on every worker do not keep other aggregations from completing.
+        """
+        header = SSE.FunctionRequestHeader(functionId=SUM_OF_COLUMN_ID, version="1")
+        metadata = (('qlik-functionrequestheader-bin', header.SerializeToString()),)
+        others_done = threading.Event()
+
+        def request(first, wait=None):
+            for i in range(3):
+                if i and wait is not None:
+                    # The remaining bundles of the first streams are only sent once the other streams have completed
+                    assert wait.wait(10), 'The other streams were blocked by those waiting for rows'
+                yield SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(first + i)))
+
+        def call(first, wait=None):
+            bundles = self.stub.ExecuteFunction(request(first, wait), metadata=metadata, timeout=30)
+            return [row.duals[0].numData for bundled_rows in bundles for row in bundled_rows.rows]
+
+        with futures.ThreadPoolExecutor(max_workers=2 * MAX_WORKERS) as clients:
+            waiting = [clients.submit(call, 0, others_done) for _ in range(MAX_WORKERS)]
+            others = [clients.submit(call, 10) for _ in range(MAX_WORKERS)]
+            try:
+                assert [other.result(timeout=10) for other in others] == [[33.0]] * MAX_WORKERS
+            finally:
+                others_done.set()
+            assert [call.result(timeout=10) for call in waiting] == [[3.0]] * MAX_WORKERS
@@ -0,0 +1,111 @@
+"""
+Unit tests of the conversion between BundledRows and Arrow data.
+"""
+import os
+import sys
+from unittest import SkipTest
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.callplan import is_arrow_script
+from ssecommon.columnar import decode_bundle
+from test.utils import duals_to_bundle, to_messages
+
+try:
+    import pyarrow
+    from ssecommon import arrow
+except ImportError:
+    # pyarrow is an optional dependency
+    pyarrow = None
+
+
+class TestArrow:
+    """
+    Tests of the ssecommon.arrow module.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        if pyarrow is None:
+            raise SkipTest('pyarrow is not installed')
+        self.params = [SSE.Parameter(dataType=SSE.NUMERIC, name='n'), SSE.Parameter(dataType=SSE.STRING, name='s'),
+                       SSE.Parameter(dataType=SSE.DUAL, name='d')]
+        self.bundles = [
+            duals_to_bundle([SSE.Dual(numData=1.5), SSE.Dual(strData='a'), SSE.Dual(numData=1, strData='x')],
+                            [SSE.Dual(numData=-2), SSE.Dual(strData='b'), SSE.Dual(numData=2, strData='y')]),
+            duals_to_bundle([SSE.Dual(numData=3), SSE.Dual(strData='c'), SSE.Dual(numData=3, strData='z')])]
+
+    def test_directive(self):
+        """
+        Scripts opt in to Arrow data with a comment.
+        """
+        assert is_arrow_script('qResult = q  # qlik-data: arrow')
+        assert not is_arrow_script('qResult = q')
+
+    def test_record_batches(self):
+        """
+        Each bundle is converted to a record batch typed from the parameters.
+        """
+        batches = list(arrow.record_batches(iter(self.bundles), self.params))
+
+        assert [batch.num_rows for batch in batches] == [2, 1]
+        assert batches[0].schema.names == ['n', 's', 'd']
+        assert batches[0].schema.types == [pyarrow.float64(), pyarrow.string(), arrow.DUAL_TYPE]
+        assert batches[0].column(0).to_pylist() == [1.5, -2]
+        assert batches[1].column(2).to_pylist() == [{'num': 3, 'str': 'z'}]
+
+    def test_round_trip(self):
+        """
+        Encoding the table of the decoded columns gives back the same rows.
+        """
+        data_types = [param.dataType for param in self.params]
+        columns = decode_bundle(self.bundles[0], data_types)
+        table = arrow.to_table(columns, [param.name for param in self.params])
+
+        assert to_messages(arrow.encode_result(table)) == [self.bundles[0]]
+        assert to_messages(arrow.encode_result(table, data_types=data_types)) == [self.bundles[0]]
+
+    def test_encode_result(self):
+        """
+        A result is typed with the return type, nulls are sent as NaN or empty strings, and split into bundles.
+        """
+        result = pyarrow.array([1, None, 3])
+        bundles = to_messages(arrow.encode_result(result, return_type=SSE.STRING, max_rows=2))
+
+        assert [len(bundle.rows) for bundle in bundles] == [2, 1]
+        assert [row.duals[0].strData for bundle in bundles for row in bundle.rows] == ['1', '', '3']
+
+        numbers = decode_bundle(to_messages(arrow.encode_result(result))[0], [SSE.NUMERIC])[0]
+        assert numpy.isnan(numbers[1]) and numbers[2] == 3
+
+        assert arrow.encode_result(pyarrow.table({'a': pyarrow.array([], pyarrow.int64())})) == [SSE.BundledRows()]
+
+    def test_encode_result_max_bytes(self):
+        """
+        A table of long strings is split into bundles below the size limit.
+        """
+        strings = ['{:0100d}'.format(i) for i in range(100)]
+        table = pyarrow.table({'s': strings, 'n': pyarrow.array(range(100), pyarrow.float64())})
+        bundles = to_messages(arrow.encode_result(table, max_bytes=1000))
+
+        assert len(bundles) > 1
+        assert all(bundle.ByteSize() <= 1000 for bundle in bundles)
+        assert [(row.duals[0].strData, row.duals[1].numData) for bundle in bundles for row in bundle.rows] == \
+            list(zip(strings, range(100)))
+
+    def test_table_description(self):
+        """
+        The fields of the table description are typed from the Arrow types.
+        """
+        table = pyarrow.table({'id': [1, 2], 'name': ['a', 'b']})
+        description = arrow.table_description(table.schema, 'Result')
+
+        assert description.name == 'Result'
+        assert [(f.name, f.dataType) for f in description.fields] == [('id', SSE.NUMERIC), ('name', SSE.STRING)]
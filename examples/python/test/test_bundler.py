@@ -0,0 +1,140 @@
+"""
+Unit tests of the response bundler.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.bundler import ColumnBundler, ResponseBundler, bundle_columns, bundle_rows, row_size
+from ssecommon.bundler import column_row_sizes, encode_column
+from ssecommon.columnar import DualColumn, decode_bundle
+from ssecommon.registry import to_column
+from test.utils import to_messages
+
+
+def _rows(n, text='value'):
+    return [[SSE.Dual(numData=i, strData='{} {}'.format(text, i))] for i in range(n)]
+
+
+class TestResponseBundler:
+    """
+    Tests of the ResponseBundler and its size estimate.
+    """
+
+    def test_size_estimate(self):
+        """
+        The estimated size of the rows is their encoded size.
+        """
+        rows = [[SSE.Dual(numData=1.5, strData='a')],
+                [SSE.Dual(numData=0, strData=''), SSE.Dual(numData=-2)],
+                [SSE.Dual(strData='åäö' * 50)],
+                [SSE.Dual(strData='x' * 300, numData=3)] * 3]
+        bundle = SSE.BundledRows()
+        for duals in rows:
+            bundle.rows.add(duals=duals)
+
+        assert sum(row_size(duals) for duals in rows) == bundle.ByteSize()
+
+    def test_max_rows(self):
+        """
+        A new bundle is started when the row limit is reached.
+        """
+        bundles = list(bundle_rows(_rows(25), max_rows=10))
+
+        assert [len(bundle.rows) for bundle in bundles] == [10, 10, 5]
+        assert [row.duals[0].numData for bundle in bundles for row in bundle.rows] == list(range(25))
+
+    def test_max_bytes(self):
+        """
+        A new bundle is started before the size limit is exceeded.
+        """
+        rows = _rows(100, 'x' * 100)
+        bundles = list(bundle_rows(rows, max_bytes=1000))
+
+        assert len(bundles) > 1
+        assert all(bundle.ByteSize() <= 1000 for bundle in bundles)
+        assert sum(len(bundle.rows) for bundle in bundles) == 100
+
+    def test_large_row(self):
+        """
+        A row larger than the size limit is sent in a bundle of its own.
+        """
+        bundler = ResponseBundler(max_bytes=100)
+        assert bundler.add([SSE.Dual(strData='a')]) is None
+        bundle = bundler.add([SSE.Dual(strData='b' * 200)])
+
+        assert len(bundle.rows) == 1
+        assert len(bundler) == 1
+        assert bundler.flush().rows[0].duals[0].strData == 'b' * 200
+
+    def test_no_rows(self):
+        """
+        An empty result is sent as one empty bundle.
+        """
+        bundles = list(bundle_rows([]))
+
+        assert len(bundles) == 1
+        assert len(bundles[0].rows) == 0
+
+    def test_column_row_sizes(self):
+        """
+        The estimated size of the rows of a column is the size of the rows a ResponseBundler collects.
+        """
+        numbers = to_column([1.5, 0, -2, 3], SSE.NUMERIC)
+        strings = to_column(['a', '', 'åäö' * 50, 'x' * 300], SSE.STRING)
+
+        for column, duals in [(numbers, [SSE.Dual(numData=n) for n in numbers]),
+                              (strings, [SSE.Dual(strData=s) for s in strings]),
+                              (DualColumn(numbers, strings),
+                               [SSE.Dual(numData=n, strData=s) for n, s in zip(numbers, strings)])]:
+            assert column_row_sizes([column]).tolist() == [row_size([dual]) for dual in duals]
+
+    def test_encode_column(self):
+        """
+        A column is split into the bundles of a ResponseBundler, below the size and row limits, in order.
+        """
+        strings = to_column(['{:0100d}'.format(i) for i in range(100)], SSE.STRING)
+        bundles = to_messages(encode_column(strings, max_bytes=1000, max_rows=60))
+        expected = list(bundle_rows([[SSE.Dual(strData=s)] for s in strings], max_bytes=1000, max_rows=60))
+
+        assert all(bundle.ByteSize() <= 1000 for bundle in bundles)
+        assert bundles == expected
+
+        numbers = to_column(numpy.arange(25), SSE.NUMERIC)
+        bundles = to_messages(encode_column(numbers, max_rows=10))
+        assert [len(bundle.rows) for bundle in bundles] == [10, 10, 5]
+        assert decode_bundle(bundles[2], [SSE.NUMERIC])[0].tolist() == [20, 21, 22, 23, 24]
+
+        assert list(encode_column(to_column([], SSE.NUMERIC))) == []
+
+    def test_bundle_columns(self):
+        """
+        The rows of several columns are sent in the bundles of a ResponseBundler, not in a bundle per column.
+        """
+        strings = ['{:050d}'.format(i) for i in range(100)]
+        columns = [to_column(strings[i:i + 7], SSE.STRING) for i in range(0, 100, 7)]
+        bundles = to_messages(bundle_columns(columns, max_bytes=1000, max_rows=15))
+
+        assert bundles == list(bundle_rows([[SSE.Dual(strData=s)] for s in strings], max_bytes=1000, max_rows=15))
+        assert to_messages(bundle_columns([])) == [SSE.BundledRows()]
+
+    def test_column_bundler(self):
+        """
+        Dual columns are collected until a bundle is full, the remaining rows are returned when flushed.
+        """
+        bundler = ColumnBundler(max_rows=4)
+        column = DualColumn(to_column([1, 2, 3], SSE.NUMERIC), to_column(['a', 'b', 'c'], SSE.STRING))
+
+        assert bundler.add(column) == []
+        bundles = to_messages(bundler.add(column))
+        assert len(bundler) == 2
+
+        assert [len(bundle.rows) for bundle in bundles] == [4]
+        assert [(d.numData, d.strData) for row in bundler.flush().parse().rows for d in row.duals] == \
+            [(2, 'b'), (3, 'c')]
@@ -0,0 +1,101 @@
+"""
+Unit tests of the call plans of script requests.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import grpc
+import ServerSideExtension_pb2 as SSE
+from ssecommon.callplan import SCRIPT_HEADER_KEY, CallPlan, CallPlanCache, row_extractor
+from test.utils import Context
+
+
+def _header_bytes(script, data_types, return_type=SSE.NUMERIC):
+    params = [SSE.Parameter(dataType=data_type, name='p{}'.format(i)) for i, data_type in enumerate(data_types)]
+    header = SSE.ScriptRequestHeader(script=script, functionType=SSE.TENSOR, returnType=return_type, params=params)
+    return header.SerializeToString()
+
+
+class TestCallPlan:
+    """
+    Tests of the CallPlanCache and the functions prepared in a CallPlan.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.built = []
+        self.cache = CallPlanCache(self._build, max_size=2)
+
+    def _build(self, header):
+        self.built.append(header.script)
+        return CallPlan(header, header.functionType, None, header.returnType)
+
+    def test_cached_by_header(self):
+        """
+        A plan is built once per distinct header, the least recently used plan is evicted first.
+        """
+        first = _header_bytes('args[0]', [SSE.NUMERIC])
+        plan = self.cache.get(first)
+        assert self.cache.get(first) is plan
+        assert plan.data_types == [SSE.NUMERIC]
+
+        self.cache.get(_header_bytes('args[1]', [SSE.NUMERIC, SSE.NUMERIC]))
+        self.cache.get(_header_bytes('args[0]', [SSE.STRING]))
+
+        assert self.built == ['args[0]', 'args[1]', 'args[0]']
+        assert self.cache.stats() == {'size': 2, 'hits': 1, 'misses': 3, 'evictions': 1}
+        assert self.cache.get(first) is not plan
+
+    def test_row_extractor(self):
+        """
+        The values of mixed parameters are extracted with one getter per column.
+        """
+        duals = [SSE.Dual(numData=1.5), SSE.Dual(strData='a'), SSE.Dual(numData=2, strData='b')]
+
+        assert row_extractor([SSE.NUMERIC, SSE.STRING, SSE.DUAL])(duals) == [1.5, 'a', (2, 'b')]
+        assert row_extractor([SSE.NUMERIC] * 3)(duals) == [1.5, 0, 2]
+        assert row_extractor([SSE.STRING] * 3)(duals) == ['', 'a', 'b']
+
+    def test_encode_and_code(self):
+        """
+        The result is encoded for the return type of the header, and the script compiled when first used.
+        """
+        plan = self.cache.get(_header_bytes('args[0] + args[1][1]', [SSE.STRING, SSE.DUAL], SSE.DUAL))
+        params = plan.extract_row([SSE.Dual(strData='a'), SSE.Dual(numData=1, strData='b')])
+
+        assert eval(plan.code, {'args': params}) == 'ab'
+        assert plan.encode((1, 'ab')) == SSE.Dual(numData=1, strData='ab')
+
+    def test_syntax_error(self):
+        """
+        A script with a syntax error can be planned, the error is raised when the script is compiled.
+        """
+        plan = self.cache.get(_header_bytes('args[', [SSE.NUMERIC]))
+        try:
+            plan.code
+        except SyntaxError:
+            pass
+        else:
+            raise AssertionError('SyntaxError not raised')
+
+    def test_undefined_return_type(self):
+        """
+        No plan is built for a header with an undefined return type, the client receives INVALID_ARGUMENT.
+        """
+        context = Context((SCRIPT_HEADER_KEY, _header_bytes('args[0]', [SSE.NUMERIC], return_type=5)))
+        try:
+            self.cache.get_from_context(context)
+        except grpc.RpcError:
+            pass
+        else:
+            raise AssertionError('grpc.RpcError not raised')
+
+        assert context.code == grpc.StatusCode.INVALID_ARGUMENT
+        assert context.details == 'Undefined data type: 5'
+        assert len(self.cache) == 0
@@ -0,0 +1,95 @@
+"""
+Unit tests of the capabilities built from the function definitions file.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.capabilities import CapabilitiesCache
+
+
+def _definition(function_id, name, params=None):
+    return {'Id': function_id, 'Name': name, 'Type': SSE.TENSOR, 'ReturnType': SSE.STRING,
+            'Params': params if params is not None else {'str1': SSE.STRING}}
+
+
+class TestCapabilitiesCache:
+    """
+    Tests of the CapabilitiesCache.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'functions.json')
+        self.implementations = {0: 'first', 1: 'second'}
+        self.writes = 0
+        self._write([_definition(0, 'First', {'b': SSE.NUMERIC, 'a': SSE.STRING})])
+
+    def tearDown(self):
+        """
+        Test teardown.
+        """
+        shutil.rmtree(self.folder)
+
+    def _write(self, definitions, text=None):
+        with open(self.path, 'w') as f:
+            f.write(text if text is not None else json.dumps({'Functions': definitions}))
+        # Make sure the change is seen also if the file system has a coarse modification time
+        self.writes += 1
+        os.utime(self.path, (self.writes, self.writes))
+
+    def test_build(self):
+        """
+        The Capabilities message and the dispatch table are built from the definitions.
+        """
+        cache = CapabilitiesCache(self.path, self.implementations, 'Test', 'v1')
+
+        capabilities = cache.capabilities
+        assert capabilities.pluginIdentifier == 'Test'
+        assert [f.name for f in capabilities.functions] == ['First']
+        assert [p.name for p in capabilities.functions[0].params] == ['a', 'b']
+        assert cache.get_function(0) == 'first'
+        assert cache.get_function(1) is None
+
+    def test_invalid_at_startup(self):
+        """
+        Invalid definitions raise an error at startup.
+        """
+        self._write([_definition(0, 'First'), _definition(0, 'Duplicate')])
+        try:
+            CapabilitiesCache(self.path, self.implementations, 'Test', 'v1')
+        except ValueError as e:
+            assert 'Id 0 of Duplicate' in str(e)
+        else:
+            assert False, 'ValueError not raised'
+
+    def test_reload(self):
+        """
+        A changed file is reloaded, an invalid edit keeps the previous version.
+        """
+        cache = CapabilitiesCache(self.path, self.implementations, 'Test', 'v1')
+        assert not cache.check()
+
+        self._write([_definition(0, 'First'), _definition(1, 'Second')])
+        assert cache.check()
+        assert [f.name for f in cache.capabilities.functions] == ['First', 'Second']
+        assert cache.get_function(1) == 'second'
+
+        for definitions in ([_definition(2, 'Unimplemented')], [_definition(1, 'Bad', {'x': 7})]):
+            self._write(definitions)
+            assert cache.check()
+            assert [f.name for f in cache.capabilities.functions] == ['First', 'Second']
+
+        self._write(None, text='{"Functions": [')
+        assert cache.check()
+        assert cache.get_function(1) == 'second'
@@ -0,0 +1,131 @@
+"""
+Unit tests of the columnar decoding shared by the plugins.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.columnar import ColumnDecoder, DistinctMapper, DualColumn, decode, decode_bundle, \
+    decode_numeric_bundle, dictionary_encode, encode_bundle, is_spilled, to_list
+from test.utils import duals_to_bundle, numbers_to_duals
+
+
+class TestColumnar:
+    """
+    Tests of the ColumnDecoder.
+    """
+
+    def test_decode_mixed_types(self):
+        """
+        One numeric, one string and one dual column over two bundles.
+        """
+        data_types = [SSE.NUMERIC, SSE.STRING, SSE.DUAL]
+        bundles = [duals_to_bundle([SSE.Dual(numData=1), SSE.Dual(strData='a'), SSE.Dual(numData=10, strData='x')],
+                                   [SSE.Dual(numData=2), SSE.Dual(strData='b'), SSE.Dual(numData=20, strData='y')]),
+                   duals_to_bundle([SSE.Dual(numData=3), SSE.Dual(strData='c'), SSE.Dual(numData=30, strData='z')])]
+
+        columns = decode(iter(bundles), data_types)
+
+        assert columns[0].dtype.name == 'float64'
+        assert columns[0].tolist() == [1, 2, 3]
+        assert columns[1].tolist() == ['a', 'b', 'c']
+        assert isinstance(columns[2], DualColumn)
+        assert to_list(columns[2]) == [[10, 20, 30], ['x', 'y', 'z']]
+
+    def test_buffers_grow_beyond_cardinality(self):
+        """
+        More rows than announced by the cardinality are still decoded.
+        """
+        decoder = ColumnDecoder([SSE.NUMERIC], cardinality=2)
+        for i in range(5):
+            decoder.append(duals_to_bundle([SSE.Dual(numData=i)], [SSE.Dual(numData=i)]))
+
+        assert len(decoder) == 10
+        assert decoder.columns()[0].sum() == 2 * sum(range(5))
+
+    def test_spill_above_memory_budget(self):
+        """
+        The numerical buffers are memory-mapped temporary files once they grow beyond the budget, the strings are
+        kept in memory.
+        """
+        decoder = ColumnDecoder([SSE.NUMERIC, SSE.DUAL, SSE.STRING], memory_budget=64)
+        for i in range(4):
+            row = [SSE.Dual(numData=i), SSE.Dual(numData=-i, strData=str(i)), SSE.Dual(strData='s')]
+            decoder.append(duals_to_bundle(row, row))
+            assert decoder.spilled == (i >= 2)
+
+        columns = decoder.columns()
+        assert isinstance(columns[0], numpy.memmap) and is_spilled(columns[1]) and not is_spilled(columns[2])
+        assert columns[0].tolist() == [0, 0, 1, 1, 2, 2, 3, 3]
+        assert to_list(columns[1]) == [[-0, -0, -1, -1, -2, -2, -3, -3], ['0', '0', '1', '1', '2', '2', '3', '3']]
+        assert to_list(columns[0], keep_numbers=True) is columns[0]
+        assert to_list(columns[2], keep_numbers=True) == ['s'] * 8
+
+        # The cardinality decides up front
+        assert ColumnDecoder([SSE.NUMERIC], cardinality=9, memory_budget=64).spilled
+        assert not ColumnDecoder([SSE.NUMERIC], cardinality=8, memory_budget=64).spilled
+
+    def test_wrong_number_of_values(self):
+        """
+        A row with a missing value is reported as a ValueError.
+        """
+        decoder = ColumnDecoder([SSE.NUMERIC, SSE.NUMERIC])
+        try:
+            decoder.append(duals_to_bundle([SSE.Dual(numData=1)]))
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
+
+    def test_decode_numeric_bundle(self):
+        """
+        The number of columns is taken from the rows.
+        """
+        matrix = decode_numeric_bundle(duals_to_bundle(numbers_to_duals(1, 2, 3), numbers_to_duals(4, 5, 6)))
+
+        assert matrix.shape == (2, 3)
+        assert matrix.sum(axis=1).tolist() == [6, 15]
+        assert decode_numeric_bundle(SSE.BundledRows()).size == 0
+
+    def test_encode_bundle_round_trip(self):
+        """
+        Encoding decoded columns gives back the same message.
+        """
+        data_types = [SSE.STRING, SSE.DUAL, SSE.NUMERIC]
+        bundle = duals_to_bundle([SSE.Dual(strData='a'), SSE.Dual(numData=1, strData='x'), SSE.Dual(numData=0.5)],
+                                 [SSE.Dual(strData='b'), SSE.Dual(numData=2, strData='y'), SSE.Dual(numData=-1)])
+
+        assert encode_bundle(decode_bundle(bundle, data_types)) == bundle
+
+    def test_dictionary_encode(self):
+        """
+        A dictionary encoded column holds each distinct value once, in the order they are first seen.
+        """
+        column = dictionary_encode(['b', 'a', 'b', 'b', 'c', 'a'])
+
+        assert column.values.tolist() == ['b', 'a', 'c']
+        assert column.codes.tolist() == [0, 1, 0, 0, 2, 1]
+        assert column.values[column.codes].tolist() == ['b', 'a', 'b', 'b', 'c', 'a']
+
+    def test_distinct_mapper(self):
+        """
+        The function is called once per distinct value over all bundles, and the results scattered to the rows.
+        """
+        calls = []
+
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+
+        mapper = DistinctMapper(upper)
+
+        assert mapper.map(['a', 'b', 'a']).tolist() == ['A', 'B', 'A']
+        assert mapper.map(['b', 'c', 'c']).tolist() == ['B', 'C', 'C']
+        assert calls == ['a', 'b', 'c']
+        assert mapper.evaluations == 3
@@ -16,6 +16,7 @@ from test.utils import to_numeric_parameters
 
 
 SUM_OF_ROWS_ID = 0
+NORMALIZE_ID = 3
 
 
 class TestColumnOperations:
@@ -68,6 +69,35 @@ class TestColumnOperations:
                 for dual in row.duals:
                     assert dual.numData == 15
 
+    def test_executefunction_malformed_bundle(self):
+        """
+        A bundle with rows of different sizes is reported to Qlik as an invalid argument.
+        """
+        header = SSE.FunctionRequestHeader(functionId=SUM_OF_ROWS_ID, version="1")
+        bundled_rows = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1, 2), numbers_to_duals(3)))]
+        metadata = (('qlik-functionrequestheader-bin', header.SerializeToString()),)
+
+        try:
+            list(self.stub.ExecuteFunction(request_iterator=iter(bundled_rows), metadata=metadata))
+        except grpc.RpcError as e:
+            assert e.code() == grpc.StatusCode.INVALID_ARGUMENT
+        else:
+            assert False, 'RpcError not raised'
+
+    def test_normalize(self):
+        """
+        Test the Normalize function, defined with the sse_function decorator and called with the whole column.
+        """
+        header = SSE.FunctionRequestHeader(functionId=NORMALIZE_ID, version="1")
+        bundled_rows = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1), numbers_to_duals(2))),
+                        SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(3)))]
+        metadata = (('qlik-functionrequestheader-bin', header.SerializeToString()),)
+
+        result = self.stub.ExecuteFunction(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [dual.numData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert [round(value, 6) for value in values] == [-1.224745, 0, 1.224745]
+
     def test_evaluatescript(self):
         """
         Test EvaluateScript ColumnOperations.
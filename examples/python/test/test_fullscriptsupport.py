@@ -3,6 +3,8 @@ Basic testing of SSE functionality.
 """
 import os
 import sys
+from unittest import SkipTest
+import threading
 
 # Add Generated folder to module path.
 PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -69,3 +71,94 @@ class TestFullScriptSupport:
             for row in bundled_row.rows:
                 for dual in row.duals:
                     assert dual.numData == 84
+
+    def test_evaluatescript_no_store(self):
+        """
+        Test EvaluateScript FullScriptSupport with caching disabled.
+
+        A script with the comment '# qlik-cache: no-store' tells
+        Qlik not to cache the result.
+        """
+        params = to_numeric_parameters('num1')
+
+        header = SSE.ScriptRequestHeader(script='sum(args[0])  # qlik-cache: no-store',
+                                         functionType=SSE.AGGREGATION,
+                                         returnType=SSE.NUMERIC,
+                                         params=params)
+
+        rows = duals_to_rows(numbers_to_duals(1), numbers_to_duals(2))
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        assert ('qlik-cache', 'no-store') in result.initial_metadata()
+        for bundled_row in result:
+            for row in bundled_row.rows:
+                for dual in row.duals:
+                    assert dual.numData == 3
+
+    def test_evaluatescript_streaming(self):
+        """
+        Test EvaluateScript FullScriptSupport bundle by bundle.
+
+        A tensor script with the comment '# qlik-stream: bundles' is
+        evaluated on each bundle as it arrives. The result of the first
+        bundle is received before the second bundle is sent.
+        """
+        params = to_numeric_parameters('num1')
+
+        header = SSE.ScriptRequestHeader(script='[a * 2 for a in args[0]]  # qlik-stream: bundles',
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.NUMERIC,
+                                         params=params)
+
+        first_received = threading.Event()
+        sent_after_first = []
+
+        def bundled_rows():
+            yield SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1), numbers_to_duals(2)))
+            sent_after_first.append(first_received.wait(5))
+            yield SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(3)))
+
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = []
+        for bundled_row in self.stub.EvaluateScript(request_iterator=bundled_rows(), metadata=metadata):
+            first_received.set()
+            result.append([dual.numData for row in bundled_row.rows for dual in row.duals])
+
+        assert sent_after_first == [True]
+        assert result == [[2, 4], [6]]
+
+    def test_evaluatescript_arrow(self):
+        """
+        Test EvaluateScript FullScriptSupport with Arrow data.
+
+        A script with the comment '# qlik-data: arrow' receives its
+        parameters as a pyarrow.Table, 'args', and may return Arrow data.
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SkipTest('pyarrow is not installed')
+        params = to_numeric_parameters('num1', 'num2')
+
+        script = "pyarrow.compute.add(args.column('num1'), args.column('num2'))  # qlik-data: arrow"
+        header = SSE.ScriptRequestHeader(script=script,
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.NUMERIC,
+                                         params=params)
+
+        rows = duals_to_rows(numbers_to_duals(42, 42), numbers_to_duals(1, 2))
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [dual.numData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert values == [84, 3]
@@ -0,0 +1,223 @@
+"""
+Basic testing of SSE functionality.
+"""
+import os
+import sys
+from unittest import SkipTest
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import grpc
+import ServerSideExtension_pb2 as SSE
+from test.utils import duals_to_rows
+from test.utils import numbers_to_duals
+from test.utils import to_numeric_parameters
+
+
+class TestFullScriptSupportPandas:
+    """
+    Basic tests for the FullScriptSupport using Pandas plugin.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.channel = grpc.insecure_channel('localhost:50056')
+        self.stub = SSE.ConnectorStub(self.channel)
+
+
+    def test_getcapabilities(self):
+        """
+        Test GetCapabilities FullScriptSupport using Pandas.
+
+        This test calls the GetCapabilities function for the
+        plugin and verifies some basic plugin properties.
+        """
+        capabilities = self.stub.GetCapabilities(SSE.Empty())
+
+        assert capabilities.allowScript is True
+        assert capabilities.pluginIdentifier == 'Full Script Support using Pandas- Qlik'
+        assert capabilities.pluginVersion == 'v1.0.0'
+
+    def test_evaluatescript(self):
+        """
+        Test EvaluateScript FullScriptSupport using Pandas.
+
+        This test calls the EvaluateScript function with the
+        script 'qResult = q.num1 + q.num2' over two rows of
+        two numbers, summarizing the numbers row wise.
+        """
+        params = to_numeric_parameters('num1', 'num2')
+
+        header = SSE.ScriptRequestHeader(script='qResult = q.num1 + q.num2',
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.NUMERIC,
+                                         params=params)
+
+        rows = duals_to_rows(numbers_to_duals(42, 42), numbers_to_duals(1, 2))
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [dual.numData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert values == [84, 3]
+
+    def test_evaluatescript_dual(self):
+        """
+        Test EvaluateScript FullScriptSupport using Pandas with dual parameters.
+
+        Each dual parameter is also available as separate
+        '_str' and '_num' columns in the data frame.
+        """
+        params = [SSE.Parameter(dataType=SSE.DUAL, name='first'), SSE.Parameter(dataType=SSE.DUAL, name='second')]
+
+        header = SSE.ScriptRequestHeader(script='qResult = q.first_str + q.second_num.astype(int).astype(str)',
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.STRING,
+                                         params=params)
+
+        rows = duals_to_rows([SSE.Dual(numData=1, strData='a'), SSE.Dual(numData=2, strData='b')],
+                             [SSE.Dual(numData=3, strData='c'), SSE.Dual(numData=4, strData='d')])
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [dual.strData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert values == ['a2', 'c4']
+
+    def test_evaluatescript_arrow(self):
+        """
+        Test EvaluateScript FullScriptSupport using Pandas with Arrow data.
+
+        A script with the comment '# qlik-data: arrow' receives its
+        parameters as a pyarrow.Table, 'q', and may return Arrow data.
+        """
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise SkipTest('pyarrow is not installed')
+        params = to_numeric_parameters('num1', 'num2')
+
+        script = "qResult = pyarrow.compute.add(q.column('num1'), q.column('num2'))  # qlik-data: arrow"
+        header = SSE.ScriptRequestHeader(script=script,
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.NUMERIC,
+                                         params=params)
+
+        rows = duals_to_rows(numbers_to_duals(42, 42), numbers_to_duals(1, 2))
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [dual.numData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert values == [84, 3]
+
+    def test_evaluatescript_polars(self):
+        """
+        Test EvaluateScript FullScriptSupport using Pandas with the polars engine.
+
+        A script with the comment '# qlik-engine: polars' receives its
+        parameters as a polars.DataFrame 'q'. The result of a group by
+        is returned as a table, described by a TableDescription.
+        """
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            raise SkipTest('polars is not installed')
+        params = [SSE.Parameter(dataType=SSE.STRING, name='key'), SSE.Parameter(dataType=SSE.NUMERIC, name='value')]
+
+        script = '\n'.join(['# qlik-engine: polars',
+                            "qResult = q.group_by('key').agg(polars.col('value').sum()).sort('key')",
+                            "table.fields.add(name='key', dataType=0)",
+                            "table.fields.add(name='total', dataType=1)",
+                            'tableDescription = True'])
+        header = SSE.ScriptRequestHeader(script=script,
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.NUMERIC,
+                                         params=params)
+
+        rows = duals_to_rows([SSE.Dual(strData='b'), SSE.Dual(numData=1)],
+                             [SSE.Dual(strData='a'), SSE.Dual(numData=2)],
+                             [SSE.Dual(strData='b'), SSE.Dual(numData=3)])
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        table = SSE.TableDescription.FromString(dict(result.initial_metadata())['qlik-tabledescription-bin'])
+        assert [field.name for field in table.fields] == ['key', 'total']
+        values = [(row.duals[0].strData, row.duals[1].numData) for bundled_row in result for row in bundled_row.rows]
+        assert values == [('a', 2), ('b', 4)]
+
+    def test_evaluatescript_polars_dual(self):
+        """
+        Test EvaluateScript FullScriptSupport using Pandas with the polars engine and a dual parameter.
+
+        A dual parameter is a struct column, also available as separate
+        '_num' and '_str' columns, and a struct result is returned as duals.
+        """
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            raise SkipTest('polars is not installed')
+        params = [SSE.Parameter(dataType=SSE.DUAL, name='first')]
+
+        header = SSE.ScriptRequestHeader(script="qResult = q['first'] if q['first_num'].sum() > 0 else None"
+                                                "  # qlik-engine: polars",
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.DUAL,
+                                         params=params)
+
+        rows = duals_to_rows([SSE.Dual(numData=1, strData='a')], [SSE.Dual(numData=2, strData='b')])
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=rows)),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [(dual.numData, dual.strData) for bundled_row in result for row in bundled_row.rows
+                  for dual in row.duals]
+        assert values == [(1, 'a'), (2, 'b')]
+
+    def test_evaluatescript_polars_large(self):
+        """
+        Test EvaluateScript FullScriptSupport using Pandas with the polars engine and a large result.
+
+        A result larger than the gRPC message size limit is sent in
+        several bundles, each below 1 MB.
+        """
+        try:
+            import polars  # noqa: F401
+        except ImportError:
+            raise SkipTest('polars is not installed')
+        params = to_numeric_parameters('value')
+
+        header = SSE.ScriptRequestHeader(script="qResult = polars.Series(['x' * 1000] * 5000)  # qlik-engine: polars",
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.STRING,
+                                         params=params)
+
+        # Trailing commas to make iterable sequences of tuples.
+        bundled_rows = (SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1)))),
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = list(self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata))
+
+        assert len(result) > 1
+        assert all(bundled_row.ByteSize() <= 1024 * 1024 for bundled_row in result)
+        assert sum(len(bundled_row.rows) for bundled_row in result) == 5000
@@ -15,6 +15,7 @@ from test.utils import duals_to_rows
 from test.utils import to_string_parameters
 
 HELLO_WORLD_ID = 0
+ECHO_TABLE_ID = 4
 
 
 class TestHelloWorld:
@@ -68,6 +69,23 @@ class TestHelloWorld:
                 for dual in row.duals:
                     assert dual.strData == 'Hello World!'
 
+
+    def test_executefunction_echo_table(self):
+        """
+        Test ExecuteFunction EchoTable_3.
+
+        The bundles are sent back as received, bundle by bundle.
+        """
+        header = SSE.FunctionRequestHeader(functionId=ECHO_TABLE_ID, version="1")
+        bundled_rows = [SSE.BundledRows(rows=duals_to_rows(strings_to_duals('a', 'b', 'c'),
+                                                           strings_to_duals('', 'åäö', 'x' * 200))),
+                        SSE.BundledRows(rows=duals_to_rows(strings_to_duals('d', 'e', 'f')))]
+        metadata = (('qlik-functionrequestheader-bin', header.SerializeToString()),)
+
+        result = self.stub.ExecuteFunction(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        assert list(result) == bundled_rows
+
     def test_evaluatescript(self):
         """
         Test EvaluateScript HelloWorld.
@@ -96,3 +114,76 @@ class TestHelloWorld:
             for row in bundled_row.rows:
                 for dual in row.duals:
                     assert dual.strData == 'HelloWorld'
+
+    def test_evaluatescript_repeated_values(self):
+        """
+        Test EvaluateScript HelloWorld with repeated values in several bundles.
+
+        The script is evaluated once per distinct pair of values, each row still gets its own result. The results
+        of both bundles are sent back in one bundle.
+        """
+        params = to_string_parameters('str1', 'str2')
+
+        header = SSE.ScriptRequestHeader(script='args[0] + args[1]',
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.STRING,
+                                         params=params)
+
+        pairs = [('a', 'x'), ('b', 'y'), ('a', 'x'), ('a', 'y'), ('b', 'y')]
+        bundled_rows = [SSE.BundledRows(rows=duals_to_rows(*[strings_to_duals(*pair) for pair in pairs[:3]])),
+                        SSE.BundledRows(rows=duals_to_rows(*[strings_to_duals(*pair) for pair in pairs[3:]]))]
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = list(self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata))
+
+        assert len(result) == 1
+        values = [dual.strData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert values == ['ax', 'by', 'ax', 'ay', 'by']
+
+    def test_evaluatescript_columns_fallback(self):
+        """
+        Test EvaluateScript HelloWorld with a script evaluated over whole columns.
+
+        The script with the comment '# qlik-eval: columns' fails over
+        the columns, a string method is not defined for an array, and is
+        then evaluated row by row.
+        """
+        params = to_string_parameters('str1')
+
+        header = SSE.ScriptRequestHeader(script='args[0].upper()  # qlik-eval: columns',
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.STRING,
+                                         params=params)
+
+        bundled_rows = [SSE.BundledRows(rows=duals_to_rows(strings_to_duals('a'), strings_to_duals('b'))),
+                        SSE.BundledRows(rows=duals_to_rows(strings_to_duals('c')))]
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        result = self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata)
+
+        values = [dual.strData for bundled_row in result for row in bundled_row.rows for dual in row.duals]
+        assert values == ['A', 'B', 'C']
+
+    def test_evaluatescript_not_a_string(self):
+        """
+        Test EvaluateScript HelloWorld with an elementwise script not returning strings.
+
+        The whole-column result is not converted to strings, the rows are
+        evaluated one by one and the number returned is reported as an error.
+        """
+        params = to_string_parameters('str1')
+
+        header = SSE.ScriptRequestHeader(script='len(args[0])',
+                                         functionType=SSE.TENSOR,
+                                         returnType=SSE.STRING,
+                                         params=params)
+
+        bundled_rows = [SSE.BundledRows(rows=duals_to_rows(strings_to_duals('ab'), strings_to_duals('c')))]
+        metadata = (('qlik-scriptrequestheader-bin', header.SerializeToString()), )
+
+        try:
+            list(self.stub.EvaluateScript(request_iterator=iter(bundled_rows), metadata=metadata))
+        except grpc.RpcError as e:
+            assert e.code() == grpc.StatusCode.UNKNOWN
+        else:
+            raise AssertionError('grpc.RpcError not raised')
@@ -0,0 +1,294 @@
+"""
+Unit tests of the metrics of the calls.
+"""
+import os
+import sys
+import threading
+from urllib.request import urlopen
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import grpc
+import ServerSideExtension_pb2 as SSE
+from ssecommon.accounting import Accounting, QuotaExceeded, Quotas
+from ssecommon.columnar import decode_bundle
+from ssecommon.metrics import Histogram, Metrics, combine
+from test.utils import duals_to_rows, function_context, numbers_to_duals
+
+
+class _Servicer:
+    def ExecuteFunction(self, request_iterator, context):
+        for bundled_rows in request_iterator:
+            if not bundled_rows.rows:
+                raise ValueError('Empty bundle')
+            yield bundled_rows
+
+
+class _DecodingServicer:
+    def ExecuteFunction(self, request_iterator, context):
+        bundles = list(request_iterator)
+        # Only the values of the first bundle are decoded
+        yield SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(*decode_bundle(bundles[0], [SSE.NUMERIC])[0])))
+
+
+class _SharedServicer:
+    def __init__(self, response):
+        self.response = response
+
+    def ExecuteFunction(self, request_iterator, context):
+        yield self.response
+
+
+class TestMetrics:
+    """
+    Tests of the Metrics recorded by an InstrumentedServicer.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.metrics = Metrics()
+        self.servicer = self.metrics.instrument(_Servicer())
+
+    def test_histogram(self):
+        """
+        Observations are counted in the bucket of the smallest upper bound not less than the value.
+        """
+        histogram = Histogram(buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 3):
+            histogram.observe(value)
+
+        assert histogram.cumulative_counts() == [(1, 2), (2, 3), (float('inf'), 4)]
+        assert histogram.sum == 6
+        assert histogram.count == 4
+
+    def test_counters(self):
+        """
+        Bundles, rows and bytes are counted per function, the messages are serialized by the registered
+        serializer.
+        """
+        bundles = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1), numbers_to_duals(2))),
+                   SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(3)))]
+        serialized = [bundle.SerializeToString() for bundle in bundles]
+        request = (self.metrics.deserialize(data) for data in serialized)
+
+        for response in self.servicer.ExecuteFunction(request, function_context(7)):
+            self.metrics.serialize(response)
+
+        stats = self.metrics.stats('ExecuteFunction', '7')
+        assert (stats.calls, stats.errors) == (1, 0)
+        assert (stats.bundles_in, stats.rows_in, stats.bytes_in) == (2, 3, sum(map(len, serialized)))
+        assert (stats.bundles_out, stats.rows_out, stats.bytes_out) == (2, 3, sum(map(len, serialized)))
+        assert stats.decode.count == stats.encode.count == 2
+        assert stats.compute.count == stats.duration.count == 1
+
+    def test_decode(self):
+        """
+        The time decoding the values of a received bundle is recorded when the plugin decodes them.
+        """
+        bundles = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1), numbers_to_duals(2)))] * 2
+        request = (self.metrics.deserialize(bundle.SerializeToString()) for bundle in bundles)
+        servicer = self.metrics.instrument(_DecodingServicer())
+
+        list(servicer.ExecuteFunction(request, function_context(8)))
+
+        stats = self.metrics.stats('ExecuteFunction', '8')
+        assert stats.bundles_in == 2
+        assert stats.decode.count == 1 and stats.decode.sum > 0
+
+    def test_shared_response(self):
+        """
+        The same message sent by concurrent calls, e.g. a cached result, is counted in the bytes of each call.
+        """
+        shared = SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1)))
+        servicer = self.metrics.instrument(_SharedServicer(shared))
+        first = servicer.ExecuteFunction(iter([]), function_context(5))
+        second = servicer.ExecuteFunction(iter([]), function_context(6))
+
+        sent = [next(first), next(second)]
+        for response in reversed(sent):
+            self.metrics.serialize(response)
+
+        for function in ('5', '6'):
+            stats = self.metrics.stats('ExecuteFunction', function)
+            assert (stats.bundles_out, stats.bytes_out) == (1, shared.ByteSize())
+
+    def test_queue_depth(self):
+        """
+        The tasks waiting for a thread of the executor are counted.
+        """
+        executor = self.metrics.create_executor(1)
+        started, release = threading.Event(), threading.Event()
+        try:
+            executor.submit(lambda: started.set() or release.wait(10))
+            started.wait(10)
+            waiting = executor.submit(lambda: None)
+            assert self.metrics.queue_depth() == 1
+            release.set()
+            waiting.result(10)
+            assert self.metrics.queue_depth() == 0
+        finally:
+            release.set()
+            executor.shutdown()
+
+    def test_errors(self):
+        """
+        A call ended by an exception is counted as an error.
+        """
+        try:
+            list(self.servicer.ExecuteFunction(iter([SSE.BundledRows()]), function_context(1)))
+        except ValueError:
+            pass
+
+        stats = self.metrics.stats('ExecuteFunction', '1')
+        assert (stats.calls, stats.errors) == (1, 1)
+
+    def test_http_endpoint(self):
+        """
+        The metrics are served in the Prometheus text format.
+        """
+        list(self.servicer.ExecuteFunction(iter(duals_to_rows()), function_context(2)))
+        server = self.metrics.start_http_server(0, 'localhost')
+        try:
+            with urlopen('http://localhost:{}/metrics'.format(server.server_address[1])) as response:
+                text = response.read().decode('utf-8')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        assert '# TYPE sse_calls_total counter' in text
+        assert 'sse_calls_total{method="ExecuteFunction",function="2"} 1' in text
+        assert 'sse_duration_seconds_bucket{method="ExecuteFunction",function="2",le="+Inf"} 1' in text
+        assert 'sse_in_flight_streams 0' in text
+
+    def test_combine(self):
+        """
+        The metrics of several processes are summed per sample, the samples of a metric kept together.
+        """
+        list(self.servicer.ExecuteFunction(iter(duals_to_rows()), function_context(2)))
+        other = Metrics()
+        other_servicer = other.instrument(_Servicer())
+        list(other_servicer.ExecuteFunction(iter(duals_to_rows()), function_context(2)))
+        list(other_servicer.ExecuteFunction(iter(duals_to_rows()), function_context(3)))
+
+        lines = combine([self.metrics.render(), other.render()]).splitlines()
+
+        assert 'sse_calls_total{method="ExecuteFunction",function="2"} 2' in lines
+        assert 'sse_calls_total{method="ExecuteFunction",function="3"} 1' in lines
+        assert 'sse_duration_seconds_count{method="ExecuteFunction",function="2"} 2' in lines
+        assert lines.count('# TYPE sse_calls_total counter') == 1
+        calls = [i for i, line in enumerate(lines) if line.startswith('sse_calls_total')]
+        assert calls == list(range(calls[0], calls[0] + 2))
+
+        peak = '# TYPE sse_app_peak_request_bytes gauge\nsse_app_peak_request_bytes{{app="a",user=""}} {}\n'
+        assert 'sse_app_peak_request_bytes{app="a",user=""} 30' in combine([peak.format(30), peak.format(20)])
+
+
+class TestAccounting:
+    """
+    Tests of the resources recorded per app and user, and of the quotas of the apps.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.metrics = Metrics(quotas=Quotas(max_calls=1))
+        self.servicer = self.metrics.instrument(_Servicer())
+
+    def test_usage(self):
+        """
+        Calls, rows and bytes are recorded per app and user, from the CommonRequestHeader.
+        """
+        bundles = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1), numbers_to_duals(2)))]
+        serialized = [bundle.SerializeToString() for bundle in bundles]
+        request = (self.metrics.deserialize(data) for data in serialized)
+        list(self.servicer.ExecuteFunction(request, function_context(1, 'app.qvf', 'UserDirectory=A; UserId=b')))
+        context = function_context(1, 'app.qvf', 'UserDirectory=A; UserId=c')
+        list(self.servicer.ExecuteFunction(iter(duals_to_rows()), context))
+
+        usage = self.metrics.accounting.usage('app.qvf', 'UserDirectory=A; UserId=b')
+        assert (usage.calls, usage.rejected, usage.rows_in, usage.rows_out) == (1, 0, 2, 2)
+        assert usage.peak_bytes_in == sum(map(len, serialized))
+        assert usage.wall_seconds > 0
+        assert self.metrics.accounting.usage('app.qvf', 'UserDirectory=A; UserId=c').calls == 1
+        assert 'sse_app_calls_total{app="app.qvf",user="UserDirectory=A; UserId=c"} 1' in self.metrics.render()
+
+    def test_max_calls(self):
+        """
+        A call of an app with as many calls in progress as its quota is rejected, the calls of other apps are not.
+        """
+        bundles = [SSE.BundledRows(rows=duals_to_rows(numbers_to_duals(1)))]
+        first = self.servicer.ExecuteFunction(iter(bundles), function_context(1, 'busy'))
+        next(first)
+        context = function_context(1, 'busy')
+        try:
+            list(self.servicer.ExecuteFunction(iter(duals_to_rows()), context))
+            assert False, 'The call over the quota was not rejected'
+        except grpc.RpcError:
+            pass
+        assert context.code == grpc.StatusCode.RESOURCE_EXHAUSTED
+        list(self.servicer.ExecuteFunction(iter(duals_to_rows()), function_context(1, 'other')))
+        list(first)
+        list(self.servicer.ExecuteFunction(iter(duals_to_rows()), function_context(1, 'busy')))
+
+        usage = self.metrics.accounting.usage('busy', '')
+        assert (usage.calls, usage.rejected) == (2, 1)
+        assert self.metrics.stats('ExecuteFunction', '1').errors == 1
+
+    def test_cpu_quota(self):
+        """
+        The calls of an app are rejected once it used its CPU seconds within the window.
+        """
+        accounting = Accounting(Quotas(cpu_seconds=1.0, window=60.0))
+        account = accounting.start('app', 'user')
+        account.add_cpu(1.5)
+        account.finish(2.0, 0, 0, 0)
+        try:
+            accounting.start('app', 'other user')
+            assert False, 'The call over the quota was not rejected'
+        except QuotaExceeded:
+            pass
+        accounting.start('other app', 'user')
+
+        # The CPU seconds leave the window
+        accounting._cpu['app'].window = -1.0
+        accounting.start('app', 'user')
+        assert accounting.usage('app', 'other user').rejected == 1
+
+    def test_expire(self):
+        """
+        The usage of the least recently used users beyond the maximum, and of idle users, is forgotten. The CPU
+        seconds of an app are only kept within the window of a CPU quota.
+        """
+        accounting = Accounting(max_entries=2)
+        for user in ('a', 'b', 'a', 'c'):
+            accounting.start('app', user).finish(1.0, 0, 0, 0)
+
+        assert len(accounting) == 2
+        assert accounting.usage('app', 'a').calls == 2
+        assert accounting.usage('app', 'b').calls == 0
+        assert not accounting._in_flight
+
+        account = accounting.start('app', 'd')
+        account.add_cpu(1.0)
+        assert not accounting._cpu
+
+        accounting.idle_seconds = -1.0
+        accounting.start('other app', 'user')
+        assert len(accounting) == 1
+        # The call in progress is still recorded when it ends
+        account.finish(1.0, 0, 0, 0)
+        assert accounting.usage('app', 'd').wall_seconds == 1.0
+
+    def test_escape(self):
+        """
+        Label values are escaped in the Prometheus text format.
+        """
+        accounting = Accounting()
+        accounting.start('C:\\Apps\\"a".qvw', 'user').finish(0.0, 0, 0, 0)
+
+        assert 'sse_app_calls_total{app="C:\\\\Apps\\\\\\"a\\".qvw",user="user"} 1' in accounting.render()
@@ -0,0 +1,79 @@
+"""
+Unit tests of the process pool evaluating scripts.
+"""
+import os
+
+import numpy
+from ssecommon.columnar import DualColumn, spilled_array
+from ssecommon.processpool import ScriptProcessPool
+
+
+def _describe(columns, factor):
+    """
+    Runs in the worker process.
+    """
+    numbers, strings, dual = columns
+    return numbers * factor, '|'.join(strings), dual.strings.tolist(), os.getpid()
+
+
+def _mapped(columns):
+    """
+    Runs in the worker process.
+    """
+    types = tuple(type(column.numbers if isinstance(column, DualColumn) else column).__name__ for column in columns)
+    return types + (columns[0].sum(),)
+
+
+class TestScriptProcessPool:
+    """
+    Tests of the ScriptProcessPool.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.pool = ScriptProcessPool(processes=1)
+
+    def tearDown(self):
+        """
+        Test teardown.
+        """
+        self.pool.close()
+
+    def test_run(self):
+        """
+        Columns are passed to and numerical arrays returned from the worker process.
+        """
+        columns = [numpy.array([1.0, 2.0]),
+                   numpy.array(['a', 'é'], dtype=object),
+                   DualColumn(numpy.array([3.0]), numpy.array(['x'], dtype=object))]
+
+        numbers, joined, dual_strings, pid = self.pool.run(_describe, columns, 10)
+
+        assert numbers.tolist() == [10.0, 20.0]
+        assert joined == 'a|é'
+        assert dual_strings == ['x']
+        assert pid != os.getpid()
+
+    def test_spilled(self):
+        """
+        Memory-mapped columns are mapped by the worker process as well, not copied to shared memory.
+        """
+        numbers = spilled_array(3)
+        numbers[:] = [1.0, 2.0, 3.0]
+        dual = DualColumn(spilled_array(1), numpy.array(['x'], dtype=object))
+
+        assert self.pool.run(_mapped, [numbers, dual, numpy.array([1.0])]) == ('memmap', 'memmap', 'ndarray', 6.0)
+        assert self.pool.run(_mapped, [spilled_array(0)])[0] == 'ndarray'
+
+    def test_exception(self):
+        """
+        Exceptions raised in the worker process are raised to the caller.
+        """
+        try:
+            self.pool.run(_describe, [], 1)
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
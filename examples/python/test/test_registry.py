@@ -0,0 +1,111 @@
+"""
+Unit tests of the functions registered with the function decorator.
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.capabilities import CapabilitiesCache
+from ssecommon.registry import FunctionRegistry
+from test.utils import Context, numbers_to_bundle, to_messages
+
+
+class TestRegistry:
+    """
+    Tests of the FunctionRegistry.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.registry = FunctionRegistry()
+        self.calls = []
+
+        @self.registry.function('Difference', SSE.TENSOR, {'b': SSE.NUMERIC, 'a': SSE.NUMERIC}, SSE.NUMERIC)
+        def difference(a, b):
+            self.calls.append(len(a))
+            return a - b
+
+        @self.registry.function('Total', SSE.AGGREGATION, {'x': SSE.NUMERIC}, SSE.STRING)
+        def total(x):
+            return 'total {:g}'.format(x.sum())
+
+        @self.registry.function('Double', SSE.SCALAR, {'x': SSE.NUMERIC}, SSE.DUAL, function_id=5)
+        def double(x):
+            return x * 2, ['x{:g}'.format(value) for value in x]
+
+        self.functions = self.registry.implementations()
+
+    def test_definitions(self):
+        """
+        The definitions are generated in the format of functions.json, with the next free id by default.
+        """
+        assert self.registry.definitions() == [
+            {'Id': 0, 'Name': 'Difference', 'Type': SSE.TENSOR, 'ReturnType': SSE.NUMERIC,
+             'Params': {'a': SSE.NUMERIC, 'b': SSE.NUMERIC}},
+            {'Id': 1, 'Name': 'Total', 'Type': SSE.AGGREGATION, 'ReturnType': SSE.STRING,
+             'Params': {'x': SSE.NUMERIC}},
+            {'Id': 5, 'Name': 'Double', 'Type': SSE.SCALAR, 'ReturnType': SSE.DUAL, 'Params': {'x': SSE.NUMERIC}},
+        ]
+
+        try:
+            self.registry.function('Again', SSE.SCALAR, {}, SSE.NUMERIC, function_id=5)(lambda: 0)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError not raised for a duplicated id')
+
+    def test_columns_by_name(self):
+        """
+        A tensor function is called once with whole columns, passed by parameter name in the order Qlik sends them.
+        """
+        request = [numbers_to_bundle((1, 10), (2, 20)), numbers_to_bundle((3, 30))]
+        response = to_messages(self.functions[0](iter(request), Context()))
+
+        assert self.calls == [3]
+        assert [d.numData for bundle in response for row in bundle.rows for d in row.duals] == [-9, -18, -27]
+
+    def test_aggregation_and_scalar(self):
+        """
+        An aggregation returns one row, a scalar function is called per bundle and may return duals.
+        """
+        request = [numbers_to_bundle((1,), (2,)), numbers_to_bundle((3,))]
+        response = to_messages(self.functions[1](iter(request), Context()))
+        assert [row.duals[0].strData for bundle in response for row in bundle.rows] == ['total 6']
+
+        response = to_messages(self.functions[5](iter(request), Context()))
+        assert len(response) == 2
+        assert [(d.numData, d.strData) for bundle in response for row in bundle.rows for d in row.duals] == \
+            [(2, 'x1'), (4, 'x2'), (6, 'x3')]
+
+    def test_capabilities(self):
+        """
+        The registered functions are added to those of the function definitions file, an id defined in both is
+        an error.
+        """
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'functions.json')
+            definition = {'Id': 2, 'Name': 'FromFile', 'Type': SSE.TENSOR, 'ReturnType': SSE.STRING, 'Params': {}}
+            with open(path, 'w') as f:
+                json.dump({'Functions': [definition]}, f)
+
+            cache = CapabilitiesCache(path, {2: 'from file'}, 'test', 'v1', registry=self.registry)
+            assert [f.name for f in cache.capabilities.functions] == ['FromFile', 'Difference', 'Total', 'Double']
+            assert cache.get_function(2) == 'from file'
+            assert cache.get_function(5) is self.functions[5]
+
+            definition['Id'] = 1
+            with open(path, 'w') as f:
+                json.dump({'Functions': [definition]}, f)
+            assert not cache.reload()
+        finally:
+            shutil.rmtree(folder)
@@ -0,0 +1,82 @@
+"""
+Unit tests of the script result cache.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import numpy
+import ServerSideExtension_pb2 as SSE
+from ssecommon.resultcache import ResultCache, is_no_store, script_request_key
+from test.utils import to_numeric_parameters
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache:
+    """
+    Tests of the ResultCache and its keys.
+    """
+
+    def test_byte_budget(self):
+        """
+        The least recently used entries are evicted when the budget is exceeded.
+        """
+        cache = ResultCache(max_bytes=100)
+        cache.put('a', 'A', 60)
+        cache.put('b', 'B', 30)
+        assert cache.get('a') == 'A'
+        cache.put('c', 'C', 30)
+
+        assert cache.get('b') is None
+        assert cache.get('a') == 'A'
+        cache.put('d', 'D', 101)
+        assert cache.get('d') is None
+        assert cache.stats()['evictions'] == 1
+
+    def test_ttl(self):
+        """
+        Entries expire after the time to live.
+        """
+        clock = _Clock()
+        cache = ResultCache(ttl=10, clock=clock)
+        cache.put('a', 'A', 1)
+        clock.now = 9
+        assert cache.get('a') == 'A'
+        clock.now = 10
+        assert cache.get('a') is None
+
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['expirations'], stats['bytes']) == (1, 1, 1, 0)
+        assert stats['hit_rate'] == 0.5
+
+    def test_request_key(self):
+        """
+        The key depends on the script, the types and the data.
+        """
+        header = SSE.ScriptRequestHeader(script='sum(args[0])', functionType=SSE.AGGREGATION,
+                                         returnType=SSE.NUMERIC, params=to_numeric_parameters('a'))
+        key = script_request_key(header, [numpy.array([1.0, 2.0])])
+
+        assert script_request_key(header, [numpy.array([1.0, 2.0])]) == key
+        assert script_request_key(header, [numpy.array([1.0, 3.0])]) != key
+        assert script_request_key(header, [numpy.array(['ab', 'c'], dtype=object)]) != \
+            script_request_key(header, [numpy.array(['a', 'bc'], dtype=object)])
+        header.returnType = SSE.STRING
+        assert script_request_key(header, [numpy.array([1.0, 2.0])]) != key
+
+    def test_no_store(self):
+        """
+        Caching is disabled by a comment in the script.
+        """
+        assert is_no_store('sum(args[0])  # qlik-cache: no-store')
+        assert not is_no_store('sum(args[0])')
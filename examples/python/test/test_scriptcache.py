@@ -0,0 +1,50 @@
+"""
+Unit tests of the compiled script cache.
+"""
+from ssecommon.scriptcache import CompiledScriptCache
+
+
+class TestCompiledScriptCache:
+    """
+    Tests of the CompiledScriptCache.
+    """
+
+    def test_hits_and_misses(self):
+        """
+        A script is compiled once per mode.
+        """
+        cache = CompiledScriptCache()
+        code = cache.get('args[0] + args[1]')
+
+        assert cache.get('args[0] + args[1]') is code
+        assert eval(code, {'args': [1, 2]}) == 3
+        cache.get('qResult = 1', 'exec')
+        assert cache.stats() == {'size': 2, 'hits': 1, 'misses': 2, 'evictions': 0}
+
+    def test_evicts_least_recently_used(self):
+        """
+        The least recently used script is evicted when the cache is full.
+        """
+        cache = CompiledScriptCache(max_size=2)
+        first = cache.get('1')
+        cache.get('2')
+        cache.get('1')
+        cache.get('3')
+
+        assert cache.evictions == 1
+        assert cache.get('1') is first
+        assert cache.stats()['misses'] == 3
+
+    def test_syntax_error_is_not_cached(self):
+        """
+        Invalid scripts raise SyntaxError, as with eval.
+        """
+        cache = CompiledScriptCache()
+        for _ in range(2):
+            try:
+                cache.get('args[')
+            except SyntaxError:
+                pass
+            else:
+                assert False, 'SyntaxError not raised'
+        assert len(cache) == 0
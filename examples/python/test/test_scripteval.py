@@ -0,0 +1,62 @@
+"""
+Unit tests of the evaluation of full scripts.
+"""
+import os
+import sys
+
+# Add Generated folder, and the folder of the plugin, to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+sys.path.append(os.path.join(PARENT_DIR, 'fullscriptsupport'))
+
+import ServerSideExtension_pb2 as SSE
+from fullscriptsupport.scripteval import ScriptEval
+from ssecommon.columnar import decode, is_spilled
+from test.utils import duals_to_rows, numbers_to_duals, to_messages, to_numeric_parameters
+
+
+def _header(script):
+    return SSE.ScriptRequestHeader(script=script, functionType=SSE.TENSOR, returnType=SSE.STRING,
+                                   params=to_numeric_parameters('num'))
+
+
+class TestScriptEval:
+    """
+    Tests of the ScriptEval of the full script plugin.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.script_eval = ScriptEval()
+        # 8 rows of numbers, 64 bytes, fit in the budget; 9 rows do not
+        self.request = [SSE.BundledRows(rows=duals_to_rows(*(numbers_to_duals(i) for i in range(9))))]
+
+    def _evaluate(self, script, memory_budget):
+        plan = self.script_eval.build_plan(_header(script))
+        columns = decode(self.request, plan.data_types, memory_budget=memory_budget)
+        assert is_spilled(columns[0]) == (memory_budget is not None)
+        bundles = to_messages(self.script_eval.evaluate(plan, columns))
+        return [dual.strData for bundle in bundles for row in bundle.rows for dual in row.duals]
+
+    def test_memory_budget(self):
+        """
+        A script receives lists whether or not its parameters are above the memory budget.
+        """
+        script = '[type(args[0]).__name__, str(args[0] + [9.0])]'
+
+        below = self._evaluate(script, None)
+        above = self._evaluate(script, 64)
+
+        assert below == above
+        assert below[0] == 'list'
+
+    def test_numpy_data(self):
+        """
+        A script with the comment '# qlik-data: numpy' receives float64 arrays, memory-mapped above the budget.
+        """
+        script = '[type(args[0]).__name__, str(args[0].sum())] # qlik-data: numpy'
+
+        assert self._evaluate(script, None) == ['ndarray', '36.0']
+        assert self._evaluate(script, 64) == ['memmap', '36.0']
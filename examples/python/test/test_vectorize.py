@@ -0,0 +1,70 @@
+"""
+Unit tests of the whole-column evaluation of elementwise scripts.
+"""
+import numpy
+
+from ssecommon.vectorize import vectorize
+
+
+def _rows(*columns):
+    return [numpy.array(column, dtype=object) for column in columns]
+
+
+class TestVectorize:
+    """
+    Tests of the vectorize function.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.columns = _rows(['ab', 'cd', 'ab'], ['x', 'y', 'z'])
+
+    def test_same_result_as_row_wise(self):
+        """
+        An elementwise script gives the same result over whole columns as evaluated for each row.
+        """
+        scripts = ["args[0] + ' ' + args[1].upper()", "'{}: {}'.format(args[0], args[1])",
+                   "'%s-%s' % (args[0], args[1])", "f'{args[0]!r:>6}|{args[1]}'", 'args[0][0] * 3 + args[1][1:]',
+                   'str(len(args[0] + args[1]))', "', '.join(args[0])", "'constant'"]
+        for script in scripts:
+            evaluate = vectorize(script)
+            assert evaluate is not None, script
+            expected = [eval(script, {'args': list(row)}) for row in zip(*self.columns)]
+            assert list(evaluate(self.columns)) == expected, script
+
+    def test_row_wise_scripts(self):
+        """
+        Scripts that are not known to be elementwise are evaluated row by row.
+        """
+        for script in ['[a for a in args]', "args[0] if args[1] else ''", 'args[i]', 'args[-1]', 'len(args)',
+                       "' '.join([args[0], args[1]])", 'open(args[0])', 'args[0].upper', 'args[']:
+            assert vectorize(script) is None, script
+
+    def test_errors(self):
+        """
+        The error of a row is raised, as is a result without one value per row.
+        """
+        try:
+            vectorize('args[0] + 1')(self.columns)
+        except TypeError:
+            pass
+        else:
+            raise AssertionError('TypeError not raised')
+
+        evaluate = vectorize('args[0][:2]  # qlik-eval: columns')
+        try:
+            evaluate(self.columns)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('ValueError not raised')
+
+    def test_columns_directive(self):
+        """
+        A script with the comment '# qlik-eval: columns' is evaluated once with the whole columns.
+        """
+        evaluate = vectorize("numpy.char.add(args[0].astype(str), args[1].astype(str))  # qlik-eval: columns")
+
+        assert list(evaluate(self.columns)) == ['abx', 'cdy', 'abz']
@@ -0,0 +1,187 @@
+"""
+Unit tests of the direct encoding and decoding of BundledRows messages.
+"""
+import os
+import sys
+
+# Add Generated folder to module path.
+PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(PARENT_DIR, 'generated'))
+
+import struct
+
+import numpy
+
+import ServerSideExtension_pb2 as SSE
+from ssecommon.columnar import DualColumn, decode_bundle, decode_numeric_bundle, encode_bundle
+from ssecommon.wire import ReceivedRows, row_count, serialize_columns, serialize_response
+
+
+def _strings(*values):
+    return numpy.array(values, dtype=object)
+
+
+class TestWire:
+    """
+    Tests of the serialize_columns function.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.numbers = numpy.array([1.5, 0.0, -2.0, float('nan'), float('inf'), 1e300, 0.0])
+        self.strings = _strings('a', '', 'åäö', 'x' * 300, '', '☃', 'b')
+
+    def assert_same_bytes(self, columns):
+        """
+        Asserts that the columns are serialized to the same bytes as by protobuf.
+        """
+        serialized = serialize_columns(columns)
+
+        assert serialized.SerializeToString() == encode_bundle(columns).SerializeToString()
+        assert serialized.ByteSize() == encode_bundle(columns).ByteSize()
+
+    def test_same_bytes_as_protobuf(self):
+        """
+        Numerical, string and dual columns are serialized byte for byte as by protobuf, including the values that are
+        not written, zeros and empty strings, and varint lengths of several bytes.
+        """
+        self.assert_same_bytes([self.numbers])
+        self.assert_same_bytes([self.numbers, self.numbers[::-1], numpy.arange(7)])
+        self.assert_same_bytes([self.strings])
+        self.assert_same_bytes([self.strings, self.numbers])
+        self.assert_same_bytes([DualColumn(self.numbers, self.strings), self.strings])
+        self.assert_same_bytes([numpy.zeros(3)])
+        self.assert_same_bytes([numpy.ones(2)] * 20)
+        self.assert_same_bytes([numpy.ones(2)] * 2000)
+        self.assert_same_bytes([numpy.zeros(0)])
+        self.assert_same_bytes([_strings()])
+        self.assert_same_bytes([])
+
+    def test_round_trip(self):
+        """
+        The serialized bundle is decoded to the same columns.
+        """
+        columns = [self.numbers, self.strings, DualColumn(self.numbers, self.strings)]
+        decoded = decode_bundle(serialize_columns(columns).parse(), [SSE.NUMERIC, SSE.STRING, SSE.DUAL])
+
+        numpy.testing.assert_array_equal(decoded[0], self.numbers)
+        assert decoded[1].tolist() == self.strings.tolist()
+        numpy.testing.assert_array_equal(decoded[2].numbers, self.numbers)
+        assert decoded[2].strings.tolist() == self.strings.tolist()
+
+        # A negative zero is written, as by the C++ implementation of protobuf, so that its sign is kept
+        assert serialize_columns([numpy.array([-0.0])]).data == b'\x0a\x0b\x0a\x09\x09' + struct.pack('<d', -0.0)
+
+    def test_serialize_response(self):
+        """
+        The response serializer sends a serialized bundle as is, and serializes a message.
+        """
+        serialized = serialize_columns([self.numbers])
+        message = encode_bundle([self.numbers])
+
+        assert serialize_response(serialized) is serialized.data
+        assert serialize_response(message) == serialized.data
+
+    def test_row_count(self):
+        """
+        The number of rows of a serialized bundle is known without parsing it.
+        """
+        assert row_count(serialize_columns([self.numbers])) == 7
+        assert row_count(serialize_columns([self.strings, self.numbers])) == 7
+        assert row_count(serialize_columns([])) == 0
+        assert row_count(encode_bundle([self.strings])) == 7
+
+
+class TestReceivedRows:
+    """
+    Tests of decoding a received bundle from the wire format.
+    """
+
+    def setUp(self):
+        """
+        Test setup.
+        """
+        self.numbers = numpy.array([1.5, 0.0, -2.0, float('inf'), 1e300, -0.0])
+        self.strings = _strings('a', '', 'åäö', 'x' * 300, '', '☃')
+
+    def assert_same_columns(self, columns, data_types):
+        """
+        Asserts that the serialized columns are decoded to the same columns as from the message parsed by protobuf.
+        """
+        data = encode_bundle(columns).SerializeToString()
+        decoded = decode_bundle(ReceivedRows(data), data_types)
+        expected = decode_bundle(SSE.BundledRows.FromString(data), data_types)
+
+        assert len(decoded) == len(expected)
+        for column, expected_column in zip(decoded, expected):
+            if isinstance(expected_column, DualColumn):
+                numpy.testing.assert_array_equal(column.numbers, expected_column.numbers)
+                assert column.strings.tolist() == expected_column.strings.tolist()
+            else:
+                assert column.dtype == expected_column.dtype
+                numpy.testing.assert_array_equal(column, expected_column)
+
+    def test_same_columns_as_protobuf(self):
+        """
+        Numerical, string and dual columns are decoded as from the parsed message, including the values that are not
+        written and lengths of several bytes.
+        """
+        self.assert_same_columns([self.numbers], [SSE.NUMERIC])
+        self.assert_same_columns([self.strings, self.numbers], [SSE.STRING, SSE.NUMERIC])
+        self.assert_same_columns([DualColumn(self.numbers, self.strings)], [SSE.DUAL])
+        self.assert_same_columns([self.strings], [SSE.DUAL])
+        self.assert_same_columns([numpy.ones(3)] * 20, [SSE.NUMERIC] * 20)
+        self.assert_same_columns([numpy.zeros(0)], [SSE.NUMERIC])
+
+    def test_numbers(self):
+        """
+        Numerical bundles are decoded into a matrix, with and without zeros, and rows of different length rejected.
+        """
+        matrix = numpy.arange(1.0, 13.0).reshape(4, 3)
+        for values in (matrix, matrix - 6):
+            data = serialize_columns(list(values.T)).data
+            decoded = decode_numeric_bundle(ReceivedRows(data))
+            numpy.testing.assert_array_equal(decoded, values)
+            assert decoded.dtype == numpy.float64 and decoded.flags.writeable
+
+        assert decode_numeric_bundle(ReceivedRows(b'')).shape == (0, 0)
+        for sizes in ((1, 2), (1, 3)):
+            uneven = SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(numData=1)] * n) for n in sizes])
+            for bundled_rows in (ReceivedRows(uneven.SerializeToString()), uneven):
+                try:
+                    decode_numeric_bundle(bundled_rows)
+                    assert False, 'Rows of different length must be rejected'
+                except ValueError:
+                    pass
+
+    def test_invalid_messages(self):
+        """
+        A truncated message, or a bundle with another number of values per row, raises ValueError, also if the total
+        number of values is right.
+        """
+        data = serialize_columns([self.strings, self.numbers]).data
+        uneven = SSE.BundledRows(rows=[SSE.Row(duals=[SSE.Dual(numData=1, strData='a')] * n) for n in (1, 3)])
+        for bundled_rows, data_types in ((ReceivedRows(data[:-3]), [SSE.STRING, SSE.NUMERIC]),
+                                         (ReceivedRows(data), [SSE.STRING]),
+                                         (ReceivedRows(uneven.SerializeToString()), [SSE.NUMERIC, SSE.NUMERIC]),
+                                         (ReceivedRows(uneven.SerializeToString()), [SSE.DUAL, SSE.STRING]),
+                                         (uneven, [SSE.NUMERIC, SSE.NUMERIC])):
+            try:
+                decode_bundle(bundled_rows, data_types)
+                assert False, 'The bundle must be rejected'
+            except ValueError:
+                pass
+
+    def test_rows(self):
+        """
+        The rows are counted without parsing the message, and parsed once when read.
+        """
+        data = serialize_columns([self.strings, self.numbers]).data
+        received = ReceivedRows(data)
+
+        assert row_count(received) == 6
+        assert received.SerializeToString() is data
+        assert received.rows is received.rows
+        assert received.parse() == SSE.BundledRows.FromString(data)
@@ -9,6 +9,7 @@ PARENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.join(PARENT_DIR, 'Generated'))
 
 import ServerSideExtension_pb2 as SSE
+from ssecommon.wire import SerializedRows
 
 def to_string_parameters(*args):
     """
@@ -52,3 +53,57 @@ def duals_to_rows(*args):
 
     return rows
 
+def to_messages(bundles):
+    """
+    Parses the serialized bundles of a response, see ssecommon.wire, to a list of BundledRows.
+    """
+    messages = [b.parse() if isinstance(b, SerializedRows) else b for b in bundles]
+
+    return messages
+
+
+def duals_to_bundle(*args):
+    """
+    Converts a number of lists of duals, one per row, to a BundledRows.
+    """
+    bundle = SSE.BundledRows(rows=duals_to_rows(*args))
+
+    return bundle
+
+def numbers_to_bundle(*args):
+    """
+    Converts a number of tuples of numbers, one per row, to a BundledRows.
+    """
+    bundle = duals_to_bundle(*[numbers_to_duals(*row) for row in args])
+
+    return bundle
+
+class Context:
+    """
+    The part of a grpc.ServicerContext used by the plugins, with the metadata sent from Qlik.
+    """
+
+    def __init__(self, *metadata):
+        self.metadata = metadata
+        self.code = None
+        self.details = None
+
+    def invocation_metadata(self):
+        return self.metadata
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+def function_context(function_id, app_id='', user_id=''):
+    """
+    Creates the Context of an ExecuteFunction call, with the function and common request headers.
+    """
+    header = SSE.FunctionRequestHeader(functionId=function_id)
+    common_header = SSE.CommonRequestHeader(appId=app_id, userId=user_id)
+    context = Context(('qlik-functionrequestheader-bin', header.SerializeToString()),
+                      ('qlik-commonrequestheader-bin', common_header.SerializeToString()))
+
+    return context